@@ -18,6 +18,8 @@ from scapy.all import (
     getmacbyip
 )
 
+from src.clock import SYSTEM_CLOCK
+
 # Intentamos importar 'rich', si no está, damos instrucciones claras.
 try:
     from rich.console import Console
@@ -44,9 +46,11 @@ class DHCPClientSimulator:
     Maneja su propio estado (IP, lease, etc.) y construye/envía paquetes.
     """
 
-    def __init__(self, interface: str, console: Console):
+    def __init__(self, interface: str, console: Console, clock=None):
         self.interface = interface
         self.console = console
+        # Reloj de las marcas de concesión (ver src/clock.py); uno virtual permite adelantar el tiempo
+        self.clock = clock or SYSTEM_CLOCK
         self.mac = FAKE_MAC
         self.xid = 0
         self.reset_state()
@@ -184,7 +188,7 @@ class DHCPClientSimulator:
         msg_type = next((opt[1] for opt in ack_pkt[DHCP].options if isinstance(opt, tuple) and opt[0] == 'message-type'), None)
         if msg_type == 5: # DHCPACK
             self._print_packet("DHCPACK Recibido", ack_pkt, "green")
-            self.lease_start_time = time.time()
+            self.lease_start_time = self.clock.time()
             self.console.print(f"[bold green]🎉 ¡CONCESIÓN CONFIRMADA! IP: {self.current_ip}[/bold green]")
             self._process_dhcp_options(ack_pkt)
             return True
@@ -217,7 +221,7 @@ class DHCPClientSimulator:
             
             if ack_pkt and ack_pkt.haslayer(DHCP) and ("message-type", 5) in ack_pkt[DHCP].options:
                 self._print_packet("DHCPACK de Renovación Recibido", ack_pkt, "green")
-                self.lease_start_time = time.time()
+                self.lease_start_time = self.clock.time()
                 self._process_dhcp_options(ack_pkt)
                 self.console.print(f"[bold green]✅ Concesión para {self.current_ip} renovada con éxito.[/bold green]")
                 success = True
@@ -326,7 +330,7 @@ class DHCPClientSimulator:
         
         table.add_row("Estado de Concesión", lease_status)
         if self.lease_start_time > 0:
-            elapsed = time.time() - self.lease_start_time
+            elapsed = self.clock.time() - self.lease_start_time
             remaining = self.lease_time - elapsed
             if remaining > 0:
                 table.add_row("Tiempo Total Concesión", f"{self.lease_time}s ({self.lease_time / 3600:.1f} horas)")
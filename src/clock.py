@@ -0,0 +1,43 @@
+# src/clock.py
+import time
+
+
+class SystemClock:
+    """Reloj real del sistema: el que se usa fuera de las simulaciones."""
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    Reloj simulado: solo avanza cuando se le pide con advance() o set().
+    Permite recorrer días de caducidades y renovaciones en segundos (ver
+    src/simulation.py). Empieza por defecto en la hora real para que las
+    marcas de tiempo guardadas en la base de datos sigan siendo verosímiles.
+    """
+
+    def __init__(self, start=None):
+        self.now = float(time.time() if start is None else start)
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        if seconds < 0:
+            raise ValueError("El reloj virtual no puede retroceder.")
+        self.now += seconds
+        return self.now
+
+    def set(self, timestamp):
+        return self.advance(timestamp - self.now)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+
+# Reloj por defecto de todos los componentes que aceptan 'clock'
+SYSTEM_CLOCK = SystemClock()
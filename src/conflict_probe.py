@@ -0,0 +1,173 @@
+# src/conflict_probe.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scapy.all import Ether, ARP, IP, ICMP, srp, sr1
+
+from src.net_utils import int_to_ip
+
+# Resultados de ConflictDetector.check()
+PROBE_FREE = 'libre'
+PROBE_IN_USE = 'en_uso'
+PROBE_PENDING = 'pendiente'
+
+
+class ArpProber:
+    """Sondeo por ARP: la IP está en uso si algún equipo responde al who-has."""
+
+    def __init__(self, iface, timeout=0.5):
+        self.iface = iface
+        self.timeout = timeout
+
+    def probe(self, ip_text):
+        answered, _ = srp(Ether(dst="ff:ff:ff:ff:ff:ff") / ARP(pdst=ip_text),
+                          iface=self.iface, timeout=self.timeout, verbose=0)
+        return len(answered) > 0
+
+
+class IcmpProber:
+    """Sondeo por ICMP echo, para direcciones detrás de un relay (fuera del dominio ARP)."""
+
+    def __init__(self, timeout=0.5):
+        self.timeout = timeout
+
+    def probe(self, ip_text):
+        return sr1(IP(dst=ip_text) / ICMP(), timeout=self.timeout, verbose=0) is not None
+
+
+class StubProber:
+    """
+    Sondeo simulado para pruebas y simulaciones: 'in_use' es el conjunto de
+    IPs (texto) que "responden" y 'delay' el tiempo que tarda cada sondeo.
+    """
+
+    def __init__(self, in_use=(), delay=0.0):
+        self.in_use = set(in_use)
+        self.delay = delay
+        self.probes = 0
+
+    def probe(self, ip_text):
+        self.probes += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return ip_text in self.in_use
+
+
+def make_prober(probe_cfg, iface):
+    method = probe_cfg.get('method', 'arp')
+    timeout = probe_cfg.get('timeout_seconds', 0.5)
+    if method == 'arp':
+        return ArpProber(iface, timeout)
+    if method == 'icmp':
+        return IcmpProber(timeout)
+    raise ValueError(f"Método de sondeo de conflictos desconocido: '{method}'.")
+
+
+class ConflictDetector:
+    """
+    Comprueba si una IP candidata ya la usa otro equipo antes de ofrecerla,
+    en lugar de enterarse después por un DHCPDECLINE.
+
+    Los sondeos se ejecutan en un pool de 'max_concurrent' hilos, nunca en el
+    hilo del handler: check() responde al momento con el resultado cacheado
+    o con PROBE_PENDING, y cuando el sondeo termina se llama a los callbacks
+    registrados. Los resultados se guardan con caducidad: una IP "libre"
+    durante 'free_ttl' segundos no se vuelve a sondear. Si ya hay
+    'max_pending' sondeos en curso la IP se da por libre sin sondear (el
+    DHCPDECLINE sigue cubriendo ese caso).
+
+    Cada callback se registra para un cliente, (MAC, xid): las
+    retransmisiones del mismo DHCPDISCOVER no añaden otro, y pending_ips()
+    permite que los demás clientes no elijan una IP que se sondea para otro.
+    """
+
+    def __init__(self, prober, max_concurrent=16, max_pending=256, free_ttl=300, in_use_ttl=3600):
+        self.prober = prober
+        self.max_pending = max_pending
+        self.free_ttl = free_ttl
+        self.in_use_ttl = in_use_ttl
+        self.results = {}  # ip -> (en_uso, caduca)
+        self.pending = {}  # ip -> {cliente: callback}
+        self.conflicts = set()  # Subconjunto de 'results' en uso
+        self.stats = {'probes': 0, 'conflicts': 0, 'cache_hits': 0, 'skipped': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="conflict-probe")
+
+    def check(self, ip, on_done=None, client=None):
+        """
+        Estado de 'ip' (entero): PROBE_FREE, PROBE_IN_USE o PROBE_PENDING. En
+        el último caso se llamará a on_done(ip, en_uso) al terminar el sondeo,
+        una sola vez por 'client' (MAC, xid) aunque se pregunte varias.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self.results.get(ip)
+            if cached and cached[1] > now:
+                self.stats['cache_hits'] += 1
+                return PROBE_IN_USE if cached[0] else PROBE_FREE
+            callbacks = self.pending.get(ip)
+            if callbacks is not None:
+                if on_done:
+                    callbacks.setdefault(client, on_done)
+                return PROBE_PENDING
+            if len(self.pending) >= self.max_pending:
+                self.stats['skipped'] += 1
+                return PROBE_FREE
+            self.pending[ip] = {client: on_done} if on_done else {}
+        self._executor.submit(self._probe, ip)
+        return PROBE_PENDING
+
+    def _probe(self, ip):
+        try:
+            in_use = bool(self.prober.probe(int_to_ip(ip)))
+            failed = False
+        except Exception:
+            # Un sondeo fallido no debe dejar la IP bloqueada: se trata como libre
+            in_use, failed = False, True
+        with self._lock:
+            self.stats['probes'] += 1
+            if failed:
+                self.stats['errors'] += 1
+            self._store(ip, in_use)
+            callbacks = self.pending.pop(ip, {})
+        for callback in callbacks.values():
+            try:
+                callback(ip, in_use)
+            except Exception as e:
+                print(f"[SONDEO] Error al completar la oferta de {int_to_ip(ip)}: {e}")
+
+    def _store(self, ip, in_use):
+        if in_use:
+            self.stats['conflicts'] += 1
+            self.conflicts.add(ip)
+        else:
+            self.conflicts.discard(ip)
+        ttl = self.in_use_ttl if in_use else self.free_ttl
+        self.results[ip] = (in_use, time.time() + ttl)
+
+    def mark_in_use(self, ip):
+        """Registra un conflicto conocido por otra vía (p. ej. un DHCPDECLINE)."""
+        with self._lock:
+            self._store(ip, True)
+
+    def in_use_ips(self):
+        """IPs con un conflicto vigente, para excluirlas al buscar otra candidata."""
+        now = time.time()
+        with self._lock:
+            expired = {ip for ip in self.conflicts if self.results[ip][1] <= now}
+            for ip in expired:
+                del self.results[ip]
+            self.conflicts -= expired
+            return set(self.conflicts)
+
+    def pending_ips(self, mac):
+        """IPs que se están sondeando para un cliente distinto de 'mac'."""
+        with self._lock:
+            return {
+                ip for ip, callbacks in self.pending.items()
+                if not any(client and client[0] == mac for client in callbacks)
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -1,11 +1,79 @@
 # src/database.py
 import sqlite3
-import time
-from ipaddress import IPv4Address
+import threading
 import os
+from src.clock import SYSTEM_CLOCK
+from src.lease_store import LeaseStore
+from src.net_utils import int_to_ip, int_to_mac, ip_to_int, mac_to_int
 
-class LeaseDatabase:
-    def __init__(self, db_path='data/dhcp_leases.db', lock=None):
+
+def _safe_ip_to_int(ip):
+    try:
+        return ip_to_int(ip)
+    except ValueError:
+        return None
+
+
+def _safe_mac_to_int(mac):
+    try:
+        return mac_to_int(mac) if isinstance(mac, str) else mac
+    except ValueError:
+        return None
+
+
+def register_sql_functions(conn):
+    """Registra las conversiones de IP y MAC para usarlas dentro de las consultas SQL."""
+    conn.create_function('ipv4_to_int', 1, _safe_ip_to_int, deterministic=True)
+    conn.create_function('ipv4_text', 1, int_to_ip, deterministic=True)
+    conn.create_function('mac_to_int', 1, _safe_mac_to_int, deterministic=True)
+    conn.create_function('mac_text', 1, int_to_mac, deterministic=True)
+
+
+def migrate_lease_columns(conn):
+    """
+    Actualiza la tabla 'leases' de bases de datos antiguas al esquema actual,
+    en el que la MAC es un entero de 48 bits (clave primaria) y la IP un
+    entero de 32 bits en 'ip_int'. Crea los índices de búsqueda.
+    """
+    columns = {row[1]: row[2].upper() for row in conn.execute("PRAGMA table_info(leases)")}
+    if not columns:
+        return  # La tabla todavía no existe; la creará el servidor con el esquema actual
+    if 'ip_address' in columns or 'mac_norm' in columns or columns.get('mac') != 'INTEGER':
+        register_sql_functions(conn)
+        ip_expr = "ipv4_to_int(ip_address)" if 'ip_address' in columns else "ip_int"
+        conn.execute("DROP TABLE IF EXISTS leases_migrated")
+        conn.execute('''
+            CREATE TABLE leases_migrated (
+                mac INTEGER PRIMARY KEY,
+                ip_int INTEGER NOT NULL,
+                expires_at INTEGER NOT NULL
+            )
+        ''')
+        # Las filas con una MAC o IP ilegible no se pueden conservar como enteros;
+        # las MAC que solo difieren en mayúsculas/separadores quedan unificadas.
+        conn.execute(f'''
+            INSERT OR REPLACE INTO leases_migrated (mac, ip_int, expires_at)
+            SELECT mac_to_int(mac), {ip_expr}, expires_at FROM leases
+            WHERE mac_to_int(mac) IS NOT NULL AND {ip_expr} IS NOT NULL
+        ''')
+        conn.execute("DROP TABLE leases")
+        conn.execute("ALTER TABLE leases_migrated RENAME TO leases")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leases_ip_int ON leases (ip_int, mac)")
+    conn.commit()
+
+
+class LeaseDatabase(LeaseStore):
+    """
+    Almacén de concesiones por defecto, sobre SQLite (ver src/lease_store.py).
+
+    Los cambios que hace otro proceso sobre la misma base de datos (manager.py)
+    se registran en 'lease_changes', con número de secuencia creciente, para
+    que el servidor los notifique a sus listeners (ver poll_external_changes).
+    """
+
+    CHANGE_RETENTION_SECONDS = 86400
+
+    def __init__(self, db_path='data/dhcp_leases.db', lock=None, clock=None):
         if not lock:
             raise ValueError("Se requiere un objeto Lock para la base de datos.")
         
@@ -13,22 +81,39 @@ class LeaseDatabase:
         if db_dir:
             os.makedirs(db_dir, exist_ok=True)
 
+        self.db_path = db_path
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
         self.cursor = self.conn.cursor()
         self.lock = lock
+        # Reloj inyectable: el del sistema, o uno virtual en las simulaciones (ver src/clock.py)
+        self.clock = clock or SYSTEM_CLOCK
+        self.change_listeners = []
+        # Renovaciones aplazadas (ver renew_lease): mac -> (ip, expires_at, expires_at_persistido)
+        self.renew_threshold = 0
+        self.renew_flush_interval = 5
+        self.renew_history = 'all'
+        self.pending_renewals = {}
+        self.pending_history = []
+        self._flush_stop = threading.Event()
+        # Solo tiene efecto en bases de datos nuevas: permite que el archivado
+        # del histórico devuelva páginas libres con 'PRAGMA incremental_vacuum'.
+        self.cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
         self._create_table()
         self._create_history_table() # <<< MEJORA: Llamamos a la creación de la nueva tabla
+        self._create_rogue_table()
+        self._create_changes_table()
 
     def _create_table(self):
         with self.lock:
             self.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS leases (
-                    mac TEXT PRIMARY KEY,
-                    ip_address TEXT NOT NULL,
+                    mac INTEGER PRIMARY KEY,
+                    ip_int INTEGER NOT NULL,
                     expires_at INTEGER NOT NULL
                 )
             ''')
-            self.conn.commit()
+            # Migración de esquemas antiguos e índices para las búsquedas del gestor (manager.py)
+            migrate_lease_columns(self.conn)
 
     # <<< MEJORA: Nuevo método para crear la tabla de histórico >>>
     def _create_history_table(self):
@@ -42,56 +127,334 @@ class LeaseDatabase:
                     event_timestamp INTEGER NOT NULL
                 )
             ''')
+            # Índice usado por el archivado para localizar los eventos antiguos sin recorrer la tabla
+            self.cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_history_timestamp ON leases_history (event_timestamp)"
+            )
             self.conn.commit()
     # --- Fin de la mejora ---
 
+    def _create_rogue_table(self):
+        with self.lock:
+            # Servidores DHCP no autorizados detectados (ver src/rogue_tracker.py)
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rogue_servers (
+                    mac INTEGER NOT NULL,
+                    ip_int INTEGER NOT NULL,
+                    first_seen INTEGER NOT NULL,
+                    last_seen INTEGER NOT NULL,
+                    packet_count INTEGER NOT NULL,
+                    PRIMARY KEY (mac, ip_int)
+                )
+            ''')
+            self.conn.commit()
+
+    def _create_changes_table(self):
+        with self.lock:
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS lease_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op INTEGER NOT NULL,
+                    mac INTEGER NOT NULL,
+                    ip_int INTEGER NOT NULL,
+                    expires_at INTEGER NOT NULL,
+                    changed_at INTEGER NOT NULL
+                )
+            ''')
+            self.conn.commit()
+        # Solo interesan los cambios posteriores al arranque
+        self.change_log = self
+        self.external_seq = self.last_external_seq()
+
+    def last_external_seq(self):
+        """
+        Secuencia del último cambio registrado en 'lease_changes' (0 si ninguno).
+        Sale de sqlite_sequence, así que no retrocede aunque se purguen los cambios.
+        """
+        with self.lock:
+            self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'lease_changes'")
+            row = self.cursor.fetchone()
+        return row[0] if row else 0
+
+    def record_external_changes(self, changes):
+        """
+        Registra en 'lease_changes' cambios (op, mac, ip, expires_at) hechos
+        fuera del servidor, para que este los vea. Purga los de más de un día.
+        """
+        now = int(self.clock.time())
+        with self.lock:
+            self.cursor.executemany(
+                "INSERT INTO lease_changes (op, mac, ip_int, expires_at, changed_at) VALUES (?, ?, ?, ?, ?)",
+                [(op, mac, ip, expires_at, now) for op, mac, ip, expires_at in changes]
+            )
+            self.prune_external_changes(now)
+            self.conn.commit()
+
+    def prune_external_changes(self, now):
+        self.cursor.execute(
+            "DELETE FROM lease_changes WHERE changed_at < ?", (now - self.CHANGE_RETENTION_SECONDS,)
+        )
+
+    def external_changes_since(self, seq):
+        """Cambios (seq, op, mac, ip, expires_at) registrados después de 'seq'."""
+        with self.lock:
+            self.cursor.execute(
+                "SELECT seq, op, mac, ip_int, expires_at FROM lease_changes WHERE seq > ? ORDER BY seq", (seq,)
+            )
+            rows = self.cursor.fetchall()
+            # Una renovación aplazada no debe deshacer el cambio externo
+            for _, _, mac, _, _ in rows:
+                self.pending_renewals.pop(mac, None)
+        return rows
+
+    def save_rogue_servers(self, sightings):
+        """
+        Acumula en 'rogue_servers' las observaciones (mac, ip, first_seen,
+        last_seen, paquetes) recogidas desde el último volcado.
+        """
+        with self.lock:
+            self.cursor.executemany(
+                "INSERT INTO rogue_servers (mac, ip_int, first_seen, last_seen, packet_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(mac, ip_int) DO UPDATE SET first_seen = MIN(first_seen, excluded.first_seen), "
+                "last_seen = MAX(last_seen, excluded.last_seen), "
+                "packet_count = packet_count + excluded.packet_count",
+                sightings
+            )
+            self.conn.commit()
+
     # <<< MEJORA: Nuevo método para añadir un registro al histórico >>>
     def add_history_log(self, mac, ip, event_type):
-        event_timestamp = int(time.time())
+        # El histórico es un registro de auditoría: guarda MAC e IP en texto
+        # (forma canónica), igual que las particiones ya archivadas.
+        mac_text = int_to_mac(mac) if isinstance(mac, int) else mac
+        ip_text = int_to_ip(ip) if isinstance(ip, int) else ip
+        event_timestamp = int(self.clock.time())
         with self.lock:
             self.cursor.execute(
                 "INSERT INTO leases_history (mac, ip_address, event_type, event_timestamp) VALUES (?, ?, ?, ?)",
-                (mac, ip, event_type, event_timestamp)
+                (mac_text, ip_text, event_type, event_timestamp)
             )
             self.conn.commit()
     # --- Fin de la mejora ---
 
+    # MACs (48 bits) e IPs (32 bits) se manejan como enteros; solo se convierten
+    # a texto al construir el paquete de respuesta o al mostrarlas.
     def add_lease(self, mac, ip, lease_time):
-        expires_at = int(time.time()) + lease_time
+        expires_at = int(self.clock.time()) + lease_time
         with self.lock:
+            self.pending_renewals.pop(mac, None)
             self.cursor.execute(
-                "REPLACE INTO leases (mac, ip_address, expires_at) VALUES (?, ?, ?)",
+                "REPLACE INTO leases (mac, ip_int, expires_at) VALUES (?, ?, ?)",
                 (mac, ip, expires_at)
             )
             self.conn.commit()
+        self._notify_change(self.LEASE_SET, mac, ip, expires_at)
+
+    def assign_lease(self, mac, ip, lease_time):
+        """
+        Concede 'ip' a 'mac' solo si nadie más la tiene vigente. La limpieza
+        del titular caducado y la inserción condicional van en la misma
+        transacción, así que también es atómico entre procesos.
+        """
+        now = int(self.clock.time())
+        expires_at = now + lease_time
+        with self.lock:
+            self.pending_renewals.pop(mac, None)
+            self.cursor.execute("DELETE FROM leases WHERE ip_int = ? AND mac != ? AND expires_at <= ?", (ip, mac, now))
+            self.cursor.execute(
+                "INSERT INTO leases (mac, ip_int, expires_at) SELECT ?, ?, ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM leases WHERE ip_int = ? AND mac != ? AND expires_at > ?) "
+                "ON CONFLICT(mac) DO UPDATE SET ip_int = excluded.ip_int, expires_at = excluded.expires_at",
+                (mac, ip, expires_at, ip, mac, now)
+            )
+            assigned = self.cursor.rowcount > 0
+            self.conn.commit()
+        if assigned:
+            self._notify_change(self.LEASE_SET, mac, ip, expires_at)
+        return assigned
+
+    def configure_renewal_coalescing(self, threshold_seconds, flush_interval=5, history='all'):
+        """
+        Activa la agrupación de escrituras de RENEW. 'history' decide qué se
+        guarda en el histórico: 'all' (un evento por RENEW, escrito por lotes),
+        'summary' (un evento por renovación persistida) o 'none'.
+        """
+        if history not in ('all', 'summary', 'none'):
+            raise ValueError(f"Modo de histórico de renovaciones no válido: '{history}'.")
+        self.renew_threshold = threshold_seconds
+        self.renew_flush_interval = flush_interval
+        self.renew_history = history
+
+    def renew_lease(self, mac, ip, lease_time):
+        """
+        Renueva la concesión de 'mac' y registra el RENEW en el histórico.
+
+        La nueva expiración se aplica en memoria al momento; solo se escribe en
+        la base de datos si adelanta la ya persistida más de 'renew_threshold'
+        segundos o si la persistida vencería antes del siguiente volcado. El
+        resto se escribe en el próximo flush_renewals(), en una transacción.
+        """
+        now = int(self.clock.time())
+        expires_at = now + lease_time
+        with self.lock:
+            pending = self.pending_renewals.get(mac)
+            if pending and pending[0] == ip:
+                persisted = pending[2]
+            else:
+                self.cursor.execute("SELECT expires_at FROM leases WHERE mac = ? AND ip_int = ?", (mac, ip))
+                row = self.cursor.fetchone()
+                persisted = row[0] if row else None
+
+            deferrable = (
+                self.renew_threshold and persisted is not None
+                and expires_at - persisted <= self.renew_threshold
+                and persisted - now > self.renew_flush_interval
+            )
+            if deferrable:
+                self.pending_renewals[mac] = (ip, expires_at, persisted)
+                if self.renew_history == 'all':
+                    self.pending_history.append((int_to_mac(mac), int_to_ip(ip), 'RENEW', now))
+            else:
+                self.pending_renewals.pop(mac, None)
+                self.cursor.execute(
+                    "REPLACE INTO leases (mac, ip_int, expires_at) VALUES (?, ?, ?)", (mac, ip, expires_at)
+                )
+                if self.renew_history != 'none':
+                    self.cursor.execute(
+                        "INSERT INTO leases_history (mac, ip_address, event_type, event_timestamp) VALUES (?, ?, ?, ?)",
+                        (int_to_mac(mac), int_to_ip(ip), 'RENEW', now)
+                    )
+                self.conn.commit()
+        self._notify_change(self.LEASE_SET, mac, ip, expires_at)
+
+    def flush_renewals(self):
+        """Persiste en una sola transacción las renovaciones aplazadas. Devuelve cuántas."""
+        with self.lock:
+            if not self.pending_renewals and not self.pending_history:
+                return 0
+            renewals, self.pending_renewals = self.pending_renewals, {}
+            history, self.pending_history = self.pending_history, []
+            now = int(self.clock.time())
+            self.cursor.executemany(
+                "UPDATE leases SET expires_at = ? WHERE mac = ? AND ip_int = ?",
+                [(expires_at, mac, ip) for mac, (ip, expires_at, _) in renewals.items()]
+            )
+            if self.renew_history == 'summary':
+                history = [(int_to_mac(mac), int_to_ip(ip), 'RENEW', now) for mac, (ip, _, _) in renewals.items()]
+            self.cursor.executemany(
+                "INSERT INTO leases_history (mac, ip_address, event_type, event_timestamp) VALUES (?, ?, ?, ?)",
+                history
+            )
+            self.conn.commit()
+            return len(renewals)
+
+    def _flush_loop(self):
+        while not self._flush_stop.wait(self.renew_flush_interval):
+            self.flush_renewals()
+
+    def start_renewal_flusher(self):
+        threading.Thread(target=self._flush_loop, name="renewal-flusher", daemon=True).start()
+
+    def stop_renewal_flusher(self):
+        self._flush_stop.set()
+        self.flush_renewals()
 
     def get_lease(self, mac):
         with self.lock:
-            self.cursor.execute("SELECT ip_address, expires_at FROM leases WHERE mac = ?", (mac,))
+            pending = self.pending_renewals.get(mac)
+            if pending:
+                return {'ip': pending[0], 'expires_at': pending[1]}
+            self.cursor.execute("SELECT ip_int, expires_at FROM leases WHERE mac = ?", (mac,))
             result = self.cursor.fetchone()
-        if result and result[1] > time.time():
+        if result and result[1] > self.clock.time():
             return {'ip': result[0], 'expires_at': result[1]}
         return None
 
+    def get_lease_holder(self, ip):
+        """Devuelve la MAC que tiene concedida la IP 'ip' (entero), o None si está libre."""
+        with self.lock:
+            self.cursor.execute(
+                "SELECT mac FROM leases WHERE ip_int = ? AND expires_at > ?", (ip, int(self.clock.time()))
+            )
+            result = self.cursor.fetchone()
+        return result[0] if result else None
+
     def release_lease(self, mac):
         with self.lock:
+            pending = self.pending_renewals.pop(mac, None)
+            self.cursor.execute("SELECT ip_int, expires_at FROM leases WHERE mac = ?", (mac,))
+            ip, expires_at = self.cursor.fetchone() or (0, 0)
             self.cursor.execute("DELETE FROM leases WHERE mac = ?", (mac,))
             self.conn.commit()
+        # Se notifica la expiración vigente, incluida una renovación aún no persistida
+        self._notify_change(self.LEASE_DELETE, mac, ip, pending[1] if pending else expires_at)
+
+    def get_all_leases(self):
+        """Devuelve todas las concesiones vigentes como tuplas (mac, ip, expires_at)."""
+        with self.lock:
+            self.cursor.execute(
+                "SELECT mac, ip_int, expires_at FROM leases WHERE expires_at > ?", (int(self.clock.time()),)
+            )
+            return [
+                (mac, ip, self.pending_renewals[mac][1] if mac in self.pending_renewals else expires_at)
+                for mac, ip, expires_at in self.cursor.fetchall()
+            ]
+
+    def apply_replicated_changes(self, changes):
+        """
+        Aplica en una sola transacción los cambios recibidos del servidor par,
+        como tuplas (op, mac, ip, expires_at). Los listeners reciben los
+        cambios aplicados marcados como replicados, para no reenviarlos de
+        vuelta. Ante un conflicto gana la concesión que expira más tarde, así
+        que reaplicar es inocuo:
+          - un LEASE_SET sobre una IP que otra MAC tiene hasta más tarde se
+            descarta, para no dejar la IP concedida a dos clientes;
+          - un LEASE_DELETE con 'expires_at' solo borra si la concesión local
+            no vence después (si se renovó aquí, la renovación gana).
+        """
+        applied = []
+        with self.lock:
+            for op, mac, ip, expires_at in changes:
+                if op == self.LEASE_SET:
+                    self.cursor.execute("DELETE FROM leases WHERE ip_int = ? AND mac != ? AND expires_at <= ?",
+                                        (ip, mac, expires_at))
+                    self.cursor.execute(
+                        "INSERT INTO leases (mac, ip_int, expires_at) SELECT ?, ?, ? "
+                        "WHERE NOT EXISTS (SELECT 1 FROM leases WHERE ip_int = ? AND mac != ?) "
+                        "ON CONFLICT(mac) DO UPDATE SET ip_int = excluded.ip_int, expires_at = excluded.expires_at "
+                        "WHERE excluded.expires_at >= leases.expires_at",
+                        (mac, ip, expires_at, ip, mac)
+                    )
+                elif op == self.LEASE_DELETE:
+                    pending = self.pending_renewals.get(mac)
+                    if expires_at and pending and pending[1] > expires_at:
+                        continue
+                    self.cursor.execute(
+                        "DELETE FROM leases WHERE mac = ? AND (? = 0 OR expires_at <= ?)", (mac, expires_at, expires_at)
+                    )
+                else:
+                    continue
+                if self.cursor.rowcount > 0:
+                    self.pending_renewals.pop(mac, None)
+                    applied.append((op, mac, ip, expires_at))
+            self.conn.commit()
+        for op, mac, ip, expires_at in applied:
+            self._notify_change(op, mac, ip, expires_at, replicated=True)
 
     def get_active_leases(self):
         with self.lock:
-            self.cursor.execute("SELECT mac, ip_address FROM leases WHERE expires_at > ?", (int(time.time()),))
+            self.cursor.execute("SELECT mac, ip_int FROM leases WHERE expires_at > ?", (int(self.clock.time()),))
             return {row[1]: row[0] for row in self.cursor.fetchall()}
 
-    def find_available_ip(self, pool_start, pool_end, reservations):
-        start = int(IPv4Address(pool_start))
-        end = int(IPv4Address(pool_end))
-        
-        active_ips = set(self.get_active_leases().keys())
-        reserved_ips = set(reservations.values())
-        
-        for ip_int in range(start, end + 1):
-            ip_str = str(IPv4Address(ip_int))
-            if ip_str not in active_ips and ip_str not in reserved_ips:
-                return ip_str
+    def find_available_ip(self, pool_start, pool_end, reserved_ips):
+        with self.lock:
+            self.cursor.execute(
+                "SELECT ip_int FROM leases WHERE ip_int BETWEEN ? AND ? AND expires_at > ?",
+                (pool_start, pool_end, int(self.clock.time()))
+            )
+            active_ips = {row[0] for row in self.cursor.fetchall()}
+
+        for ip in range(pool_start, pool_end + 1):
+            if ip not in active_ips and ip not in reserved_ips:
+                return ip
         return None
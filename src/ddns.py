@@ -0,0 +1,470 @@
+# src/ddns.py
+import argparse
+import itertools
+import re
+import socket
+import struct
+import threading
+import time
+from ipaddress import IPv4Network
+
+from src.clock import SYSTEM_CLOCK
+from src.lease_store import LeaseStore
+from src.net_utils import int_to_ip, int_to_mac
+from src.replication import parse_address
+
+# Mensajes DNS UPDATE (RFC 2136). Se codifican a mano: scapy no sabe
+# serializar los registros de borrado, que van sin RDATA.
+HEADER = struct.Struct('!HHHHHH')  # id, flags, zona, prerrequisitos, actualizaciones, adicionales
+RR_FIXED = struct.Struct('!HHIH')  # tipo, clase, ttl, longitud de RDATA
+QUESTION_FIXED = struct.Struct('!HH')
+
+OPCODE_UPDATE = 5
+TYPE_A = 1
+TYPE_SOA = 6
+TYPE_PTR = 12
+CLASS_IN = 1
+CLASS_ANY = 255  # En una actualización con TTL 0 y sin RDATA: borra el conjunto de registros
+RCODE_NOERROR = 0
+RCODE_NOTZONE = 10
+
+HOST_LABEL_INVALID = re.compile(r'[^a-z0-9-]+')
+
+
+class DnsRejected(Exception):
+    """El servidor DNS respondió a una actualización con un rcode de error."""
+
+    def __init__(self, rcode, zone):
+        super().__init__(f"el servidor DNS respondió con rcode {rcode} para la zona '{zone}'")
+        self.rcode = rcode
+
+
+def encode_name(name):
+    labels = [label for label in name.rstrip('.').split('.') if label]
+    return b''.join(bytes([len(label)]) + label.encode('ascii') for label in labels) + b'\x00'
+
+
+def decode_name(data, offset):
+    """Lee un nombre (admite punteros de compresión). Devuelve (nombre, siguiente offset)."""
+    labels = []
+    end = None
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack_from('!H', data, offset)[0] & 0x3FFF
+            continue
+        offset += 1
+        if not length:
+            break
+        labels.append(data[offset:offset + length].decode('ascii'))
+        offset += length
+    return '.'.join(labels), end if end is not None else offset
+
+
+def encode_update(msg_id, zone, updates):
+    """
+    Mensaje DNS UPDATE para 'zone' con las actualizaciones (nombre, tipo,
+    clase, ttl, rdata en bytes) en la sección de actualización.
+    """
+    parts = [
+        HEADER.pack(msg_id, OPCODE_UPDATE << 11, 1, 0, len(updates), 0),
+        encode_name(zone) + QUESTION_FIXED.pack(TYPE_SOA, CLASS_IN),
+    ]
+    for name, rtype, rclass, ttl, rdata in updates:
+        parts.append(encode_name(name) + RR_FIXED.pack(rtype, rclass, ttl, len(rdata)) + rdata)
+    return b''.join(parts)
+
+
+def decode_message(data):
+    """Decodifica un mensaje DNS UPDATE o su respuesta en un diccionario."""
+    msg_id, flags, zone_count, prereq_count, update_count, _ = HEADER.unpack_from(data)
+    offset = HEADER.size
+    zone = None
+    for _ in range(zone_count):
+        zone, offset = decode_name(data, offset)
+        offset += QUESTION_FIXED.size
+    records = []
+    for _ in range(prereq_count + update_count):
+        name, offset = decode_name(data, offset)
+        rtype, rclass, ttl, rdlength = RR_FIXED.unpack_from(data, offset)
+        offset += RR_FIXED.size
+        records.append((name, rtype, rclass, ttl, data[offset:offset + rdlength]))
+        offset += rdlength
+    return {
+        'id': msg_id, 'response': bool(flags & 0x8000), 'opcode': (flags >> 11) & 0xF, 'rcode': flags & 0xF,
+        'zone': zone, 'updates': records[prereq_count:]
+    }
+
+
+def encode_response(msg_id, rcode):
+    return HEADER.pack(msg_id, 0x8000 | OPCODE_UPDATE << 11 | rcode, 0, 0, 0, 0)
+
+
+def reverse_name(ip):
+    """Nombre PTR de una IP (entero): 100.1.168.192.in-addr.arpa."""
+    return '.'.join(reversed(int_to_ip(ip).split('.'))) + '.in-addr.arpa'
+
+
+def reverse_zone_for(subnet):
+    """Zona inversa de la subred, redondeada al octeto: 192.168.1.0/24 -> 1.168.192.in-addr.arpa."""
+    network = IPv4Network(f"{subnet['network']}/{subnet['mask']}", strict=False)
+    octets = str(network.network_address).split('.')[:max(network.prefixlen // 8, 1)]
+    return '.'.join(reversed(octets)) + '.in-addr.arpa'
+
+
+def host_label(hostname):
+    """Etiqueta DNS válida a partir del hostname del cliente (opción 12), o None."""
+    if not hostname:
+        return None
+    label = HOST_LABEL_INVALID.sub('-', hostname.split('.')[0].lower()).strip('-')[:63]
+    return label or None
+
+
+class DdnsUpdater:
+    """
+    Mantiene los registros A y PTR de los clientes con hostname en un
+    servidor DNS mediante DNS UPDATE (RFC 2136).
+
+    El handler y el almacén de concesiones solo anotan el estado deseado de
+    cada cliente (register() al conceder o renovar, el listener al liberar)
+    y marcan su MAC como pendiente: nunca esperan a la red. Un hilo propio
+    espera 'batch_window' segundos para agrupar, compara el estado deseado
+    con el ya publicado y envía los cambios de hasta 'batch_size' clientes
+    en un mensaje para la zona directa y otro para la inversa. Las
+    actualizaciones repetidas de un cliente antes del envío se funden en una
+    sola, y las que no cambian nada no se envían. Las concesiones caducadas
+    se retiran cada 'expiry_check' segundos.
+
+    Si el servidor DNS no responde, los clientes del lote vuelven a quedar
+    pendientes y se reintenta tras 'retry_interval' segundos. Si rechaza un
+    lote, se divide en mitades hasta aislar a los clientes rechazados, que
+    se descartan con un aviso en lugar de reintentarse para siempre. Al
+    parar se envía lo que quede pendiente.
+    """
+
+    def __init__(self, server, forward_zone, reverse_zone, ttl=300, batch_size=50, batch_window=0.5,
+                 timeout=2.0, retry_interval=5.0, expiry_check=60, clock=None):
+        self.server = server
+        self.forward_zone = forward_zone.rstrip('.')
+        self.reverse_zone = reverse_zone.rstrip('.')
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.expiry_check = expiry_check
+        self.clock = clock or SYSTEM_CLOCK
+        self.desired = {}  # mac -> (fqdn, ip)
+        self.published = {}  # mac -> (fqdn, ip) confirmado por el servidor DNS
+        self.expires = {}  # mac -> expires_at de su concesión
+        self.dirty = {}  # MACs pendientes, en orden de llegada
+        self.stats = {'queued': 0, 'coalesced': 0, 'messages': 0, 'records': 0, 'errors': 0, 'rejected': 0}
+        self._msg_id = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._socket = None
+        self._thread = None
+
+    def _mark(self, mac):
+        # Con _lock tomado
+        if mac in self.dirty:
+            self.stats['coalesced'] += 1
+        else:
+            self.dirty[mac] = None
+            self.stats['queued'] += 1
+        self._wake.set()
+
+    def register(self, mac, ip, hostname=None):
+        """
+        El cliente 'mac' tiene 'ip' concedida. Sin hostname se conserva el
+        nombre que ya tuviera; un cliente sin nombre conocido no se publica.
+        """
+        label = host_label(hostname)
+        with self._lock:
+            current = self.desired.get(mac)
+            fqdn = f"{label}.{self.forward_zone}" if label else (current[0] if current else None)
+            if fqdn is None or current == (fqdn, ip):
+                return
+            self.desired[mac] = (fqdn, ip)
+            self._mark(mac)
+
+    def on_lease_change(self, op, mac, ip, expires_at, replicated=False):
+        """Listener del almacén: liberaciones y cambios de IP de clientes ya publicados."""
+        with self._lock:
+            if op == LeaseStore.LEASE_DELETE:
+                self.expires.pop(mac, None)
+                if self.desired.pop(mac, None):
+                    self._mark(mac)
+                return
+            self.expires[mac] = expires_at
+            current = self.desired.get(mac)
+            if current and current[1] != ip:
+                self.desired[mac] = (current[0], ip)
+                self._mark(mac)
+
+    def expire(self, now=None):
+        """Retira los registros de las concesiones caducadas. Devuelve cuántas."""
+        now = self.clock.time() if now is None else now
+        with self._lock:
+            expired = [mac for mac, expires_at in self.expires.items() if expires_at <= now]
+            for mac in expired:
+                del self.expires[mac]
+                if self.desired.pop(mac, None):
+                    self._mark(mac)
+        return len(expired)
+
+    def _records(self, old, new, names_in_use=()):
+        """
+        Actualizaciones (zona directa, zona inversa) para pasar de 'old' a
+        'new' (None = sin registros). El registro A de un nombre que ya usa
+        otro cliente ('names_in_use') no se borra: es suyo.
+        """
+        forward, reverse = [], []
+        if old and (not new or old[0] != new[0]) and old[0] not in names_in_use:
+            forward.append((old[0], TYPE_A, CLASS_ANY, 0, b''))
+        if old and (not new or old[1] != new[1]):
+            reverse.append((reverse_name(old[1]), TYPE_PTR, CLASS_ANY, 0, b''))
+        if new:
+            fqdn, ip = new
+            # Borrar el conjunto y añadir el registro: sustituye lo que hubiera
+            forward.append((fqdn, TYPE_A, CLASS_ANY, 0, b''))
+            forward.append((fqdn, TYPE_A, CLASS_IN, self.ttl, ip.to_bytes(4, 'big')))
+            ptr_name = reverse_name(ip)
+            reverse.append((ptr_name, TYPE_PTR, CLASS_ANY, 0, b''))
+            reverse.append((ptr_name, TYPE_PTR, CLASS_IN, self.ttl, encode_name(fqdn)))
+        return forward, reverse
+
+    def _take_batch(self):
+        with self._lock:
+            macs = list(itertools.islice(self.dirty, self.batch_size))
+            for mac in macs:
+                del self.dirty[mac]
+            changes = []
+            for mac in macs:
+                old, new = self.published.get(mac), self.desired.get(mac)
+                if old != new:
+                    changes.append((mac, old, new))
+            names_in_use = {fqdn for fqdn, _ in self.desired.values()} if changes else set()
+            if not self.dirty:
+                self._wake.clear()
+        return changes, names_in_use
+
+    def _send(self, zone, updates):
+        self._msg_id = (self._msg_id + 1) & 0xFFFF
+        msg_id = self._msg_id
+        self._socket.sendto(encode_update(msg_id, zone, updates), self.server)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            self._socket.settimeout(max(deadline - time.monotonic(), 0.001))
+            data, _ = self._socket.recvfrom(512)
+            reply = decode_message(data)
+            if reply['id'] == msg_id and reply['response']:
+                break
+        self.stats['messages'] += 1
+        self.stats['records'] += len(updates)
+        if reply['rcode'] != RCODE_NOERROR:
+            raise DnsRejected(reply['rcode'], zone)
+
+    def _publish(self, changes, names_in_use, accepted, rejected):
+        """
+        Envía 'changes' y los anota en 'accepted'. Si el servidor rechaza el
+        lote, lo parte en mitades hasta aislar los cambios rechazados, que
+        van a 'rejected'. Los errores de red se propagan.
+        """
+        forward, reverse = [], []
+        for _, old, new in changes:
+            records = self._records(old, new, names_in_use)
+            forward.extend(records[0])
+            reverse.extend(records[1])
+        try:
+            if forward:
+                self._send(self.forward_zone, forward)
+            if reverse:
+                self._send(self.reverse_zone, reverse)
+        except DnsRejected as e:
+            if len(changes) == 1:
+                rejected.append((changes[0], e))
+                return
+            # Borrar y añadir es idempotente: reenviar la parte ya aplicada no cambia nada
+            half = len(changes) // 2
+            self._publish(changes[:half], names_in_use, accepted, rejected)
+            self._publish(changes[half:], names_in_use, accepted, rejected)
+            return
+        accepted.extend(changes)
+
+    def flush(self):
+        """Envía un lote de cambios pendientes. Devuelve cuántos clientes se publicaron (None si falló)."""
+        changes, names_in_use = self._take_batch()
+        if not changes:
+            return 0
+        accepted, rejected = [], []
+        failed = None
+        try:
+            self._publish(changes, names_in_use, accepted, rejected)
+        except (OSError, struct.error) as e:
+            failed = e
+        for (mac, old, new), e in rejected:
+            self.stats['rejected'] += 1
+            print(f"[DDNS] {self.server[0]}:{self.server[1]} rechazó la actualización de {(new or old)[0]} "
+                  f"({int_to_mac(mac)}): {e}. Se descarta.")
+        with self._lock:
+            for mac, _, new in accepted:
+                if new:
+                    self.published[mac] = new
+                else:
+                    self.published.pop(mac, None)
+            if failed:
+                done = {mac for mac, _, _ in accepted} | {change[0] for change, _ in rejected}
+                for mac, _, _ in changes:
+                    if mac not in done:
+                        self._mark(mac)
+        if failed:
+            self.stats['errors'] += 1
+            print(f"[DDNS] No se pudieron publicar {len(changes) - len(accepted) - len(rejected)} cambios "
+                  f"en {self.server[0]}:{self.server[1]}: {failed}")
+            return None
+        return len(accepted)
+
+    def _run(self):
+        next_expiry = time.monotonic() + self.expiry_check
+        while not self._stop_event.is_set():
+            self._wake.wait(max(next_expiry - time.monotonic(), 0))
+            if time.monotonic() >= next_expiry:
+                self.expire()
+                next_expiry = time.monotonic() + self.expiry_check
+            if not self._wake.is_set():
+                continue
+            # Ventana de agrupación: las actualizaciones que lleguen mientras tanto van en el mismo lote
+            if self._stop_event.wait(self.batch_window):
+                break
+            while self.dirty and not self._stop_event.is_set():
+                if self.flush() is None:
+                    self._stop_event.wait(self.retry_interval)
+                    break
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._thread = threading.Thread(target=self._run, name="ddns-updater", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=self.timeout + 1)
+        if self._socket:
+            # Lo pendiente se envía antes de cerrar (solo un intento si el servidor DNS no responde)
+            if not (self._thread and self._thread.is_alive()):
+                while self.dirty and self.flush() is not None:
+                    pass
+            self._socket.close()
+
+
+def make_updater(config, clock=None):
+    """DdnsUpdater según config['ddns'], o None si está desactivado."""
+    ddns_cfg = config.get('ddns', {})
+    if not ddns_cfg.get('enabled', False):
+        return None
+    return DdnsUpdater(
+        parse_address(ddns_cfg.get('server', '127.0.0.1:53'), default_host='127.0.0.1'),
+        ddns_cfg.get('forward_zone', config.get('domain_name', 'local')),
+        ddns_cfg.get('reverse_zone') or reverse_zone_for(config['subnet']),
+        ttl=ddns_cfg.get('ttl', 300),
+        batch_size=ddns_cfg.get('batch_size', 50),
+        batch_window=ddns_cfg.get('batch_window_seconds', 0.5),
+        timeout=ddns_cfg.get('timeout_seconds', 2),
+        retry_interval=ddns_cfg.get('retry_interval_seconds', 5),
+        expiry_check=ddns_cfg.get('expiry_check_seconds', 60),
+        clock=clock
+    )
+
+
+class StubDnsServer:
+    """
+    Servidor DNS mínimo para pruebas: acepta DNS UPDATE por UDP para las
+    zonas de 'zones', aplica los cambios a 'records' ({(nombre, tipo):
+    {rdata}}) y responde NOERROR (NOTZONE si un nombre queda fuera de la
+    zona). Con 'rcode' distinto de 0 rechaza todo, para probar reintentos.
+    """
+
+    def __init__(self, listen=('127.0.0.1', 5353), zones=(), verbose=False):
+        self.listen = listen
+        self.zones = {zone.rstrip('.') for zone in zones}
+        self.verbose = verbose
+        self.records = {}
+        self.rcode = RCODE_NOERROR
+        self.messages = []
+        self._socket = None
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    def _in_zone(self, name, zone):
+        return not self.zones or (zone in self.zones and (name == zone or name.endswith('.' + zone)))
+
+    def _apply(self, message):
+        zone = message['zone']
+        if any(not self._in_zone(name, zone) for name, *_ in message['updates']):
+            return RCODE_NOTZONE
+        for name, rtype, rclass, _, rdata in message['updates']:
+            if rtype == TYPE_A:
+                value = socket.inet_ntoa(rdata) if rdata else None
+            else:
+                value = decode_name(rdata, 0)[0] if rdata else None
+            if rclass == CLASS_ANY:
+                self.records.pop((name, rtype), None)
+            else:
+                self.records.setdefault((name, rtype), set()).add(value)
+            if self.verbose:
+                action = "borrar" if rclass == CLASS_ANY else "añadir"
+                print(f"[DNS] {zone}: {action} {name} {'A' if rtype == TYPE_A else 'PTR'} {value or ''}")
+        return RCODE_NOERROR
+
+    def _run(self):
+        while True:
+            try:
+                data, peer = self._socket.recvfrom(65535)
+            except OSError:
+                break
+            try:
+                message = decode_message(data)
+            except (struct.error, IndexError, UnicodeDecodeError):
+                continue
+            self.messages.append(message)
+            rcode = self.rcode or self._apply(message)
+            self._socket.sendto(encode_response(message['id'], rcode), peer)
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(self.listen)
+        self._thread = threading.Thread(target=self._run, name="stub-dns", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor DNS de pruebas que acepta y muestra actualizaciones DDNS.")
+    parser.add_argument('--listen', default='127.0.0.1:5353', help="Dirección 'host:puerto' de escucha (por defecto: 127.0.0.1:5353).")
+    parser.add_argument('--zone', action='append', default=[], help="Zona aceptada (repetible). Sin zonas se acepta cualquier nombre.")
+    args = parser.parse_args()
+
+    stub = StubDnsServer(parse_address(args.listen, default_host='127.0.0.1'), args.zone, verbose=True)
+    stub.start()
+    print(f"Servidor DNS de pruebas escuchando en {args.listen}. Ctrl+C para salir.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,23 @@
 # src/dhcp_handler.py
-from scapy.all import Ether, IP, UDP, BOOTP, DHCP, get_if_hwaddr
-from ipaddress import IPv4Address
+from scapy.all import Ether, IP, UDP, BOOTP, DHCP, Raw, get_if_hwaddr
+from src.lease_policy import LeasePolicy
+from src.lease_snapshot import LeaseIndex, LeaseSnapshotter
+from src.clock import SYSTEM_CLOCK
+from src.conflict_probe import ConflictDetector, PROBE_FREE, PROBE_PENDING, make_prober
+from src.ddns import make_updater
+from src.dhcp_options import OptionCatalogue, requested_parameters
+from src.inform import InformResponder
 from src.logger import DhcpLogger
+from src.net_utils import int_to_ip, int_to_mac, ip_to_int, mac_to_int
+from src.offer_cache import OfferCache, PreparedPacket
+from src.rate_limiter import TokenBucketLimiter
+from src.relay_agent import RelayRuleTable, parse_suboptions, relay_agent_option
+from src.reservations import ReservationMap, ReservationStore
+from src.rogue_tracker import RogueServerTracker
+from src.tracing import NULL_TRACER, TracedStore, traced
 import time
 import threading
+from collections import ChainMap
 from enum import IntEnum
 
 class DHCPMessageType(IntEnum):
@@ -18,30 +32,159 @@ class DHCPMessageType(IntEnum):
 
 class DHCPHandler:
     CONVERSATION_COOLDOWN_SECONDS = 5
+    # IPs del pool que se prueban como mucho por DISCOVER si las anteriores están en uso
+    MAX_PROBE_CANDIDATES = 4
 
-    def __init__(self, config, db, log_mode='profesional', lock=None):
+    def __init__(self, config, db, log_mode='profesional', lock=None, failover=None, clock=None, tracer=None):
         if not lock:
             raise ValueError("Se requiere un objeto Lock para el handler.")
         
         self.config = config
-        self.db = db
+        # Con el trazado activo cada llamada al almacén se registra como un span 'db.*' (ver src/tracing.py)
+        self.tracer = tracer or NULL_TRACER
+        self.db = TracedStore(db, self.tracer) if self.tracer.enabled else db
         self.server_ip = config['server_ip']
         self.mac_map = {}
         self.conversation_counter = 0
         self.lock = lock
+        # Par de failover opcional (ver src/replication.py): reparte el pool y
+        # evita que el otro servidor del par se trate como servidor intruso.
+        self.failover = failover
+        # Reloj inyectable (ver src/clock.py): el real, o uno virtual en simulaciones
+        self.clock = clock or SYSTEM_CLOCK
         self.logger = DhcpLogger(mode=log_mode, server_ip=self.server_ip, lock=self.lock)
 
         try:
-            self.iface_mac = get_if_hwaddr(config['interface'])
+            # Entero para comparar con la MAC de origen; texto para construir las tramas con scapy
+            self.iface_mac = mac_to_int(get_if_hwaddr(config['interface']))
+            self.iface_mac_text = int_to_mac(self.iface_mac)
         except Exception as e:
             print(f"[ERROR CRÍTICO] No se pudo obtener la MAC de la interfaz '{config['interface']}'. Error: {e}")
             exit(1)
         
+        # Ofertas ya serializadas para clientes conocidos; cualquier cambio en su
+        # concesión (local o replicado) invalida la entrada.
+        cache_cfg = config.get('offer_cache', {})
+        self.offer_cache = None
+        if cache_cfg.get('enabled', True):
+            self.offer_cache = OfferCache(cache_cfg.get('max_entries', 50000), cache_cfg.get('ttl_seconds', 300))
+            db.add_change_listener(self.offer_cache.on_lease_change)
+
+        # Reservas de config.json más las del almacén SQLite, si está activo;
+        # manager.py modifica el almacén y el servidor aplica los cambios en caliente.
+        reservation_cfg = config.get('reservation_store', {})
+        store = ReservationStore(db.db_path) if reservation_cfg.get('enabled', False) else None
+        self.reservations = ReservationMap(store, reservation_cfg.get('refresh_interval_seconds', 5))
+        if self.offer_cache:
+            self.reservations.add_change_listener(self.offer_cache.invalidate)
+        self.reservations.load()
+        self.apply_config(config)
+
+        # Índice en memoria de las concesiones para el asignador, con instantáneas
+        # y diario en disco: un reinicio lo recupera sin recorrer la base de datos.
+        snapshot_cfg = config.get('lease_snapshot', {})
+        self.lease_index = self.snapshotter = None
+        if snapshot_cfg.get('enabled', False):
+            self.lease_index = LeaseIndex(self.clock)
+            self.snapshotter = LeaseSnapshotter(
+                self.lease_index,
+                snapshot_cfg.get('path', 'data/leases.snap'),
+                snapshot_cfg.get('journal_path', 'data/leases.journal'),
+                interval=snapshot_cfg.get('interval_seconds', 300),
+                conversations=self._conversation_state,
+                flush_interval=snapshot_cfg.get('journal_flush_seconds', 1)
+            )
+            self._restore_conversations(*self.snapshotter.restore(db))
+            db.add_change_listener(self.snapshotter.on_lease_change)
+
+        rogue_cfg = config.get('rogue_detection', {})
+        self.rogue_tracker = RogueServerTracker(
+            db,
+            alert_interval=rogue_cfg.get('alert_interval_seconds', 60),
+            flush_interval=rogue_cfg.get('flush_interval_seconds', 30),
+            max_tracked_keys=rogue_cfg.get('max_tracked_keys', 1000)
+        )
+
+        # Limitación de tasa por MAC de origen y por relay (giaddr), aplicada
+        # antes de cualquier acceso a la base de datos.
+        rate_cfg = config.get('rate_limit', {})
+        self.mac_limiter = self.relay_limiter = None
+        if rate_cfg.get('enabled', False):
+            self.mac_limiter = TokenBucketLimiter(
+                rate_cfg.get('per_mac_rate', 5), rate_cfg.get('per_mac_burst', 10),
+                rate_cfg.get('max_tracked_keys', 10000), rate_cfg.get('idle_seconds', 60)
+            )
+            self.relay_limiter = TokenBucketLimiter(
+                rate_cfg.get('per_relay_rate', 200), rate_cfg.get('per_relay_burst', 400),
+                rate_cfg.get('max_tracked_keys', 10000), rate_cfg.get('idle_seconds', 60)
+            )
+
+        # Sondeo ARP/ICMP opcional de las IPs nuevas antes de ofrecerlas. Las
+        # ofertas que esperan a un sondeo se envían después con 'deferred_send',
+        # que asigna el servidor.
+        probe_cfg = config.get('conflict_detection', {})
+        self.conflict_detector = None
+        if probe_cfg.get('enabled', False):
+            self.conflict_detector = ConflictDetector(
+                make_prober(probe_cfg, config['interface']),
+                max_concurrent=probe_cfg.get('max_concurrent', 16),
+                max_pending=probe_cfg.get('max_pending', 256),
+                free_ttl=probe_cfg.get('free_ttl_seconds', 300),
+                in_use_ttl=probe_cfg.get('in_use_ttl_seconds', 3600)
+            )
+        self.deferred_send = None
+
+        # Registros A/PTR de los clientes con hostname (DDNS). El handler solo
+        # anota los cambios; se envían agrupados desde el hilo del actualizador.
+        self.ddns = make_updater(config, self.clock)
+        if self.ddns:
+            db.add_change_listener(self.ddns.on_lease_change)
+
         # --- LÍNEA REDUNDANTE ELIMINADA DE AQUÍ ---
 
+    def apply_config(self, config):
+        """
+        (Re)calcula los datos derivados de la configuración: pool, reservas de
+        config.json y MACs bloqueadas. Interfaz, IP del servidor y límites de tasa solo se
+        leen al arrancar. Con SIGHUP se llama mientras los hilos de paquetes siguen
+        atendiendo: los datos nuevos se calculan fuera del lock y se sustituyen con él tomado.
+        """
+        # Representación interna de IPs (32 bits) y MACs (48 bits) como enteros,
+        # calculada una sola vez. Normalizar las MAC de la configuración evita que
+        # una reserva escrita en mayúsculas o con guiones deje de coincidir.
+        blocked_macs = {mac_to_int(mac) for mac in config.get('blocked_macs', [])}
+        lease_policy = LeasePolicy(config)
+        # Opciones del ámbito principal, codificadas y cacheadas por huella de PRL
+        option_catalogue = OptionCatalogue(config['subnet'], config)
+        scope_catalogues = {
+            scope['name']: OptionCatalogue(scope, config) for scope in config.get('scopes', []) if 'name' in scope
+        }
+        # Reglas de opción 82 compiladas en tablas de búsqueda
+        relay_rules = RelayRuleTable(config.get('relay_rules', []))
+        # IPs de los pools de reglas, excluidas al asignar del pool principal
+        relay_pool_ips = dict.fromkeys(
+            ip for start, end in relay_rules.pools for ip in range(start, end + 1)
+        )
+        # Opciones de DHCPINFORM precalculadas por ámbito
+        inform_responder = InformResponder(config, self.server_ip, self.iface_mac)
+        with self.lock:
+            self.config = config
+            self.pool_start = ip_to_int(config['subnet']['pool_start'])
+            self.pool_end = ip_to_int(config['subnet']['pool_end'])
+            self.reservations.set_static(config.get('reservations', {}))
+            self.blocked_macs = blocked_macs
+            self.lease_policy = lease_policy
+            self.option_catalogue = option_catalogue
+            self.scope_catalogues = scope_catalogues
+            self.relay_rules = relay_rules
+            self.relay_pool_ips = relay_pool_ips
+            self.inform_responder = inform_responder
+            if self.offer_cache:
+                self.offer_cache.clear()
+
     def _get_convo_id(self, mac):
         with self.lock:
-            current_time = time.time()
+            current_time = self.clock.time()
             if mac in self.mac_map:
                 convo_id, timestamp = self.mac_map[mac]
                 if current_time - timestamp < self.CONVERSATION_COOLDOWN_SECONDS:
@@ -51,61 +194,146 @@ class DHCPHandler:
             self.conversation_counter += 1
             new_convo_id = f"Conversación #{self.conversation_counter}"
             self.mac_map[mac] = (new_convo_id, current_time)
-            self.logger.log_new_conversation(mac, self.conversation_counter)
+            self.logger.log_new_conversation(int_to_mac(mac), self.conversation_counter)
             return new_convo_id
 
+    def _conversation_state(self):
+        """Contador y conversaciones abiertas (mac, número, último paquete) para la instantánea."""
+        with self.lock:
+            return self.conversation_counter, [
+                (mac, int(convo_id.rsplit('#', 1)[1]), timestamp) for mac, (convo_id, timestamp) in self.mac_map.items()
+            ]
+
+    def _restore_conversations(self, counter, conversations):
+        # La numeración continúa donde la dejó el proceso anterior
+        with self.lock:
+            self.conversation_counter = max(self.conversation_counter, counter)
+            for mac, number, timestamp in conversations:
+                self.mac_map[mac] = (f"Conversación #{number}", timestamp)
+
     def _clear_convo_id(self, mac):
         with self.lock:
             if mac in self.mac_map:
                 del self.mac_map[mac]
 
     def handle_packet(self, pkt):
+        # Cada paquete abre un contexto de traza; sin trazado, begin/end no hacen nada
+        self.tracer.begin()
+        try:
+            return self._process_packet(pkt)
+        finally:
+            self.tracer.end()
+
+    def _process_packet(self, pkt):
         if not pkt.haslayer(Ether): return None
 
-        src_mac = pkt[Ether].src
+        src_mac_text = pkt[Ether].src
+        src_mac = mac_to_int(src_mac_text)
         
         if src_mac == self.iface_mac:
             return None
-            
-        if pkt.haslayer(UDP) and pkt[UDP].sport == 67:
-            rogue_ip = pkt[IP].src if pkt.haslayer(IP) else "N/A"
-            self.logger.log_rogue_server_detected(src_mac, rogue_ip)
+
+        # Solo una respuesta (BOOTREPLY) delata a un servidor: un relay reenvía
+        # peticiones de clientes también desde el puerto 67.
+        if self._is_server_reply(pkt):
+            rogue_ip = pkt[IP].src if pkt.haslayer(IP) else "0.0.0.0"
+            if self.failover and rogue_ip == self.failover.peer_server_ip:
+                return None
+            if self._reply_server_id(pkt) == self.server_ip:
+                return None  # Respuesta nuestra reenviada por un relay
+            # Se agrega en memoria; solo se avisa al detectarlo y, después, como mucho una vez por intervalo
+            packets = self.rogue_tracker.observe(src_mac, ip_to_int(rogue_ip), now=self.clock.time())
+            if packets:
+                self.logger.log_rogue_server_detected(src_mac_text, rogue_ip, packets)
             return None
 
         if not pkt.haslayer(BOOTP) or not pkt.haslayer(DHCP): return None
 
-        convo_id = self._get_convo_id(src_mac)
-        msg_type_opt = next((opt for opt in pkt[DHCP].options if opt[0] == 'message-type'), None)
+        # Detrás de un relay la MAC de origen es la del router: el cliente se identifica por chaddr
+        giaddr = pkt[BOOTP].giaddr
+        if giaddr != '0.0.0.0':
+            src_mac = int.from_bytes(bytes(pkt[BOOTP].chaddr)[:6], 'big')
+            src_mac_text = int_to_mac(src_mac)
+
+        if self.mac_limiter and self._rate_limited(src_mac, src_mac_text, giaddr):
+            return None
+
+        with self.tracer.span('parse'):
+            convo_id = self._get_convo_id(src_mac)
+            msg_type_opt = next((opt for opt in pkt[DHCP].options if opt[0] == 'message-type'), None)
         if not msg_type_opt: return None
         
         msg_type = msg_type_opt[1]
+        self.tracer.tag(conversation=convo_id, msg_type=int(msg_type), mac=src_mac_text)
         
         if msg_type == DHCPMessageType.DISCOVER:
-            return self._handle_discover(pkt, convo_id)
+            return self._handle_discover(pkt, src_mac, convo_id)
         elif msg_type == DHCPMessageType.REQUEST:
-            return self._handle_request(pkt, convo_id)
+            return self._handle_request(pkt, src_mac, convo_id)
         elif msg_type == DHCPMessageType.RELEASE:
             lease = self.db.get_lease(src_mac)
             if lease:
                 self.db.add_history_log(src_mac, lease['ip'], 'RELEASE')
-                self.logger.log_db_history_update(src_mac, lease['ip'], 'RELEASE', convo_id)
+                self.logger.log_db_history_update(src_mac_text, int_to_ip(lease['ip']), 'RELEASE', convo_id)
             self.db.release_lease(src_mac)
-            self.logger.log_release(src_mac, convo_id)
+            self.logger.log_release(src_mac_text, convo_id)
             self._clear_convo_id(src_mac)
             return None
+        elif msg_type == DHCPMessageType.INFORM:
+            # Sin consultas ni escrituras de concesiones: solo la carga de opciones del ámbito
+            with self.tracer.span('craft.inform'):
+                response = self.inform_responder.build_ack(pkt[BOOTP], src_mac, requested_parameters(pkt))
+            self.logger.log_inform(src_mac_text, pkt[BOOTP].ciaddr, answered=response is not None, convo_id=convo_id)
+            self._clear_convo_id(src_mac)
+            if response is None:
+                return None
+            return PreparedPacket(response, src_mac_text, pkt[BOOTP].ciaddr, DHCPMessageType.ACK)
         elif msg_type == DHCPMessageType.DECLINE:
             requested_ip_opt = next((opt for opt in pkt[DHCP].options if opt[0] == 'requested_addr'), None)
             declined_ip = requested_ip_opt[1] if requested_ip_opt else "N/A"
             self.db.release_lease(src_mac) 
             if declined_ip != "N/A":
+                if self.conflict_detector:
+                    self.conflict_detector.mark_in_use(ip_to_int(declined_ip))
                 self.db.add_history_log(src_mac, declined_ip, 'DECLINE')
-                self.logger.log_db_history_update(src_mac, declined_ip, 'DECLINE', convo_id)
-            self.logger.log_decline(src_mac, declined_ip, convo_id)
+                self.logger.log_db_history_update(src_mac_text, declined_ip, 'DECLINE', convo_id)
+            self.logger.log_decline(src_mac_text, declined_ip, convo_id)
             self._clear_convo_id(src_mac)
             return None
         
         return None
 
+    @staticmethod
+    def _is_server_reply(pkt):
+        if not pkt.haslayer(UDP) or pkt[UDP].sport != 67:
+            return False
+        return pkt[UDP].dport == 68 or (pkt.haslayer(BOOTP) and pkt[BOOTP].op == 2)
+
+    @staticmethod
+    def _reply_server_id(pkt):
+        if not pkt.haslayer(DHCP):
+            return None
+        return next((opt[1] for opt in pkt[DHCP].options if opt[0] == 'server_id'), None)
+
+    @traced('rate_limit')
+    def _rate_limited(self, client_mac, client_mac_text, giaddr):
+        """
+        Consume un token del cliente y, si llega por un relay, del giaddr. El
+        cubo del cliente va por su MAC (chaddr tras un relay), no por la del
+        router, que comparten todos los clientes del relay.
+        """
+        with self.lock:
+            drops = self.mac_limiter.check(client_mac)
+            key = client_mac_text
+            if not drops and giaddr != '0.0.0.0':
+                key = giaddr
+                drops = self.relay_limiter.check(key)
+        if drops == 1:
+            # Solo se avisa al empezar a descartar, no por cada paquete descartado
+            self.logger.log_rate_limited(key)
+        return bool(drops)
+
+    @traced('craft.headers')
     def _craft_response_packet(self, request_pkt, yiaddr, dest_ip="255.255.255.255", dest_mac="ff:ff:ff:ff:ff:ff"):
         use_broadcast = request_pkt[BOOTP].flags & 0x8000
         ciaddr_is_set = request_pkt[BOOTP].ciaddr != '0.0.0.0'
@@ -119,82 +347,231 @@ class DHCPHandler:
             dest_mac = "ff:ff:ff:ff:ff:ff"
 
         return (
-            Ether(src=self.iface_mac, dst=dest_mac) /
+            Ether(src=self.iface_mac_text, dst=dest_mac) /
             IP(src=self.server_ip, dst=dest_ip) /
             UDP(sport=67, dport=68) /
             BOOTP(
-                op=2, yiaddr=str(yiaddr), siaddr=self.server_ip, giaddr=request_pkt[BOOTP].giaddr,
+                op=2, yiaddr=int_to_ip(yiaddr), siaddr=self.server_ip, giaddr=request_pkt[BOOTP].giaddr,
                 xid=request_pkt[BOOTP].xid, chaddr=request_pkt[BOOTP].chaddr, flags=request_pkt[BOOTP].flags
             )
         )
 
-    def _handle_discover(self, pkt, convo_id):
-        client_mac = pkt[Ether].src
+    @traced('craft.options')
+    def _dhcp_options(self, pkt, msg_type, times, rule=None):
+        """
+        Opciones de la respuesta: las obligatorias (tipo, servidor, tiempos de
+        concesión) seguidas del bloque del catálogo ya codificado para la PRL
+        (opción 55) del cliente, en el orden en que las pidió. Si la petición
+        llegó con opción 82 se devuelve tal cual al relay (RFC 3046).
+        """
+        catalogue = self.scope_catalogues.get(rule.scope, self.option_catalogue) if rule else self.option_catalogue
+        block = catalogue.block_for(requested_parameters(pkt))
+        relay_data = relay_agent_option(pkt)
+        if relay_data:
+            block += bytes([82, len(relay_data)]) + relay_data
+        return DHCP(options=[
+            ("message-type", msg_type), ("server_id", self.server_ip),
+            ("lease_time", times.lease), ("renewal_time", times.t1), ("rebinding_time", times.t2)
+        ]) / Raw(load=block + b'\xff')
+
+    @traced('policy.relay_rule')
+    def _relay_rule(self, pkt):
+        """Regla de opción 82 que corresponde al paquete, o None."""
+        if not self.relay_rules:
+            return None
+        relay_data = relay_agent_option(pkt)
+        return self.relay_rules.classify(parse_suboptions(relay_data)) if relay_data else None
+
+    def _pool_for(self, rule):
+        """Pool del que asignar: el de la regla de relay si fija uno, o el principal."""
+        return rule.pool if rule and rule.pool else (self.pool_start, self.pool_end)
+
+    @traced('policy.lease_times')
+    def _lease_times(self, pkt, client_mac, rule=None):
+        """Duración, T1 y T2 para este cliente según la política de concesiones."""
+        vendor_opt = next((opt for opt in pkt[DHCP].options if opt[0] == 'vendor_class_id'), None)
+        vendor_class = vendor_opt[1].decode(errors='ignore') if vendor_opt else None
+        return self.lease_policy.for_client(client_mac, vendor_class, rule.lease_class if rule else None)
+
+    def _parse_ip(self, value):
+        """Convierte una IP recibida en el paquete a entero (None si no es válida)."""
+        try:
+            return ip_to_int(value)
+        except ValueError:
+            return None
+
+    def _handle_discover(self, pkt, client_mac, convo_id):
+        mac_text = int_to_mac(client_mac)
         
         hostname_opt = next((opt for opt in pkt[DHCP].options if opt[0] == 'hostname'), None)
         hostname = hostname_opt[1].decode(errors='ignore') if hostname_opt else None
 
-        if client_mac in self.config.get('blocked_macs', []):
-            self.logger.log_blocked(client_mac, convo_id)
+        if client_mac in self.blocked_macs:
+            self.logger.log_blocked(mac_text, convo_id)
             self._clear_convo_id(client_mac)
             return None
 
-        self.logger.log_discover(client_mac, hostname, convo_id)
-        
-        ip_to_offer = self.config['reservations'].get(client_mac)
+        self.logger.log_discover(mac_text, hostname, convo_id)
+
+        # Camino rápido: cliente conocido cuya oferta ya está serializada en memoria
+        variant = None
+        if self.offer_cache:
+            bootp = pkt[BOOTP]
+            vendor_opt = next((opt for opt in pkt[DHCP].options if opt[0] == 'vendor_class_id'), None)
+            # Vendor class, PRL y opción 82 entran en la variante: cambian los tiempos y las opciones de la oferta
+            variant = (bootp.flags, bootp.giaddr, bootp.ciaddr, bootp.chaddr, vendor_opt, requested_parameters(pkt),
+                       relay_agent_option(pkt))
+            with self.tracer.span('offer_cache'):
+                cached = self.offer_cache.get(client_mac, variant, bootp.xid, now=self.clock.time())
+            if cached:
+                packet_bytes, ip_to_offer = cached
+                ip_text = int_to_ip(ip_to_offer)
+                self.logger.log_offer(mac_text, ip_text, convo_id)
+                return PreparedPacket(packet_bytes, mac_text, ip_text, DHCPMessageType.OFFER)
+
+        return self._offer(pkt, client_mac, convo_id, variant)
+
+    def _offer(self, pkt, client_mac, convo_id, variant, probed_ip=None):
+        """
+        Elige la IP y construye el DHCPOFFER. Devuelve None si no hay IP libre
+        o si la candidata se está sondeando: en ese caso la oferta se completa
+        y se envía desde _complete_deferred_offer.
+        """
+        mac_text = int_to_mac(client_mac)
+        lease = None
+        rule = self._relay_rule(pkt)
+        ip_to_offer = self.reservations.get(client_mac)
         if not ip_to_offer:
             lease = self.db.get_lease(client_mac)
-            ip_to_offer = lease['ip'] if lease else self.db.find_available_ip(
-                self.config['subnet']['pool_start'], self.config['subnet']['pool_end'], self.config['reservations']
-            )
-        
+            pool_start, pool_end = self._pool_for(rule)
+            reserved = self.reservations.by_ip
+            if self.relay_pool_ips and not (rule and rule.pool):
+                reserved = ChainMap(reserved, self.relay_pool_ips)
+            if lease and rule and rule.pool and not pool_start <= lease['ip'] <= pool_end:
+                lease = None  # El cliente ha cambiado de puerto/relay: se le asigna del pool que le corresponde ahora
+            if self.failover:
+                pool_start, pool_end = self.failover.allocation_range(pool_start, pool_end)
+            if lease:
+                ip_to_offer = lease['ip']
+            else:
+                ip_to_offer = self._free_candidate(
+                    pool_start, pool_end, reserved, convo_id, (client_mac, pkt[BOOTP].xid),
+                    lambda ip, in_use: self._complete_deferred_offer(pkt, client_mac, convo_id, variant, ip, in_use),
+                    probed_ip
+                )
+                if ip_to_offer == PROBE_PENDING:
+                    return None
+
         if not ip_to_offer:
             self.logger.log_no_ips_available(convo_id)
             self._clear_convo_id(client_mac)
             return None
             
-        self.logger.log_offer(client_mac, ip_to_offer, convo_id)
+        self.logger.log_offer(mac_text, int_to_ip(ip_to_offer), convo_id)
+        times = self._lease_times(pkt, client_mac, rule)
         response_pkt = self._craft_response_packet(pkt, ip_to_offer)
-        response_pkt /= DHCP(options=[("message-type", DHCPMessageType.OFFER), ("server_id", self.server_ip), ("lease_time", self.config['lease_time_seconds']), ("subnet_mask", self.config['subnet']['mask']), ("router", self.config['subnet']['gateway']), ("name_server", *self.config['dns_servers']), ("domain", self.config['domain_name'].encode()), "end"])
+        response_pkt /= self._dhcp_options(pkt, DHCPMessageType.OFFER, times, rule)
+
+        # Solo se cachean las ofertas estables (reserva o concesión vigente), no
+        # las IPs recién elegidas del pool, que aún no son del cliente.
+        if self.offer_cache and (lease or client_mac in self.reservations):
+            self.offer_cache.put(client_mac, variant, bytes(response_pkt), ip_to_offer,
+                                 lease['expires_at'] if lease else None, now=self.clock.time())
         return response_pkt
 
-    def _handle_request(self, pkt, convo_id):
-        client_mac = pkt[Ether].src
+    @traced('policy.pool')
+    def _free_candidate(self, pool_start, pool_end, reserved, convo_id, client, on_probe_done, probed_ip=None):
+        """
+        Primera IP libre del pool que no esté en 'reserved'. Con la detección
+        de conflictos activa se saltan las que responden al sondeo y las que
+        se sondean para otro cliente; devuelve PROBE_PENDING si la candidata
+        de 'client' (MAC, xid) aún se está sondeando. 'probed_ip', la IP ya
+        sondeada para este cliente, se prefiere si sigue libre.
+        """
+        if not self.conflict_detector:
+            return self._find_available_ip(pool_start, pool_end, reserved)
+        for _ in range(self.MAX_PROBE_CANDIDATES):
+            # Vista combinada sin copiar el índice de reservas, que puede tener decenas de miles de IPs
+            busy = self.conflict_detector.in_use_ips() | self.conflict_detector.pending_ips(client[0])
+            excluded = ChainMap(reserved, dict.fromkeys(busy))
+            ip = None
+            if probed_ip is not None and pool_start <= probed_ip <= pool_end:
+                ip = self._find_available_ip(probed_ip, probed_ip, excluded)
+                probed_ip = None
+            if ip is None:
+                ip = self._find_available_ip(pool_start, pool_end, excluded)
+            if ip is None:
+                return None
+            status = self.conflict_detector.check(ip, on_probe_done, client)
+            if status == PROBE_FREE:
+                return ip
+            if status == PROBE_PENDING:
+                self.logger.log_probe_pending(int_to_ip(ip), convo_id)
+                return PROBE_PENDING
+        return None
+
+    def _find_available_ip(self, pool_start, pool_end, excluded):
+        if self.lease_index is None:
+            return self.db.find_available_ip(pool_start, pool_end, excluded)
+        # Búsqueda en memoria; el almacén solo confirma la candidata elegida
+        return self.lease_index.find_available_ip(pool_start, pool_end, excluded, self.db)
+
+    def _complete_deferred_offer(self, pkt, client_mac, convo_id, variant, ip, in_use):
+        """
+        Se ejecuta en el pool de sondeos al terminar el de 'ip'. Repite la
+        selección, que ahora encuentra el resultado en la caché del detector
+        y prefiere 'ip' si quedó libre, y envía la oferta resultante.
+        """
+        if in_use:
+            self.logger.log_probe_conflict(int_to_ip(ip), convo_id)
+        response = self._offer(pkt, client_mac, convo_id, variant, probed_ip=ip)
+        if response is not None and self.deferred_send:
+            self.deferred_send(response)
+
+    def _handle_request(self, pkt, client_mac, convo_id):
+        mac_text = int_to_mac(client_mac)
         client_ip_from_ciaddr = pkt[BOOTP].ciaddr
         
         hostname_opt = next((opt for opt in pkt[DHCP].options if opt[0] == 'hostname'), None)
         hostname = hostname_opt[1].decode(errors='ignore') if hostname_opt else None
 
+        rule = self._relay_rule(pkt)
+
         if client_ip_from_ciaddr != '0.0.0.0': # Proceso de renovación
-            self.logger.log_renewal_request(client_mac, client_ip_from_ciaddr, convo_id)
+            self.logger.log_renewal_request(mac_text, client_ip_from_ciaddr, convo_id)
             
+            client_ip = self._parse_ip(client_ip_from_ciaddr)
             lease = self.db.get_lease(client_mac)
-            if lease and lease['ip'] == client_ip_from_ciaddr:
-                self.db.add_lease(client_mac, client_ip_from_ciaddr, self.config['lease_time_seconds'])
-                self.db.add_history_log(client_mac, client_ip_from_ciaddr, 'RENEW')
-                self.logger.log_db_history_update(client_mac, client_ip_from_ciaddr, 'RENEW', convo_id)
-                self.logger.log_ack(client_mac, client_ip_from_ciaddr, convo_id, is_renewal=True)
+            if lease and lease['ip'] == client_ip:
+                times = self._lease_times(pkt, client_mac, rule)
+                # Expiración y evento RENEW se agrupan en memoria (ver LeaseDatabase.renew_lease)
+                self.db.renew_lease(client_mac, client_ip, times.lease)
+                if self.ddns:
+                    self.ddns.register(client_mac, client_ip, hostname)
+                self.logger.log_db_history_update(mac_text, client_ip_from_ciaddr, 'RENEW', convo_id)
+                self.logger.log_ack(mac_text, client_ip_from_ciaddr, convo_id, is_renewal=True)
                 
-                response_pkt = self._craft_response_packet(pkt, client_ip_from_ciaddr)
-                response_pkt /= DHCP(options=[("message-type", DHCPMessageType.ACK), ("server_id", self.server_ip), ("lease_time", self.config['lease_time_seconds']), ("subnet_mask", self.config['subnet']['mask']), ("router", self.config['subnet']['gateway']), ("name_server", *self.config['dns_servers']), ("domain", self.config['domain_name'].encode()), "end"])
+                response_pkt = self._craft_response_packet(pkt, client_ip)
+                response_pkt /= self._dhcp_options(pkt, DHCPMessageType.ACK, times, rule)
                 self._clear_convo_id(client_mac)
                 return response_pkt
             else:
-                self.logger.log_nak(client_mac, client_ip_from_ciaddr, convo_id)
+                self.logger.log_nak(mac_text, client_ip_from_ciaddr, convo_id)
                 self._clear_convo_id(client_mac)
                 return self._handle_nak(pkt)
         
         else: # Proceso de asignación inicial (selección)
             requested_ip_opt = next((opt for opt in pkt[DHCP].options if opt[0] == 'requested_addr'), None)
-            requested_ip = requested_ip_opt[1] if requested_ip_opt else None
+            requested_ip_text = requested_ip_opt[1] if requested_ip_opt else None
+            requested_ip = self._parse_ip(requested_ip_text) if requested_ip_text else None
             
             server_id_opt = next((opt for opt in pkt[DHCP].options if opt[0] == 'server_id'), None)
             server_id = server_id_opt[1] if server_id_opt else None
             
             is_for_other_server = server_id and server_id != self.server_ip
-            is_valid = self._validate_requested_ip(client_mac, requested_ip)
+            is_valid = self._validate_requested_ip(client_mac, requested_ip, self._pool_for(rule))
             
-            self.logger.log_request(client_mac, requested_ip, server_id, leads_to_nak=(not is_valid), is_for_other_server=is_for_other_server, hostname=hostname, convo_id=convo_id)
+            self.logger.log_request(mac_text, requested_ip_text, server_id, leads_to_nak=(not is_valid), is_for_other_server=is_for_other_server, hostname=hostname, convo_id=convo_id)
             
             if is_for_other_server:
                 self.logger.log_request_ignored(convo_id)
@@ -202,45 +579,54 @@ class DHCPHandler:
                 return None
                 
             if not is_valid:
-                self.logger.log_nak(client_mac, requested_ip, convo_id)
+                self.logger.log_nak(mac_text, requested_ip_text, convo_id)
                 self._clear_convo_id(client_mac)
                 return self._handle_nak(pkt)
 
-            self.db.add_lease(client_mac, requested_ip, self.config['lease_time_seconds'])
+            times = self._lease_times(pkt, client_mac, rule)
+            if not self.db.assign_lease(client_mac, requested_ip, times.lease):
+                # Otro proceso que comparte el almacén la concedió entre la validación y la escritura
+                self.logger.log_nak(mac_text, requested_ip_text, convo_id)
+                self._clear_convo_id(client_mac)
+                return self._handle_nak(pkt)
             self.db.add_history_log(client_mac, requested_ip, 'ASSIGN')
-            self.logger.log_db_history_update(client_mac, requested_ip, 'ASSIGN', convo_id)
-            self.logger.log_ack(client_mac, requested_ip, convo_id, is_renewal=False)
+            if self.ddns:
+                self.ddns.register(client_mac, requested_ip, hostname)
+            self.logger.log_db_history_update(mac_text, requested_ip_text, 'ASSIGN', convo_id)
+            self.logger.log_ack(mac_text, requested_ip_text, convo_id, is_renewal=False)
             
             lease_info = self.db.get_lease(client_mac)
             if lease_info:
-                self.logger.log_db_update(client_mac, requested_ip, time.ctime(lease_info['expires_at']), convo_id)
+                self.logger.log_db_update(mac_text, requested_ip_text, time.ctime(lease_info['expires_at']), convo_id)
 
             response_pkt = self._craft_response_packet(pkt, requested_ip)
-            response_pkt /= DHCP(options=[("message-type", DHCPMessageType.ACK), ("server_id", self.server_ip), ("lease_time", self.config['lease_time_seconds']), ("subnet_mask", self.config['subnet']['mask']), ("router", self.config['subnet']['gateway']), ("name_server", *self.config['dns_servers']), ("domain", self.config['domain_name'].encode()), "end"])
+            response_pkt /= self._dhcp_options(pkt, DHCPMessageType.ACK, times, rule)
             self._clear_convo_id(client_mac)
             return response_pkt
 
-    def _validate_requested_ip(self, mac, ip):
-        if not ip or ip == '0.0.0.0': return False
-        if self.config['reservations'].get(mac) == ip: return True
+    @traced('policy.validate')
+    def _validate_requested_ip(self, mac, ip, pool=None):
+        # 'ip' llega ya convertida a entero (None si el cliente no envió una IP válida)
+        # 'pool' es (inicio, fin) del pool que corresponde al cliente; por defecto el principal
+        pool_start, pool_end = pool or (self.pool_start, self.pool_end)
+        if not ip: return False
+        if self.reservations.get(mac) == ip: return True
         
-        active_leases = self.db.get_active_leases()
-        if ip in active_leases and active_leases[ip] != mac:
+        holder = self.db.get_lease_holder(ip)
+        if holder is not None and holder != mac:
             return False 
-        
-        try:
-            pool_start = int(IPv4Address(self.config['subnet']['pool_start']))
-            pool_end = int(IPv4Address(self.config['subnet']['pool_end']))
-            req_ip_int = int(IPv4Address(ip))
-        except ValueError: 
-            return False
             
-        if pool_start <= req_ip_int <= pool_end or ip in self.config['reservations'].values():
+        if pool_start <= ip <= pool_end or ip in self.reservations.by_ip:
             return True
                 
         return False
         
+    @traced('craft.nak')
     def _handle_nak(self, pkt):
-        response_pkt = self._craft_response_packet(pkt, '0.0.0.0')
-        response_pkt /= DHCP(options=[("message-type", DHCPMessageType.NAK), ("server_id", self.server_ip), "end"])
+        response_pkt = self._craft_response_packet(pkt, 0)
+        options = [("message-type", DHCPMessageType.NAK), ("server_id", self.server_ip)]
+        relay_data = relay_agent_option(pkt)
+        if relay_data:
+            options.append(("relay_agent_information", relay_data))
+        response_pkt /= DHCP(options=options + ["end"])
         return response_pkt
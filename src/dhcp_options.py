@@ -0,0 +1,81 @@
+# src/dhcp_options.py
+import threading
+
+from scapy.all import DHCP
+from scapy.layers.dhcp import DHCPRevOptions
+
+# Opciones enviadas si el cliente no incluye la lista de parámetros (opción 55)
+DEFAULT_PRL = (1, 3, 6, 15)
+
+
+def encode_option(name, value):
+    """Codifica una opción como TLV usando la definición de scapy."""
+    values = value if isinstance(value, list) else [value]
+    return bytes(DHCP(options=[(name, *values)]))
+
+
+class OptionCatalogue:
+    """
+    Catálogo de opciones configurables de un ámbito, ya codificadas como TLV.
+
+    Cubre la máscara, el router, los DNS y el dominio del ámbito, más las
+    opciones extra de 'dhcp_options' en la configuración: por nombre de
+    scapy ("NTP_server": ["192.168.1.1"]) o por código numérico con un
+    valor de texto ("66": "tftp.home.local").
+
+    block_for(prl) devuelve las opciones pedidas en la opción 55, en el
+    orden pedido y omitiendo las que no existen en el catálogo. El bloque
+    se cachea por huella de la PRL: cada sistema operativo pide siempre la
+    misma lista, así que en la práctica hay pocas entradas.
+    """
+
+    MAX_FINGERPRINTS = 256
+
+    def __init__(self, scope, config):
+        options = {
+            'subnet_mask': scope['mask'],
+            'router': scope['gateway'],
+            'name_server': scope.get('dns_servers', config['dns_servers']),
+            'domain': scope.get('domain_name', config['domain_name']).encode(),
+        }
+        options.update(config.get('dhcp_options', {}))
+        options.update(scope.get('dhcp_options', {}))
+
+        self.encoded = {}
+        for key, value in options.items():
+            if str(key).isdigit():
+                data = value.encode() if isinstance(value, str) else bytes(value)
+                self.encoded[int(key)] = bytes([int(key), len(data)]) + data
+            elif key in DHCPRevOptions:
+                self.encoded[DHCPRevOptions[key][0]] = encode_option(key, value)
+            else:
+                raise ValueError(f"Opción DHCP desconocida en la configuración: '{key}'.")
+        self.blocks = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def block_for(self, prl=None):
+        fingerprint = tuple(prl) if prl else DEFAULT_PRL
+        block = self.blocks.get(fingerprint)
+        if block is not None:
+            self.hits += 1
+            return block
+        self.misses += 1
+        seen = set()
+        parts = []
+        for code in fingerprint:
+            if code in self.encoded and code not in seen:
+                seen.add(code)
+                parts.append(self.encoded[code])
+        block = b''.join(parts)
+        with self._lock:
+            if len(self.blocks) >= self.MAX_FINGERPRINTS:
+                self.blocks.clear()
+            self.blocks[fingerprint] = block
+        return block
+
+
+def requested_parameters(pkt):
+    """Lista de parámetros pedidos (opción 55) del paquete, o None."""
+    return next((opt[1] for opt in pkt[DHCP].options if opt[0] == 'param_req_list'), None)
@@ -0,0 +1,137 @@
+# src/history_archive.py
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+HISTORY_COLUMNS = "history_id, mac, ip_address, event_type, event_timestamp"
+
+
+def month_bounds(timestamp):
+    """Devuelve (inicio, fin) en epoch UTC del mes que contiene 'timestamp'."""
+    moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def partition_path(archive_dir, timestamp):
+    """Ruta del fichero de archivo mensual (history_AAAA_MM.db) para 'timestamp'."""
+    moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    return os.path.join(archive_dir, f"history_{moment.year:04d}_{moment.month:02d}.db")
+
+
+def list_partitions(archive_dir, newest_first=True):
+    """Lista las particiones de archivo existentes, ordenadas por mes."""
+    return sorted(glob.glob(os.path.join(archive_dir, "history_*.db")), reverse=newest_first)
+
+
+class HistoryArchiver:
+    """
+    Traslada los eventos de 'leases_history' más antiguos que el periodo de
+    retención a bases de datos SQLite mensuales dentro de 'archive_dir'.
+    Usa su propia conexión y trabaja por lotes para no bloquear al servidor.
+    """
+
+    def __init__(self, db_path, archive_dir='data/archive', retention_days=30,
+                 interval_seconds=3600, batch_size=5000):
+        self.db_path = db_path
+        self.archive_dir = archive_dir
+        self.retention_seconds = int(retention_days * 86400)
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def run_once(self, now=None):
+        """Ejecuta una pasada de archivado. Devuelve el número de eventos movidos."""
+        cutoff = int(now if now is not None else time.time()) - self.retention_seconds
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (history_id INTEGER PRIMARY KEY)")
+            moved = 0
+            while not self._stop_event.is_set():
+                oldest = conn.execute(
+                    "SELECT MIN(event_timestamp) FROM leases_history WHERE event_timestamp < ?", (cutoff,)
+                ).fetchone()[0]
+                if oldest is None:
+                    break
+                month_start, month_end = month_bounds(oldest)
+                moved += self._archive_month(conn, partition_path(self.archive_dir, oldest),
+                                             month_start, min(month_end, cutoff))
+            if moved:
+                # Devuelve al sistema las páginas liberadas (no-op si la BD no usa auto_vacuum incremental)
+                conn.execute("PRAGMA incremental_vacuum").fetchall()
+            return moved
+        finally:
+            conn.close()
+
+    def _archive_month(self, conn, path, start, end):
+        conn.execute("ATTACH DATABASE ? AS part", (path,))
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS part.leases_history (
+                    history_id INTEGER PRIMARY KEY,
+                    mac TEXT NOT NULL,
+                    ip_address TEXT NOT NULL,
+                    event_type TEXT NOT NULL,
+                    event_timestamp INTEGER NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS part.idx_history_timestamp ON leases_history (event_timestamp)")
+            conn.commit()
+
+            moved = 0
+            while not self._stop_event.is_set():
+                # Cada lote es una transacción corta: copia al archivo y borra del histórico vivo
+                conn.execute("DELETE FROM temp.archive_batch")
+                conn.execute(
+                    "INSERT INTO temp.archive_batch SELECT history_id FROM main.leases_history "
+                    "WHERE event_timestamp >= ? AND event_timestamp < ? LIMIT ?",
+                    (start, end, self.batch_size)
+                )
+                batch = conn.execute("SELECT COUNT(*) FROM temp.archive_batch").fetchone()[0]
+                if not batch:
+                    conn.commit()
+                    break
+                conn.execute(
+                    f"INSERT OR IGNORE INTO part.leases_history ({HISTORY_COLUMNS}) "
+                    f"SELECT {HISTORY_COLUMNS} FROM main.leases_history "
+                    "WHERE history_id IN (SELECT history_id FROM temp.archive_batch)"
+                )
+                conn.execute(
+                    "DELETE FROM main.leases_history WHERE history_id IN (SELECT history_id FROM temp.archive_batch)"
+                )
+                conn.commit()
+                moved += batch
+            return moved
+        finally:
+            conn.rollback()
+            conn.execute("DETACH DATABASE part")
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                moved = self.run_once()
+                if moved:
+                    print(f"[ARCHIVO] {moved} eventos del histórico movidos a '{self.archive_dir}'.")
+            except sqlite3.Error as e:
+                print(f"[ARCHIVO] Error durante el archivado del histórico: {e}")
+            self._stop_event.wait(self.interval_seconds)
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="history-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
@@ -0,0 +1,87 @@
+# src/inform.py
+import socket
+import struct
+
+from scapy.all import DHCP
+
+from src.dhcp_options import OptionCatalogue
+from src.net_utils import ip_to_int
+
+DHCP_ACK = 5
+MAGIC_COOKIE = b'\x63\x82\x53\x63'
+BROADCAST_MAC = b'\xff' * 6
+BROADCAST_IP = b'\xff' * 4
+
+ETHER_HEADER = struct.Struct('!6s6sH')
+IP_HEADER = struct.Struct('!BBHHHBBH4s4s')
+UDP_HEADER = struct.Struct('!HHHH')
+# op, htype, hlen, hops, xid, secs, flags, ciaddr, yiaddr, siaddr, giaddr, chaddr (sname/file van a cero)
+BOOTP_HEADER = struct.Struct('!BBBBIHH4s4s4s4s16s')
+BOOTP_PADDING = bytes(64 + 128)
+
+
+def _ip_checksum(header):
+    total = sum(struct.unpack('!10H', header))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+class InformResponder:
+    """
+    Responde a DHCPINFORM (clientes con IP estática que solo piden la
+    configuración) sin consultar ni escribir concesiones.
+
+    Para cada ámbito (la subred principal y las de 'scopes' en la
+    configuración) se precalcula una vez la cabecera de opciones del DHCPACK
+    y su catálogo (ver src/dhcp_options.py), que cachea el bloque de cada
+    PRL. Al responder solo se empaquetan las cabeceras con struct y se
+    concatenan esas cargas ya serializadas, sin construir el paquete con scapy.
+    """
+
+    def __init__(self, config, server_ip, iface_mac):
+        self.server_ip = socket.inet_aton(server_ip)
+        self.iface_mac = iface_mac.to_bytes(6, 'big')
+        self.scopes = []
+        head = MAGIC_COOKIE + bytes(DHCP(options=[("message-type", DHCP_ACK), ("server_id", server_ip)]))
+        for scope in [config['subnet']] + config.get('scopes', []):
+            network = ip_to_int(scope['network'])
+            mask = ip_to_int(scope['mask'])
+            self.scopes.append((network & mask, mask, head, OptionCatalogue(scope, config)))
+
+    def payload_for(self, ip, prl=None):
+        """Opciones del DHCPACK para 'ip' (entero) y la PRL del cliente, o None si no es de ningún ámbito."""
+        for network, mask, head, catalogue in self.scopes:
+            if ip & mask == network:
+                return head + catalogue.block_for(prl) + b'\xff'
+        return None
+
+    def build_ack(self, bootp, client_mac, prl=None):
+        """
+        Construye la trama DHCPACK para el BOOTP de un DHCPINFORM. Devuelve
+        None si ciaddr no pertenece a ningún ámbito del servidor.
+        """
+        ciaddr = ip_to_int(bootp.ciaddr)
+        payload = self.payload_for(ciaddr, prl)
+        if payload is None:
+            return None
+
+        # Mismo criterio de destino que DHCPHandler._craft_response_packet
+        giaddr = socket.inet_aton(bootp.giaddr)
+        if giaddr != b'\x00' * 4:
+            dst_mac, dst_ip = BROADCAST_MAC, giaddr
+        elif bootp.flags & 0x8000:
+            dst_mac, dst_ip = BROADCAST_MAC, BROADCAST_IP
+        else:
+            dst_mac, dst_ip = client_mac.to_bytes(6, 'big'), ciaddr.to_bytes(4, 'big')
+
+        bootp_bytes = BOOTP_HEADER.pack(
+            2, 1, 6, 0, bootp.xid, 0, int(bootp.flags), ciaddr.to_bytes(4, 'big'), bytes(4),
+            self.server_ip, giaddr, bootp.chaddr[:16].ljust(16, b'\x00')
+        ) + BOOTP_PADDING + payload
+        udp_length = UDP_HEADER.size + len(bootp_bytes)
+        # Checksum UDP 0: opcional en IPv4
+        udp = UDP_HEADER.pack(67, 68, udp_length, 0)
+        ip_header = IP_HEADER.pack(0x45, 0, IP_HEADER.size + udp_length, 1, 0, 64, 17, 0, self.server_ip, dst_ip)
+        ip_header = ip_header[:10] + _ip_checksum(ip_header).to_bytes(2, 'big') + ip_header[12:]
+        return ETHER_HEADER.pack(dst_mac, self.iface_mac, 0x0800) + ip_header + udp + bootp_bytes
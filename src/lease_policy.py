@@ -0,0 +1,73 @@
+# src/lease_policy.py
+import zlib
+from collections import namedtuple
+
+from src.net_utils import normalize_mac
+
+LeaseTimes = namedtuple('LeaseTimes', ['lease', 't1', 't2'])
+
+
+class LeasePolicy:
+    """
+    Calcula por cliente la duración de la concesión y los tiempos T1
+    (renewal_time) y T2 (rebinding_time).
+
+    T1 y T2 se desplazan un porcentaje ('jitter_percent') hacia arriba o
+    hacia abajo según un hash de la MAC. El desplazamiento es determinista,
+    así que cada cliente conserva su hueco de renovación ciclo tras ciclo y
+    los equipos que arrancan a la vez no renuevan todos en el mismo instante.
+
+    Las clases de 'classes' sobrescriben los valores por defecto para los
+    clientes cuya MAC empiece por alguno de 'mac_prefixes' o cuyo vendor
+    class (opción 60) empiece por alguno de 'vendor_classes'. Gana la
+    primera clase que coincida.
+    """
+
+    def __init__(self, config):
+        policy_cfg = config.get('lease_policy', {})
+        self.default = self._compile_class(policy_cfg, {
+            'lease_time_seconds': config['lease_time_seconds'],
+            't1_ratio': 0.5,
+            't2_ratio': 0.875,
+            'jitter_percent': 0
+        })
+        self.classes = [self._compile_class(cls, self.default) for cls in policy_cfg.get('classes', [])]
+        self.by_name = {cls['name']: cls for cls in self.classes}
+
+    @staticmethod
+    def _compile_class(cls, defaults):
+        compiled = {key: cls.get(key, defaults[key]) for key in ('lease_time_seconds', 't1_ratio', 't2_ratio', 'jitter_percent')}
+        if not 0 < compiled['t1_ratio'] < compiled['t2_ratio'] < 1:
+            raise ValueError(f"Política de concesión no válida: se requiere 0 < t1_ratio < t2_ratio < 1 ({cls.get('name', 'por defecto')}).")
+        compiled['name'] = cls.get('name', 'por defecto')
+        # Cada prefijo de MAC se guarda como (desplazamiento, valor): coincide si mac >> desplazamiento == valor
+        compiled['mac_prefixes'] = []
+        for prefix in cls.get('mac_prefixes', []):
+            digits = normalize_mac(prefix)
+            shift = 48 - 4 * len(digits)
+            compiled['mac_prefixes'].append((shift, int(digits, 16)))
+        compiled['vendor_classes'] = tuple(cls.get('vendor_classes', []))
+        return compiled
+
+    def _match(self, mac, vendor_class):
+        for cls in self.classes:
+            if any(mac >> shift == value for shift, value in cls['mac_prefixes']):
+                return cls
+            if vendor_class and cls['vendor_classes'] and vendor_class.startswith(cls['vendor_classes']):
+                return cls
+        return self.default
+
+    def for_client(self, mac, vendor_class=None, class_name=None):
+        """
+        Devuelve LeaseTimes(lease, t1, t2) en segundos para la MAC (entero de
+        48 bits). 'class_name' fuerza una clase concreta (p. ej. la elegida
+        por una regla de relay, ver src/relay_agent.py).
+        """
+        cls = self.by_name.get(class_name) or self._match(mac, vendor_class)
+        lease = cls['lease_time_seconds']
+        # Fracción estable en [-1, 1) derivada de la MAC
+        spread = zlib.crc32(mac.to_bytes(6, 'big')) / 0x80000000 - 1
+        factor = 1 + spread * cls['jitter_percent'] / 100
+        t2 = min(int(lease * cls['t2_ratio'] * factor), lease - 1)
+        t1 = min(int(lease * cls['t1_ratio'] * factor), t2 - 1)
+        return LeaseTimes(lease, max(t1, 1), max(t2, 2))
@@ -0,0 +1,311 @@
+# src/lease_snapshot.py
+import os
+import struct
+import threading
+import time
+import zlib
+
+from src.clock import SYSTEM_CLOCK
+from src.lease_store import LeaseStore
+
+# Instantánea: cabecera, concesiones, conversaciones y CRC32 de todo lo anterior
+SNAPSHOT_MAGIC = b'DHLS'
+# magia, versión, generación, creada, secuencia de cambios externos, contador, concesiones, conversaciones
+SNAPSHOT_HEADER = struct.Struct('<4sHQqQIII')
+LEASE_RECORD = struct.Struct('<QIq')  # mac, ip, expires_at
+CONVERSATION_RECORD = struct.Struct('<QId')  # mac, número de conversación, último paquete
+CRC = struct.Struct('<I')
+
+# Diario: cabecera con la generación de su instantánea y registros con su propio CRC32
+JOURNAL_MAGIC = b'DHLJ'
+JOURNAL_HEADER = struct.Struct('<4sHQ')  # magia, versión, generación
+JOURNAL_RECORD = struct.Struct('<BQIq')  # op, mac, ip, expires_at
+
+FORMAT_VERSION = 2
+
+
+class SnapshotError(Exception):
+    """Instantánea ausente, truncada, corrupta o de otra versión."""
+
+
+class LeaseIndex:
+    """
+    Espejo en memoria de las concesiones del servidor: 'by_mac' (MAC -> (IP,
+    expiración)) y 'by_ip' (IP -> MAC). Se mantiene con los cambios que
+    notifica el almacén (ver LeaseStore.add_change_listener) y sirve al
+    asignador para elegir IP sin recorrer la tabla 'leases'.
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock or SYSTEM_CLOCK
+        self.by_mac = {}
+        self.by_ip = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.by_mac)
+
+    def load(self, leases):
+        """Sustituye el contenido por las concesiones (mac, ip, expires_at) dadas."""
+        by_mac = {mac: (ip, expires_at) for mac, ip, expires_at in leases}
+        by_ip = {ip: mac for mac, (ip, _) in by_mac.items()}
+        with self.lock:
+            self.by_mac, self.by_ip = by_mac, by_ip
+
+    def apply(self, op, mac, ip, expires_at):
+        """Aplica un cambio; hay que llamarlo con 'lock' tomado."""
+        previous = self.by_mac.pop(mac, None)
+        if previous and self.by_ip.get(previous[0]) == mac:
+            del self.by_ip[previous[0]]
+        if op == LeaseStore.LEASE_SET:
+            self.by_mac[mac] = (ip, expires_at)
+            self.by_ip[ip] = mac
+
+    def holder(self, ip, now):
+        mac = self.by_ip.get(ip)
+        if mac is None:
+            return None
+        entry = self.by_mac.get(mac)
+        return mac if entry and entry[0] == ip and entry[1] > now else None
+
+    def find_available_ip(self, pool_start, pool_end, reserved_ips, store=None):
+        """
+        Primera IP del pool sin concesión vigente en el índice. Con 'store'
+        se confirma la candidata en el almacén (una consulta por clave): si
+        otro proceso la concedió, p. ej. una importación con manager.py, se
+        corrige el índice y se sigue buscando.
+        """
+        now = self.clock.time()
+        for ip in range(pool_start, pool_end + 1):
+            if ip in reserved_ips or self.holder(ip, now) is not None:
+                continue
+            if store is not None:
+                mac = store.get_lease_holder(ip)
+                lease = store.get_lease(mac) if mac is not None else None
+                if lease:
+                    with self.lock:
+                        self.apply(LeaseStore.LEASE_SET, mac, lease['ip'], lease['expires_at'])
+                    continue
+            return ip
+        return None
+
+    def expired(self, now):
+        """Concesiones caducadas que siguen en el índice, para no guardarlas en la instantánea."""
+        return [mac for mac, (_, expires_at) in self.by_mac.items() if expires_at <= now]
+
+
+class LeaseSnapshotter:
+    """
+    Instantáneas binarias del estado en memoria (índice de concesiones y
+    mapa de conversaciones) más un diario con los cambios posteriores, para
+    que un reinicio recupere el estado en milisegundos sin consultar la
+    base de datos.
+
+    Cada cambio de concesión se aplica al índice y se añade al diario (21
+    bytes más su CRC32), salvo las renovaciones que solo mueven la
+    expiración, que son la mayoría. El diario se vuelca a disco cada
+    'flush_interval' segundos. Cada 'interval' segundos, y al parar, se
+    escribe una instantánea nueva (fichero temporal y os.replace, así que
+    nunca queda a medias) y se empieza un diario vacío marcado con su
+    número de generación. Al arrancar, restore() carga la instantánea, comprueba su
+    CRC y aplica el diario hasta el primer registro incompleto o corrupto
+    (una escritura cortada por una caída). Si la instantánea falta, no es
+    válida o la base de datos cambió con el servidor parado (p. ej. con
+    manager.py, ver LeaseDatabase.last_external_seq), el índice se
+    reconstruye desde la tabla 'leases'.
+
+    El almacén sigue siendo la fuente de verdad: el índice solo propone
+    candidatas al asignador, que las confirma (ver LeaseIndex). Por eso una
+    expiración antigua tras una caída solo cuesta una consulta de más.
+    """
+
+    def __init__(self, index, path='data/leases.snap', journal_path='data/leases.journal', interval=300,
+                 conversations=None, flush_interval=1.0):
+        self.index = index
+        self.path = path
+        self.journal_path = journal_path
+        self.interval = interval
+        self.flush_interval = flush_interval
+        # Almacén recibido en restore(), del que sale la secuencia de cambios externos
+        self.store = None
+        # Función sin argumentos que devuelve (contador, [(mac, número, último paquete)])
+        self.conversations = conversations
+        self.generation = 0
+        self.journal = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def on_lease_change(self, op, mac, ip, expires_at, replicated=False):
+        """Listener del almacén de concesiones: aplica el cambio al índice y lo anota en el diario."""
+        record = JOURNAL_RECORD.pack(op, mac, ip, expires_at)
+        with self.index.lock:
+            previous = self.index.by_mac.get(mac)
+            self.index.apply(op, mac, ip, expires_at)
+            renewal = op == LeaseStore.LEASE_SET and previous is not None and previous[0] == ip
+            if self.journal and not renewal:
+                self.journal.write(record + CRC.pack(zlib.crc32(record)))
+
+    def flush_journal(self):
+        with self.index.lock:
+            if self.journal:
+                self.journal.flush()
+
+    # --- Escritura ---
+
+    def snapshot(self):
+        """Escribe una instantánea del estado actual y reinicia el diario. Devuelve cuántas concesiones guarda."""
+        counter, conversations = self.conversations() if self.conversations else (0, [])
+        now = self.index.clock.time()
+        with self.index.lock:
+            for mac in self.index.expired(now):
+                self.index.apply(LeaseStore.LEASE_DELETE, mac, 0, 0)
+            leases = [(mac, ip, expires_at) for mac, (ip, expires_at) in self.index.by_mac.items()]
+            generation = self.generation + 1
+            external_seq = self.store.change_log.external_seq if self.store else 0
+            body = b''.join((
+                SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, FORMAT_VERSION, generation, int(time.time()),
+                                     external_seq, counter, len(leases), len(conversations)),
+                b''.join(LEASE_RECORD.pack(*lease) for lease in leases),
+                b''.join(CONVERSATION_RECORD.pack(*conversation) for conversation in conversations),
+            ))
+            self._write_atomic(self.path, body + CRC.pack(zlib.crc32(body)))
+            # Con el lock tomado: ningún cambio puede quedar entre la instantánea y el diario nuevo
+            self._open_journal(generation)
+            self.generation = generation
+        return len(leases)
+
+    @staticmethod
+    def _write_atomic(path, data):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _open_journal(self, generation, valid_records=None):
+        """
+        Empieza un diario vacío de 'generation' o, con 'valid_records', sigue
+        el existente tras descartar lo que haya después de esos registros.
+        """
+        if self.journal:
+            self.journal.close()
+        if valid_records is None:
+            self.journal = open(self.journal_path, 'wb')
+            self.journal.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, FORMAT_VERSION, generation))
+        else:
+            self.journal = open(self.journal_path, 'r+b')
+            self.journal.truncate(JOURNAL_HEADER.size + valid_records * (JOURNAL_RECORD.size + CRC.size))
+            self.journal.seek(0, os.SEEK_END)
+        self.journal.flush()
+
+    # --- Lectura ---
+
+    def read_snapshot(self):
+        """Devuelve (generación, secuencia externa, contador, concesiones, conversaciones) o lanza SnapshotError."""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise SnapshotError(f"no existe '{self.path}'")
+        if len(data) < SNAPSHOT_HEADER.size + CRC.size:
+            raise SnapshotError("fichero truncado")
+        body, (crc,) = data[:-CRC.size], CRC.unpack(data[-CRC.size:])
+        if zlib.crc32(body) != crc:
+            raise SnapshotError("CRC incorrecto")
+        (magic, version, generation, _, external_seq,
+         counter, lease_count, conversation_count) = SNAPSHOT_HEADER.unpack_from(body)
+        if magic != SNAPSHOT_MAGIC or version != FORMAT_VERSION:
+            raise SnapshotError(f"formato desconocido ({magic!r}, versión {version})")
+        leases_end = SNAPSHOT_HEADER.size + lease_count * LEASE_RECORD.size
+        if leases_end + conversation_count * CONVERSATION_RECORD.size != len(body):
+            raise SnapshotError("tamaño incoherente con la cabecera")
+        leases = LEASE_RECORD.iter_unpack(body[SNAPSHOT_HEADER.size:leases_end])
+        conversations = list(CONVERSATION_RECORD.iter_unpack(body[leases_end:]))
+        return generation, external_seq, counter, leases, conversations
+
+    def read_journal(self, generation):
+        """
+        Cambios válidos del diario de 'generation', o None si no hay diario
+        o es de otra instantánea.
+        """
+        try:
+            with open(self.journal_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < JOURNAL_HEADER.size or JOURNAL_HEADER.unpack_from(data) != (JOURNAL_MAGIC, FORMAT_VERSION, generation):
+            return None
+        changes = []
+        record_size = JOURNAL_RECORD.size + CRC.size
+        for offset in range(JOURNAL_HEADER.size, len(data) - record_size + 1, record_size):
+            record = data[offset:offset + JOURNAL_RECORD.size]
+            (crc,) = CRC.unpack_from(data, offset + JOURNAL_RECORD.size)
+            if zlib.crc32(record) != crc:
+                break
+            changes.append(JOURNAL_RECORD.unpack(record))
+        return changes
+
+    def restore(self, store):
+        """
+        Recupera el índice (y las conversaciones) de la instantánea y su
+        diario; si no es posible, lo reconstruye desde 'store'. Devuelve
+        (contador, conversaciones) para el handler. Deja abierto un diario
+        nuevo para los cambios siguientes.
+        """
+        started = time.perf_counter()
+        self.store = store
+        try:
+            generation, external_seq, counter, leases, conversations = self.read_snapshot()
+            current_seq = store.change_log.last_external_seq()
+            if external_seq != current_seq:
+                raise SnapshotError(f"la base de datos cambió con el servidor parado "
+                                    f"(cambios externos {external_seq} -> {current_seq})")
+        except SnapshotError as e:
+            self.index.load(store.get_all_leases())
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"[INSTANTÁNEA] No se pudo usar la instantánea ({e}): {len(self.index)} concesiones "
+                  f"reconstruidas desde la tabla 'leases' en {elapsed:.1f} ms.")
+            self.snapshot()
+            return 0, []
+
+        self.index.load(leases)
+        changes = self.read_journal(generation)
+        with self.index.lock:
+            for op, mac, ip, expires_at in changes or ():
+                self.index.apply(op, mac, ip, expires_at)
+            # Se sigue escribiendo en el mismo diario, sin la cola cortada si la había
+            self._open_journal(generation, None if changes is None else len(changes))
+        self.generation = generation
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"[INSTANTÁNEA] {len(self.index)} concesiones restauradas (instantánea más {len(changes or ())} "
+              f"cambios del diario) en {elapsed:.1f} ms.")
+        return counter, conversations
+
+    # --- Hilo de instantáneas periódicas ---
+
+    def _run(self):
+        next_snapshot = time.monotonic() + self.interval
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                if time.monotonic() >= next_snapshot:
+                    self.snapshot()
+                    next_snapshot = time.monotonic() + self.interval
+                else:
+                    self.flush_journal()
+            except OSError as e:
+                print(f"[INSTANTÁNEA] No se pudo escribir la instantánea: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="lease-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self.snapshot()
+        with self.index.lock:
+            self.journal.close()
+            self.journal = None
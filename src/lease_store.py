@@ -0,0 +1,425 @@
+# src/lease_store.py
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from fnmatch import fnmatchcase
+
+from src.clock import SYSTEM_CLOCK
+
+
+class LeaseStore(ABC):
+    """
+    Interfaz común de almacenamiento de concesiones usada por el handler, la
+    replicación y el gestor. MACs (48 bits) e IPs (32 bits) son enteros.
+
+    Implementaciones:
+      - LeaseDatabase (src/database.py): SQLite, la opción por defecto.
+      - KVLeaseStore: almacén clave-valor compatible con Redis, para que
+        varios procesos compartan el estado de las concesiones.
+    """
+
+    # Códigos de operación notificados a los 'change_listeners' (ver src/replication.py)
+    LEASE_SET = 1
+    LEASE_DELETE = 2
+
+    def add_change_listener(self, callback):
+        """
+        Registra callback(op, mac, ip, expires_at, replicated), llamado tras cada
+        cambio en las concesiones. 'replicated' indica que llegó del servidor par.
+        En LEASE_DELETE, 'ip' y 'expires_at' son los de la concesión borrada
+        (0 si no se conocen); la replicación los usa para no borrar una
+        concesión que el par renovó después.
+        """
+        self.change_listeners.append(callback)
+
+    def _notify_change(self, op, mac, ip=0, expires_at=0, replicated=False):
+        for callback in self.change_listeners:
+            callback(op, mac, ip, expires_at, replicated)
+
+    def poll_external_changes(self):
+        """
+        Notifica a los listeners los cambios hechos por otro proceso (manager.py)
+        desde la última llamada, sin marcarlos como replicados: así la caché de
+        ofertas, la instantánea, el DDNS y el failover también se enteran.
+        Los cambios están en 'change_log', el LeaseDatabase local; su
+        'external_seq' solo avanza tras notificar cada cambio. Devuelve cuántos había.
+        """
+        log = self.change_log
+        changes = log.external_changes_since(log.external_seq)
+        for seq, op, mac, ip, expires_at in changes:
+            self._notify_change(op, mac, ip, expires_at)
+            log.external_seq = seq
+        return len(changes)
+
+    def _watch_loop(self, interval):
+        while not self._watch_stop.wait(interval):
+            try:
+                self.poll_external_changes()
+            except sqlite3.Error as e:
+                print(f"[CONCESIONES] No se pudieron leer los cambios externos: {e}")
+
+    def start_external_watcher(self, interval=5):
+        self._watch_stop = threading.Event()
+        threading.Thread(target=self._watch_loop, args=(interval,), name="lease-changes", daemon=True).start()
+
+    def stop_external_watcher(self):
+        self._watch_stop.set()
+
+    @abstractmethod
+    def get_lease(self, mac):
+        """Concesión vigente de 'mac' como {'ip', 'expires_at'}, o None."""
+
+    @abstractmethod
+    def get_lease_holder(self, ip):
+        """MAC que tiene concedida 'ip', o None si está libre."""
+
+    @abstractmethod
+    def add_lease(self, mac, ip, lease_time):
+        """Crea o sustituye la concesión de 'mac' sin comprobaciones."""
+
+    @abstractmethod
+    def assign_lease(self, mac, ip, lease_time):
+        """
+        Concede 'ip' a 'mac' de forma atómica solo si está libre, caducada o ya
+        es suya. Devuelve False si otro cliente la obtuvo antes.
+        """
+
+    @abstractmethod
+    def renew_lease(self, mac, ip, lease_time):
+        """Extiende la concesión de 'mac' y registra el RENEW en el histórico."""
+
+    @abstractmethod
+    def release_lease(self, mac):
+        """Elimina la concesión de 'mac'."""
+
+    @abstractmethod
+    def get_all_leases(self):
+        """Concesiones vigentes como tuplas (mac, ip, expires_at)."""
+
+    @abstractmethod
+    def apply_replicated_changes(self, changes):
+        """Aplica cambios (op, mac, ip, expires_at) recibidos del servidor par."""
+
+    @abstractmethod
+    def add_history_log(self, mac, ip, event_type):
+        """Añade un evento al histórico de auditoría."""
+
+    @abstractmethod
+    def save_rogue_servers(self, sightings):
+        """Acumula observaciones de servidores DHCP no autorizados."""
+
+    def get_active_leases(self):
+        """Concesiones vigentes como diccionario {ip: mac}."""
+        return {ip: mac for mac, ip, _ in self.get_all_leases()}
+
+    def find_available_ip(self, pool_start, pool_end, reserved_ips):
+        active_ips = {ip for ip in self.get_active_leases() if pool_start <= ip <= pool_end}
+        for ip in range(pool_start, pool_end + 1):
+            if ip not in active_ips and ip not in reserved_ips:
+                return ip
+        return None
+
+    # Agrupación de escrituras de RENEW: solo la implementan los almacenes que
+    # la necesitan (SQLite); en el resto estas operaciones no hacen nada.
+    def configure_renewal_coalescing(self, threshold_seconds, flush_interval=5, history='all'):
+        pass
+
+    def flush_renewals(self):
+        return 0
+
+    def start_renewal_flusher(self):
+        pass
+
+    def stop_renewal_flusher(self):
+        pass
+
+
+class InMemoryKV:
+    """
+    Sustituto en proceso de un servidor Redis con el subconjunto de comandos
+    que usa KVLeaseStore. Sirve para pruebas y simulaciones de varios
+    servidores dentro del mismo proceso. Los datos viven solo en la memoria
+    de ese proceso: otro proceso (p. ej. manager.py) no los ve.
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock or SYSTEM_CLOCK
+        self.data = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key, now):
+        item = self.data.get(key)
+        if item and item[1] is not None and item[1] <= now:
+            del self.data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._alive(key, self.clock.time())
+            return item[0] if item else None
+
+    def mget(self, keys):
+        with self._lock:
+            now = self.clock.time()
+            return [item[0] if item else None for item in (self._alive(key, now) for key in keys)]
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self.data[key] = (value, self.clock.time() + ex if ex else None)
+
+    def delete(self, key):
+        with self._lock:
+            return 1 if self.data.pop(key, None) else 0
+
+    def scan_iter(self, match):
+        with self._lock:
+            now = self.clock.time()
+            keys = [key for key in list(self.data) if fnmatchcase(key, match) and self._alive(key, now)]
+        return iter(keys)
+
+    def compare_and_set(self, key, expected, value, ex=None):
+        """Escribe 'value' solo si el valor actual es 'expected' (None = no existe)."""
+        with self._lock:
+            item = self._alive(key, self.clock.time())
+            if (item[0] if item else None) != expected:
+                return False
+            self.data[key] = (value, self.clock.time() + ex if ex else None)
+            return True
+
+    def compare_and_delete(self, key, expected):
+        with self._lock:
+            item = self._alive(key, self.clock.time())
+            if not item or item[0] != expected:
+                return False
+            del self.data[key]
+            return True
+
+
+class RedisKV:
+    """
+    Adaptador para un cliente 'redis' ya creado (redis.Redis con
+    decode_responses=True). Las operaciones condicionales se ejecutan como
+    scripts Lua, que Redis ejecuta de forma atómica.
+    """
+
+    CAS_SCRIPT = """
+        local current = redis.call('GET', KEYS[1])
+        if (current or '') ~= ARGV[1] then return 0 end
+        if ARGV[3] ~= '' then
+            redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+        else
+            redis.call('SET', KEYS[1], ARGV[2])
+        end
+        return 1
+    """
+    CAD_SCRIPT = """
+        if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+        redis.call('DEL', KEYS[1])
+        return 1
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._cas = client.register_script(self.CAS_SCRIPT)
+        self._cad = client.register_script(self.CAD_SCRIPT)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def mget(self, keys):
+        return self.client.mget(keys)
+
+    def set(self, key, value, ex=None):
+        self.client.set(key, value, ex=ex)
+
+    def delete(self, key):
+        return self.client.delete(key)
+
+    def scan_iter(self, match):
+        return self.client.scan_iter(match=match)
+
+    def compare_and_set(self, key, expected, value, ex=None):
+        return bool(self._cas(keys=[key], args=[expected or '', value, ex or '']))
+
+    def compare_and_delete(self, key, expected):
+        return bool(self._cad(keys=[key], args=[expected]))
+
+
+class KVLeaseStore(LeaseStore):
+    """
+    Concesiones en un almacén clave-valor compartido:
+      lease:mac:<mac> -> "<ip>:<expires_at>"
+      lease:ip:<ip>   -> "<mac>:<expires_at>"   (propiedad de la IP)
+    La clave de la IP es la que decide quién tiene la dirección: se escribe
+    con compare-and-set, así que dos servidores no pueden conceder la misma
+    IP a la vez. Las claves caducan solas con la concesión.
+
+    El histórico y los servidores intrusos siguen siendo locales: se delegan
+    en 'audit_db' (un LeaseDatabase), cuyo 'db_path' usa el archivado.
+    """
+
+    MAC_KEY = 'lease:mac:{}'
+    IP_KEY = 'lease:ip:{}'
+    CAS_RETRIES = 3
+
+    def __init__(self, kv, audit_db):
+        self.kv = kv
+        self.audit_db = audit_db
+        # manager.py registra sus cambios en el SQLite local, junto al histórico
+        self.change_log = audit_db
+        self.db_path = audit_db.db_path
+        self.clock = audit_db.clock
+        self.change_listeners = []
+
+    @staticmethod
+    def _parse(value):
+        if value is None:
+            return None
+        owner, expires_at = value.split(':')
+        return int(owner), int(expires_at)
+
+    def get_lease(self, mac):
+        entry = self._parse(self.kv.get(self.MAC_KEY.format(mac)))
+        if entry and entry[1] > self.clock.time():
+            return {'ip': entry[0], 'expires_at': entry[1]}
+        return None
+
+    def get_lease_holder(self, ip):
+        entry = self._parse(self.kv.get(self.IP_KEY.format(ip)))
+        if entry and entry[1] > self.clock.time():
+            return entry[0]
+        return None
+
+    def _write(self, mac, ip, expires_at, force):
+        now = int(self.clock.time())
+        ttl = max(expires_at - now, 1)
+        ip_key = self.IP_KEY.format(ip)
+        new_owner = f"{mac}:{expires_at}"
+        for _ in range(self.CAS_RETRIES):
+            current = self.kv.get(ip_key)
+            entry = self._parse(current)
+            if not force and entry and entry[0] != mac and entry[1] > now:
+                return False
+            if self.kv.compare_and_set(ip_key, current, new_owner, ex=ttl):
+                break
+        else:
+            return False
+
+        # Si el cliente tenía otra IP, se libera (solo si sigue siendo suya)
+        previous = self._parse(self.kv.get(self.MAC_KEY.format(mac)))
+        if previous and previous[0] != ip:
+            old_key = self.IP_KEY.format(previous[0])
+            old_owner = self.kv.get(old_key)
+            if old_owner and self._parse(old_owner)[0] == mac:
+                self.kv.compare_and_delete(old_key, old_owner)
+        self.kv.set(self.MAC_KEY.format(mac), f"{ip}:{expires_at}", ex=ttl)
+        return True
+
+    def add_lease(self, mac, ip, lease_time):
+        expires_at = int(self.clock.time()) + lease_time
+        self._write(mac, ip, expires_at, force=True)
+        self._notify_change(self.LEASE_SET, mac, ip, expires_at)
+
+    def assign_lease(self, mac, ip, lease_time):
+        expires_at = int(self.clock.time()) + lease_time
+        if not self._write(mac, ip, expires_at, force=False):
+            return False
+        self._notify_change(self.LEASE_SET, mac, ip, expires_at)
+        return True
+
+    def renew_lease(self, mac, ip, lease_time):
+        self.add_lease(mac, ip, lease_time)
+        self.add_history_log(mac, ip, 'RENEW')
+
+    def _delete(self, mac, expires_before=0):
+        """Borra la concesión de 'mac' (solo si no vence después de 'expires_before'). Devuelve (ip, expires_at) o None."""
+        mac_key = self.MAC_KEY.format(mac)
+        entry = self._parse(self.kv.get(mac_key))
+        if entry and expires_before and entry[1] > expires_before:
+            return None
+        self.kv.delete(mac_key)
+        if entry:
+            ip_key = self.IP_KEY.format(entry[0])
+            owner = self.kv.get(ip_key)
+            if owner and self._parse(owner)[0] == mac:
+                self.kv.compare_and_delete(ip_key, owner)
+        return entry
+
+    def release_lease(self, mac):
+        entry = self._delete(mac) or (0, 0)
+        self._notify_change(self.LEASE_DELETE, mac, *entry)
+
+    def get_all_leases(self):
+        now = self.clock.time()
+        leases = []
+        for key in self.kv.scan_iter(self.MAC_KEY.format('*')):
+            entry = self._parse(self.kv.get(key))
+            if entry and entry[1] > now:
+                leases.append((int(key.rsplit(':', 1)[1]), entry[0], entry[1]))
+        return leases
+
+    def find_available_ip(self, pool_start, pool_end, reserved_ips, chunk=256):
+        # Consulta la propiedad de las IPs del pool por bloques con MGET
+        now = self.clock.time()
+        for start in range(pool_start, pool_end + 1, chunk):
+            ips = range(start, min(start + chunk, pool_end + 1))
+            owners = self.kv.mget([self.IP_KEY.format(ip) for ip in ips])
+            for ip, owner in zip(ips, owners):
+                if ip in reserved_ips:
+                    continue
+                entry = self._parse(owner)
+                if not entry or entry[1] <= now:
+                    return ip
+        return None
+
+    def apply_replicated_changes(self, changes):
+        # Como en LeaseDatabase, un cambio que pierde el conflicto no se aplica ni se notifica
+        applied = []
+        for op, mac, ip, expires_at in changes:
+            if op == self.LEASE_SET and self._write(mac, ip, expires_at, force=False):
+                applied.append((op, mac, ip, expires_at))
+            elif op == self.LEASE_DELETE and self._delete(mac, expires_at):
+                applied.append((op, mac, ip, expires_at))
+        for op, mac, ip, expires_at in applied:
+            self._notify_change(op, mac, ip, expires_at, replicated=True)
+
+    def add_history_log(self, mac, ip, event_type):
+        self.audit_db.add_history_log(mac, ip, event_type)
+
+    def save_rogue_servers(self, sightings):
+        self.audit_db.save_rogue_servers(sightings)
+
+
+def open_lease_store(config, lock, db_path='data/dhcp_leases.db', kv=None, clock=None):
+    """
+    Crea el almacén de concesiones indicado en config['lease_store']:
+      {"backend": "sqlite"}                               (por defecto)
+      {"backend": "kv", "url": "memory://"}               sustituto en proceso
+      {"backend": "kv", "url": "redis://host:6379/0"}     requiere el paquete 'redis'
+    Con memory:// cada proceso tiene su propio almacén vacío, así que manager.py
+    no ve las concesiones del servidor; para compartirlas hace falta Redis.
+    Se puede pasar un 'kv' ya creado (p. ej. un InMemoryKV compartido) y un
+    reloj ('clock', ver src/clock.py) para simulaciones.
+    """
+    from src.database import LeaseDatabase
+
+    store_cfg = config.get('lease_store', {})
+    local_db = LeaseDatabase(db_path, lock=lock, clock=clock)
+    backend = store_cfg.get('backend', 'sqlite')
+    if backend == 'sqlite':
+        return local_db
+    if backend != 'kv':
+        raise ValueError(f"Backend de concesiones desconocido: '{backend}'.")
+
+    if kv is None:
+        url = store_cfg.get('url', 'memory://')
+        if url.startswith('memory://'):
+            kv = InMemoryKV(clock)
+        else:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("El backend 'kv' con una URL redis:// necesita el paquete 'redis' (pip install redis).")
+            kv = RedisKV(redis.Redis.from_url(url, decode_responses=True))
+    return KVLeaseStore(kv, local_db)
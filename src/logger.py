@@ -194,6 +194,24 @@ class DhcpLogger:
         self._log(speaker, msg, convo_id)
         self._separator()
 
+    def log_inform(self, mac, ip, answered=True, convo_id=None):
+        if self.mode == 'profesional': return
+        if answered:
+            messages = {
+                'chat': ('💻 Cliente', f"Ya tengo IP ({ip}), solo necesito la configuración de la red. ¿Me la pasas?"),
+                'docente': ('🎓 Cliente (Análisis)', f"El cliente {mac} tiene IP estática ({ip}) y envía un DHCPINFORM para obtener solo los parámetros de red. El servidor responde con un DHCPACK sin conceder ninguna IP."),
+                'colegas': ('👷‍♂️ Cliente', f"Tengo la {ip} puesta a mano, pásame DNS y gateway y no te molesto más.")
+            }
+        else:
+            messages = {
+                'chat': ('🤖 Servidor', f"La IP {ip} no es de ninguna de mis redes, así que no puedo darte su configuración."),
+                'docente': ('🎓 Servidor (Análisis)', f"El DHCPINFORM de {mac} se ignora: su IP ({ip}) no pertenece a ningún ámbito configurado."),
+                'colegas': ('⚙️ Servidor', f"¿{ip}? Esa no es de mi red. Paso.")
+            }
+        speaker, msg = messages[self.mode]
+        self._log(speaker, msg, convo_id)
+        self._separator()
+
     def log_new_conversation(self, mac, convo_number):
         if self.mode == 'profesional': return
         convo_id = f"Conversación #{convo_number}"
@@ -205,13 +223,44 @@ class DhcpLogger:
         speaker, msg = messages[self.mode]
         self._log(speaker, msg, convo_id)
 
-    def log_rogue_server_detected(self, rogue_mac, rogue_ip):
+    def log_rogue_server_detected(self, rogue_mac, rogue_ip, packets=1):
+        repeated = f" ({packets} paquetes desde el último aviso)" if packets > 1 else ""
         messages = {
-            'chat': ('🚨 ALERTA', f"¡Cuidado! Se ha detectado otro servidor DHCP ({rogue_ip}) en la red. Esto puede causar conflictos."),
-            'docente': ('🛡️ SEGURIDAD', f"ALERTA: Detectado tráfico de un servidor DHCP no autorizado en {rogue_ip} ({rogue_mac})."),
-            'colegas': ('🕵️‍♂️ OJO', f"¡Al loro! Hay otro DHCP server en {rogue_ip} ({rogue_mac}) metiendo ruido. A ver quién es."),
-            'profesional': ('🚨 ALERTA DE SEGURIDAD', f"Detectado servidor DHCP no autorizado. IP: {rogue_ip}, MAC: {rogue_mac}.")
+            'chat': ('🚨 ALERTA', f"¡Cuidado! Se ha detectado otro servidor DHCP ({rogue_ip}) en la red. Esto puede causar conflictos.{repeated}"),
+            'docente': ('🛡️ SEGURIDAD', f"ALERTA: Detectado tráfico de un servidor DHCP no autorizado en {rogue_ip} ({rogue_mac}).{repeated}"),
+            'colegas': ('🕵️‍♂️ OJO', f"¡Al loro! Hay otro DHCP server en {rogue_ip} ({rogue_mac}) metiendo ruido. A ver quién es.{repeated}"),
+            'profesional': ('🚨 ALERTA DE SEGURIDAD', f"Detectado servidor DHCP no autorizado. IP: {rogue_ip}, MAC: {rogue_mac}.{repeated}")
         }
         speaker, msg = messages[self.mode]
         self._log(speaker, msg, None)
         self._separator()
+
+    def log_probe_pending(self, ip, convo_id=None):
+        if self.mode == 'profesional': return
+        messages = {
+            'chat': ('🌐 Servidor', f"Antes de ofrecer la IP {ip} compruebo que nadie la esté usando..."),
+            'docente': ('👨‍🏫 Servidor (Acción)', f"El servidor sondea {ip} (ARP/ICMP) antes de ofrecerla. La oferta se enviará cuando llegue el resultado, sin bloquear el resto de peticiones."),
+            'colegas': ('🔧 Servidor', f"Un momento, voy a ver si la {ip} está pillada.")
+        }
+        speaker, msg = messages[self.mode]
+        self._log(speaker, msg, convo_id)
+
+    def log_probe_conflict(self, ip, convo_id=None):
+        messages = {
+            'chat': ('🚨 ALERTA', f"¡La IP {ip} ya la está usando alguien! Buscaré otra."),
+            'docente': ('👨‍🏫 Servidor (Análisis)', f"Un equipo ha respondido al sondeo de {ip}: hay un conflicto de IP. El servidor la aparta y elige otra, ahorrándose el DHCPDECLINE del cliente."),
+            'colegas': ('🔧 Servidor', f"Uy, la {ip} ya la tiene alguien. Te busco otra."),
+            'profesional': ('⚠️ CONFLICTO', f"IP {ip} en uso según el sondeo previo a la oferta; se descarta.")
+        }
+        speaker, msg = messages[self.mode]
+        self._log(speaker, msg, convo_id)
+
+    def log_rate_limited(self, source):
+        messages = {
+            'chat': ('🚦 AVISO', f"{source} está enviando demasiadas peticiones. Ignoraré algunas hasta que se calme."),
+            'docente': ('🚦 PROTECCIÓN', f"{source} supera la tasa de peticiones permitida. Sus paquetes se descartan antes de consultar la base de datos."),
+            'colegas': ('🚦 FRENA', f"{source} está inundando a peticiones. Le ignoro un rato."),
+            'profesional': ('🚦 LÍMITE DE TASA', f"Descartando paquetes de {source}: tasa máxima superada.")
+        }
+        speaker, msg = messages[self.mode]
+        self._log(speaker, msg, None)
@@ -1,14 +1,29 @@
 # manager.py
 import argparse
+import csv
+import itertools
 import json
+import os
+import signal
 import sqlite3
 import sys
+import threading
+import time
+from collections import Counter, deque
 from datetime import datetime
-from ipaddress import IPv4Address
+from ipaddress import IPv4Address, IPv4Network
+
+from src.database import LeaseDatabase, register_sql_functions
+from src.history_archive import HistoryArchiver, list_partitions
+from src.lease_store import open_lease_store
+from src.net_utils import SearchQuery, int_to_ip, int_to_mac, ip_to_int, mac_to_int
+from src.profiler import REQUEST_FILE, hot_paths, read_collapsed, read_server_pid, write_request
+from src.reservations import ReservationStore
 
 # Intentamos importar 'rich', si no está, damos instrucciones claras.
 try:
-    from rich.console import Console
+    from rich.console import Console, Group
+    from rich.live import Live
     from rich.panel import Panel
     from rich.table import Table
     from rich.text import Text
@@ -20,6 +35,14 @@ except ImportError:
 # --- Constantes ---
 DB_PATH = 'data/dhcp_leases.db'
 CONFIG_PATH = 'config/config.json'
+PAGE_SIZE = 500
+BULK_BATCH_SIZE = 5000
+EXPORT_FIELDS = ['mac', 'ip', 'expires_at', 'expires']
+
+
+def file_format(path):
+    """Deduce el formato de importación/exportación a partir de la extensión."""
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
 
 class DHCPManager:
     """
@@ -35,11 +58,34 @@ class DHCPManager:
         except json.JSONDecodeError:
             raise RuntimeError(f"Error: El archivo de configuración '{config_path}' no es un JSON válido.")
 
+        self.db_path = db_path
+        archive_cfg = self.config.get('history_archive', {})
+        self.archive_dir = archive_cfg.get('archive_dir', 'data/archive')
+        self.retention_days = archive_cfg.get('retention_days', 30)
+        profile_cfg = self.config.get('profiling', {})
+        self.profile_dir = profile_cfg.get('output_dir', 'data/profiles')
+        self.pid_file = profile_cfg.get('pid_file', 'data/dhcp_server.pid')
+        self.default_profile_seconds = profile_cfg.get('default_duration_seconds', 30)
+
         try:
-            self.conn = sqlite3.connect(db_path)
+            # Mismo almacén que el servidor (config['lease_store']). Con SQLite las
+            # consultas masivas usan SQL directamente; con un almacén clave-valor
+            # las concesiones pasan por la API y el histórico queda en el SQLite local.
+            self.store = open_lease_store(self.config, threading.RLock(), db_path)
+            self.sql_leases = isinstance(self.store, LeaseDatabase)
+            self.local_db = self.store if self.sql_leases else self.store.audit_db
+            self.conn = self.local_db.conn
             self.cursor = self.conn.cursor()
-        except sqlite3.OperationalError as e:
-            raise RuntimeError(f"Error al conectar con la base de datos en '{db_path}': {e}")
+            register_sql_functions(self.conn)
+            # El servidor no ve los listeners de este proceso: cada cambio hecho
+            # con la API del almacén queda en 'lease_changes' para que lo aplique.
+            # Las operaciones masivas sobre SQL lo registran en su propia transacción.
+            self.store.add_change_listener(self._record_change)
+        except (sqlite3.OperationalError, ValueError) as e:
+            raise RuntimeError(f"Error al abrir el almacén de concesiones: {e}")
+        # Reservas masivas: el servidor aplica los cambios sin reiniciarse (ver src/reservations.py)
+        self.reservations = ReservationStore(db_path)
+        self.last_query = None
 
     def get_pool_stats(self):
         """Calcula las estadísticas de uso del pool de IPs."""
@@ -50,31 +96,106 @@ class DHCPManager:
         except KeyError:
             return {'total': 0, 'used': 0, 'percentage': 0}
 
-        self.cursor.execute("SELECT COUNT(*) FROM leases")
-        used_ips = self.cursor.fetchone()[0]
+        if self.sql_leases:
+            self.cursor.execute("SELECT COUNT(*) FROM leases")
+            used_ips = self.cursor.fetchone()[0]
+        else:
+            used_ips = len(self.store.get_all_leases())
         
         percentage = (used_ips / total_ips) * 100 if total_ips > 0 else 0
         return {'total': total_ips, 'used': used_ips, 'percentage': percentage}
 
+    def iter_leases(self, search_term=None, after=None, offset=0, limit=None, page_size=PAGE_SIZE):
+        """
+        Recorre las concesiones ordenadas por IP sin cargarlas todas en memoria.
+        Usa paginación por clave (ip_int, mac): cada página continúa donde
+        terminó la anterior, así que el coste no crece con el tamaño de la tabla.
+        Las búsquedas por MAC/OUI se ordenan por MAC (la clave primaria).
+        Al terminar, 'last_query' guarda el tipo de búsqueda y el tiempo en SQL.
+        """
+        search = SearchQuery(search_term) if search_term else None
+        if not self.sql_leases:
+            yield from self._iter_store_leases(search, after, offset, limit)
+            return
+        base_conditions = []
+        base_params = []
+        if search:
+            base_conditions.append(search.condition)
+            base_params.extend(search.params)
+        if after:
+            base_conditions.append("ip_int > ?")
+            base_params.append(ip_to_int(after))
+
+        sort_key = ('mac',) if search and search.kind in ('mac', 'oui') else ('ip_int', 'mac')
+        stats = {'kind': search.kind if search else 'all', 'indexed': search.uses_index if search else True,
+                 'rows': 0, 'elapsed': 0.0}
+        self.last_query = stats
+
+        last_key = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            conditions = []
+            params = []
+            if last_key:
+                # Va primero para que SQLite use la clave como punto de partida en el índice
+                # en lugar del límite inferior del filtro (que obligaría a releer páginas).
+                conditions.append(f"({', '.join(sort_key)}) > ({', '.join('?' * len(sort_key))})")
+                params.extend(last_key)
+            conditions.extend(base_conditions)
+            params.extend(base_params)
+
+            query = "SELECT mac, ip_int, expires_at FROM leases"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += f" ORDER BY {', '.join(sort_key)} LIMIT ?"
+            batch = page_size if remaining is None else min(page_size, remaining)
+            params.append(batch)
+            # El desplazamiento solo se aplica a la primera página
+            if offset and last_key is None:
+                query += " OFFSET ?"
+                params.append(offset)
+
+            started = time.perf_counter()
+            rows = self.conn.execute(query, params).fetchall()
+            stats['elapsed'] += time.perf_counter() - started
+            stats['rows'] += len(rows)
+
+            for row in rows:
+                yield {
+                    'mac': int_to_mac(row[0]),
+                    'ip': int_to_ip(row[1]),
+                    'expires_at': row[2],
+                    'expires': datetime.fromtimestamp(row[2]).strftime('%Y-%m-%d %H:%M:%S')
+                }
+            if len(rows) < batch:
+                return
+            last_key = (rows[-1][0],) if sort_key == ('mac',) else (rows[-1][1], rows[-1][0])
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def _iter_store_leases(self, search, after, offset, limit):
+        """Equivalente de iter_leases para almacenes sin SQL: filtra y ordena en memoria."""
+        started = time.perf_counter()
+        after_int = ip_to_int(after) if after else None
+        rows = [
+            row for row in self.store.get_all_leases()
+            if (not search or search.matches(row[0], row[1])) and (after_int is None or row[1] > after_int)
+        ]
+        rows.sort(key=(lambda row: row[0]) if search and search.kind in ('mac', 'oui') else (lambda row: (row[1], row[0])))
+        rows = rows[offset:] if limit is None else rows[offset:offset + limit]
+        self.last_query = {'kind': search.kind if search else 'all', 'indexed': False,
+                           'rows': len(rows), 'elapsed': time.perf_counter() - started}
+        for mac, ip, expires_at in rows:
+            yield {
+                'mac': int_to_mac(mac),
+                'ip': int_to_ip(ip),
+                'expires_at': expires_at,
+                'expires': datetime.fromtimestamp(expires_at).strftime('%Y-%m-%d %H:%M:%S')
+            }
+
     def get_active_leases(self, search_term=None):
         """Obtiene una lista de todas las concesiones activas, con opción de búsqueda."""
-        query = "SELECT mac, ip_address, expires_at FROM leases"
-        params = []
-        if search_term:
-            query += " WHERE mac LIKE ? OR ip_address LIKE ?"
-            params.extend([f'%{search_term}%', f'%{search_term}%'])
-        
-        query += " ORDER BY ip_address"
-        self.cursor.execute(query, params)
-        leases = self.cursor.fetchall()
-        
-        return [
-            {
-                'mac': row[0],
-                'ip': row[1],
-                'expires': datetime.fromtimestamp(row[2]).strftime('%Y-%m-%d %H:%M:%S')
-            } for row in leases
-        ]
+        return list(self.iter_leases(search_term))
 
     def get_recent_history(self, limit=5):
         """Obtiene los eventos más recientes del histórico."""
@@ -97,67 +218,585 @@ class DHCPManager:
             return []
 
 
+    def get_last_history_id(self):
+        """Devuelve el mayor history_id registrado (0 si no hay eventos)."""
+        try:
+            self.cursor.execute("SELECT MAX(history_id) FROM leases_history")
+            return self.cursor.fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            return 0
+
+    def get_history_since(self, last_id, limit=1000):
+        """Obtiene los eventos posteriores a 'last_id', recorriendo solo la cola de la clave primaria."""
+        try:
+            self.cursor.execute(
+                "SELECT history_id, event_timestamp, event_type, mac, ip_address FROM leases_history "
+                "WHERE history_id > ? ORDER BY history_id LIMIT ?",
+                (last_id, limit)
+            )
+            rows = self.cursor.fetchall()
+        except sqlite3.OperationalError:
+            return []
+        return [
+            {
+                'id': row[0],
+                'timestamp': row[1],
+                'time': datetime.fromtimestamp(row[1]).strftime('%H:%M:%S'),
+                'type': row[2],
+                'mac': row[3],
+                'ip': row[4]
+            } for row in rows
+        ]
+
+    def get_history(self, identifier=None, limit=50):
+        """
+        Obtiene eventos del histórico (más recientes primero) recorriendo la tabla
+        viva y, si hace falta, las particiones archivadas de la más nueva a la más antigua.
+        """
+        query = "SELECT event_timestamp, event_type, mac, ip_address FROM leases_history"
+        params = []
+        if identifier:
+            # El histórico guarda las MAC en forma canónica (aa:bb:cc:dd:ee:ff)
+            try:
+                identifier = int_to_mac(mac_to_int(identifier))
+            except ValueError:
+                pass
+            query += " WHERE mac = ? OR ip_address = ?"
+            params.extend([identifier, identifier])
+        query += " ORDER BY event_timestamp DESC LIMIT ?"
+
+        events = []
+        sources = [('vivo', None)] + [(os.path.basename(path), path) for path in list_partitions(self.archive_dir)]
+        for source, path in sources:
+            remaining = limit - len(events)
+            if remaining <= 0:
+                break
+            try:
+                conn = self.conn if path is None else sqlite3.connect(path)
+                try:
+                    rows = conn.execute(query, params + [remaining]).fetchall()
+                finally:
+                    if path is not None:
+                        conn.close()
+            except sqlite3.OperationalError:
+                continue
+            events.extend(
+                {
+                    'time': datetime.fromtimestamp(row[0]).strftime('%Y-%m-%d %H:%M:%S'),
+                    'type': row[1],
+                    'mac': row[2],
+                    'ip': row[3],
+                    'source': source
+                } for row in rows
+            )
+        return events
+
+    def get_rogue_servers(self):
+        """Obtiene los servidores DHCP no autorizados detectados, más activos primero."""
+        try:
+            self.cursor.execute(
+                "SELECT mac, ip_int, first_seen, last_seen, packet_count FROM rogue_servers "
+                "ORDER BY packet_count DESC"
+            )
+            rows = self.cursor.fetchall()
+        except sqlite3.OperationalError:
+            # La tabla no existe hasta que el servidor arranca con esta versión
+            return []
+        return [
+            {
+                'mac': int_to_mac(row[0]),
+                'ip': int_to_ip(row[1]),
+                'first_seen': datetime.fromtimestamp(row[2]).strftime('%Y-%m-%d %H:%M:%S'),
+                'last_seen': datetime.fromtimestamp(row[3]).strftime('%Y-%m-%d %H:%M:%S'),
+                'packets': row[4]
+            } for row in rows
+        ]
+
+    def archive_history(self):
+        """Ejecuta una pasada de archivado del histórico según la retención configurada."""
+        archiver = HistoryArchiver(self.db_path, archive_dir=self.archive_dir, retention_days=self.retention_days)
+        return archiver.run_once()
+
     def free_lease(self, identifier):
-        """Libera una concesión por su IP o MAC."""
-        query = "DELETE FROM leases WHERE ip_address = ? OR mac = ?"
-        self.cursor.execute(query, (identifier, identifier))
-        self.conn.commit()
-        return self.cursor.rowcount > 0
+        """Libera una concesión vigente por su IP o MAC."""
+        try:
+            mac = self.store.get_lease_holder(ip_to_int(identifier))
+        except ValueError:
+            try:
+                mac = mac_to_int(identifier)
+            except ValueError:
+                return False
+            if not self.store.get_lease(mac):
+                mac = None
+        if mac is None:
+            return False
+        self.store.release_lease(mac)
+        return True
+
+    def _record_change(self, op, mac, ip, expires_at, replicated=False):
+        self.local_db.record_external_changes([(op, mac, ip, expires_at)])
+
+    def _store_leases_in(self, network):
+        first, last = int(network.network_address), int(network.broadcast_address)
+        return [(mac, ip) for mac, ip, _ in self.store.get_all_leases() if first <= ip <= last]
+
+    def count_leases_in_range(self, cidr):
+        """Cuenta las concesiones cuya IP pertenece a la red 'cidr'."""
+        network = IPv4Network(cidr, strict=False)
+        if not self.sql_leases:
+            return len(self._store_leases_in(network))
+        self.cursor.execute(
+            "SELECT COUNT(*) FROM leases WHERE ip_int BETWEEN ? AND ?",
+            (int(network.network_address), int(network.broadcast_address))
+        )
+        return self.cursor.fetchone()[0]
+
+    def free_range(self, cidr):
+        """
+        Libera todas las concesiones de la red 'cidr' en una única transacción,
+        registrando un evento ADMIN_RELEASE por concesión en el histórico.
+        """
+        network = IPv4Network(cidr, strict=False)
+        bounds = (int(network.network_address), int(network.broadcast_address))
+        started = time.perf_counter()
+        if not self.sql_leases:
+            leases = self._store_leases_in(network)
+            for mac, ip in leases:
+                self.store.release_lease(mac)
+                self.store.add_history_log(mac, ip, 'ADMIN_RELEASE')
+            return {'rows': len(leases), 'elapsed': time.perf_counter() - started}
+        now = int(time.time())
+        try:
+            self.cursor.execute(
+                "INSERT INTO leases_history (mac, ip_address, event_type, event_timestamp) "
+                "SELECT mac_text(mac), ipv4_text(ip_int), 'ADMIN_RELEASE', ? FROM leases WHERE ip_int BETWEEN ? AND ?",
+                (now, *bounds)
+            )
+            self.cursor.execute(
+                "INSERT INTO lease_changes (op, mac, ip_int, expires_at, changed_at) "
+                "SELECT ?, mac, ip_int, expires_at, ? FROM leases WHERE ip_int BETWEEN ? AND ?",
+                (LeaseDatabase.LEASE_DELETE, now, *bounds)
+            )
+            self.local_db.prune_external_changes(now)
+            self.cursor.execute("DELETE FROM leases WHERE ip_int BETWEEN ? AND ?", bounds)
+            rows = self.cursor.rowcount
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+        return {'rows': rows, 'elapsed': time.perf_counter() - started}
+
+    def _read_import_rows(self, path):
+        """
+        Lee un fichero CSV o JSON Lines con el formato de --export y valida cada
+        fila. Una IP repetida en el fichero es un error: acabaría concedida a dos MAC.
+        """
+        default_expiry = int(time.time()) + self.config.get('lease_time_seconds', 3600)
+        fmt = file_format(path)
+        seen_ips = {}
+        with open(path, newline='') as f:
+            records = csv.DictReader(f) if fmt == 'csv' else (json.loads(line) for line in f if line.strip())
+            for line_no, record in enumerate(records, start=2 if fmt == 'csv' else 1):
+                try:
+                    mac = mac_to_int(record['mac'].strip())
+                    ip = ip_to_int(record['ip'].strip())
+                    expires_at = int(record.get('expires_at') or default_expiry)
+                except (KeyError, ValueError, TypeError, AttributeError) as e:
+                    raise ValueError(f"Registro {line_no} de '{path}' no válido: {e}")
+                if ip in seen_ips:
+                    raise ValueError(
+                        f"Registro {line_no} de '{path}' no válido: la IP {int_to_ip(ip)} ya aparece en el registro {seen_ips[ip]}"
+                    )
+                seen_ips[ip] = line_no
+                yield (mac, ip, expires_at)
+
+    def import_leases(self, path, batch_size=BULK_BATCH_SIZE):
+        """
+        Importa (o pre-carga) concesiones desde un fichero en una única transacción,
+        insertando por lotes con executemany. Si alguna fila no es válida no se
+        aplica ningún cambio.
+        """
+        rows = self._read_import_rows(path)
+        now = int(time.time())
+        total = 0
+        started = time.perf_counter()
+        if not self.sql_leases:
+            # Sin transacción que deshacer: se valida el fichero completo antes de escribir
+            for mac, ip, expires_at in list(rows):
+                if expires_at > now:
+                    self.store.add_lease(mac, ip, expires_at - now)
+                    self.store.add_history_log(mac, ip, 'IMPORT')
+                    total += 1
+            return {'rows': total, 'elapsed': time.perf_counter() - started}
+        try:
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                # Una IP importada deja de pertenecer a cualquier otra MAC
+                displaced = [(row[1], row[0]) for row in batch]
+                self.cursor.executemany(
+                    "INSERT INTO lease_changes (op, mac, ip_int, expires_at, changed_at) "
+                    "SELECT ?, mac, ip_int, expires_at, ? FROM leases WHERE ip_int = ? AND mac != ?",
+                    [(LeaseDatabase.LEASE_DELETE, now, ip, mac) for ip, mac in displaced]
+                )
+                self.cursor.executemany("DELETE FROM leases WHERE ip_int = ? AND mac != ?", displaced)
+                self.cursor.executemany("REPLACE INTO leases (mac, ip_int, expires_at) VALUES (?, ?, ?)", batch)
+                self.cursor.executemany(
+                    "INSERT INTO lease_changes (op, mac, ip_int, expires_at, changed_at) VALUES (?, ?, ?, ?, ?)",
+                    [(LeaseDatabase.LEASE_SET, mac, ip, expires_at, now) for mac, ip, expires_at in batch]
+                )
+                self.cursor.executemany(
+                    "INSERT INTO leases_history (mac, ip_address, event_type, event_timestamp) VALUES (?, ?, 'IMPORT', ?)",
+                    [(int_to_mac(row[0]), int_to_ip(row[1]), now) for row in batch]
+                )
+                total += len(batch)
+            self.local_db.prune_external_changes(now)
+            self.conn.commit()
+        except (ValueError, sqlite3.Error):
+            self.conn.rollback()
+            raise
+        return {'rows': total, 'elapsed': time.perf_counter() - started}
+
+    def get_reservations(self):
+        """Reservas del almacén y de config.json; las del almacén tienen prioridad."""
+        rows, _ = self.reservations.all()
+        stored = {mac: (ip, hostname, 'almacén') for mac, ip, hostname in rows}
+        for mac_text, ip_text in self.config.get('reservations', {}).items():
+            stored.setdefault(mac_to_int(mac_text), (ip_to_int(ip_text), None, 'config.json'))
+        return [
+            {'mac': int_to_mac(mac), 'ip': int_to_ip(ip), 'hostname': hostname, 'source': source}
+            for mac, (ip, hostname, source) in sorted(stored.items(), key=lambda item: item[1][0])
+        ]
+
+    def reserve(self, mac_text, ip_text, hostname=None):
+        self.reservations.upsert([(mac_to_int(mac_text), ip_to_int(ip_text), hostname)])
+
+    def unreserve(self, mac_text):
+        return self.reservations.remove(mac_to_int(mac_text))
+
+    def import_reservations(self, path):
+        """Importa reservas (columnas mac, ip y opcionalmente hostname) en una única transacción."""
+        started = time.perf_counter()
+        fmt = file_format(path)
+        rows = []
+        with open(path, newline='') as f:
+            records = csv.DictReader(f) if fmt == 'csv' else (json.loads(line) for line in f if line.strip())
+            for line_no, record in enumerate(records, start=2 if fmt == 'csv' else 1):
+                try:
+                    rows.append((mac_to_int(record['mac'].strip()), ip_to_int(record['ip'].strip()),
+                                 (record.get('hostname') or '').strip() or None))
+                except (KeyError, ValueError, TypeError, AttributeError) as e:
+                    raise ValueError(f"Registro {line_no} de '{path}' no válido: {e}")
+        return {'rows': self.reservations.upsert(rows), 'elapsed': time.perf_counter() - started}
+
+    def request_profile(self, seconds=None):
+        """
+        Pide al servidor en marcha una sesión de perfilado (señal SIGUSR1 al
+        PID de 'pid_file'). Devuelve la duración de la sesión en segundos.
+        """
+        if not hasattr(signal, 'SIGUSR1'):
+            raise RuntimeError("El perfilado bajo demanda necesita señales POSIX (SIGUSR1).")
+        # Se comprueba que el PID sigue siendo el del servidor antes de enviarle la señal
+        pid = read_server_pid(self.pid_file)
+        if pid is None:
+            raise RuntimeError(f"No hay un servidor en marcha con el PID de '{self.pid_file}'. ¿Está arrancado?")
+        seconds = seconds or self.default_profile_seconds
+        os.makedirs(self.profile_dir, exist_ok=True)
+        write_request(os.path.join(self.profile_dir, REQUEST_FILE), seconds)
+        try:
+            os.kill(pid, signal.SIGUSR1)
+        except ProcessLookupError:
+            raise RuntimeError(f"El servidor (PID {pid}) no está en marcha.")
+        return seconds
+
+    def latest_profile(self, since=0):
+        """Perfil más reciente de 'profile_dir' escrito después de 'since', o None."""
+        try:
+            paths = [os.path.join(self.profile_dir, name) for name in os.listdir(self.profile_dir) if name.endswith('.folded')]
+        except FileNotFoundError:
+            return None
+        paths = [path for path in paths if os.path.getmtime(path) >= since]
+        return max(paths, key=os.path.getmtime) if paths else None
+
+    def export_leases(self, path):
+        """Exporta todas las concesiones a un fichero CSV o JSON Lines según su extensión."""
+        started = time.perf_counter()
+        with open(path, 'w', newline='') as f:
+            rows = export_leases(self, f, file_format(path))
+        return {'rows': rows, 'elapsed': time.perf_counter() - started}
 
     def close(self):
         """Cierra la conexión a la base de datos."""
+        self.reservations.close()
         self.conn.close()
 
 
-def display_dashboard(manager, console):
-    """Muestra el panel de control principal."""
-    stats = manager.get_pool_stats()
-    recent_history = manager.get_recent_history()
-
-    # Panel de estadísticas
+def build_stats_panel(stats):
+    """Construye el panel de uso del pool."""
     used_color = "green"
     if stats['percentage'] > 50: used_color = "yellow"
     if stats['percentage'] > 80: used_color = "red"
-    
+
     stats_text = Text(justify="center")
     stats_text.append(f"{stats['used']} / {stats['total']} IPs asignadas\n", style="bold")
     stats_text.append(f"({stats['percentage']:.2f}%)", style=used_color)
 
-    panel_stats = Panel(stats_text, title="[bold cyan]Uso del Pool[/bold cyan]", border_style="cyan")
+    return Panel(stats_text, title="[bold cyan]Uso del Pool[/bold cyan]", border_style="cyan")
+
 
-    # Tabla de histórico reciente
+def build_history_table(events):
+    """Construye la tabla de últimos eventos."""
     history_table = Table(title="[bold magenta]Últimos Eventos[/bold magenta]", border_style="magenta")
     history_table.add_column("Hora", style="dim")
     history_table.add_column("Evento", style="yellow")
     history_table.add_column("MAC Address")
     history_table.add_column("IP Address")
 
-    for item in recent_history:
+    for item in events:
         history_table.add_row(item['time'], item['type'], item['mac'], item['ip'])
-    
-    console.print(panel_stats)
+    return history_table
+
+
+def display_dashboard(manager, console):
+    """Muestra el panel de control principal."""
+    stats = manager.get_pool_stats()
+    recent_history = manager.get_recent_history()
+
+    console.print(build_stats_panel(stats))
     if recent_history:
-        console.print(history_table)
+        console.print(build_history_table(recent_history))
     else:
         console.print("[yellow]No hay eventos en el histórico todavía.[/yellow]")
 
 
-def display_leases(manager, console, search_term=None):
-    """Muestra la tabla de concesiones activas."""
-    leases = manager.get_active_leases(search_term)
-    
-    table = Table(title="[bold green]Concesiones Activas[/bold green]", show_header=True, header_style="bold green")
-    table.add_column("MAC Address", style="cyan", no_wrap=True)
-    table.add_column("IP Address", style="magenta")
-    table.add_column("Expira en", style="yellow")
+class LiveDashboard:
+    """
+    Estado del dashboard en modo --watch. En cada refresco solo lee los
+    eventos con history_id mayor que el último visto y mantiene en memoria
+    los eventos recientes y una ventana deslizante para calcular las tasas.
+    """
+    RATE_WINDOW_SECONDS = 60
+    STATS_REFRESH_SECONDS = 30
+
+    def __init__(self, manager, recent=10):
+        self.manager = manager
+        self.recent = deque(maxlen=recent)
+        self.window = deque()
+        self.session_totals = Counter()
+        self.stats = None
+        self.stats_refreshed_at = 0
+        # Carga inicial de los últimos eventos (no cuentan en los totales de la sesión)
+        self.last_id = max(0, manager.get_last_history_id() - recent)
+        self._ingest(manager.get_history_since(self.last_id), count=False)
+
+    def _ingest(self, events, count=True):
+        for event in events:
+            self.recent.appendleft(event)
+            self.window.append((event['timestamp'], event['type']))
+            if count:
+                self.session_totals[event['type']] += 1
+            self.last_id = event['id']
+
+    def poll(self, now=None):
+        now = now if now is not None else time.time()
+        new_events = 0
+        while True:
+            events = self.manager.get_history_since(self.last_id)
+            self._ingest(events)
+            new_events += len(events)
+            if len(events) < 1000:
+                break
+
+        while self.window and self.window[0][0] < now - self.RATE_WINDOW_SECONDS:
+            self.window.popleft()
 
-    if not leases:
+        # El recuento del pool solo se repite si hubo cambios o para reflejar expiraciones
+        if new_events or self.stats is None or now - self.stats_refreshed_at >= self.STATS_REFRESH_SECONDS:
+            self.stats = self.manager.get_pool_stats()
+            self.stats_refreshed_at = now
+
+    def render(self):
+        rates = Counter(event_type for _, event_type in self.window)
+        rates_table = Table(title="[bold yellow]Actividad[/bold yellow]", border_style="yellow")
+        rates_table.add_column("Evento", style="yellow")
+        rates_table.add_column(f"Últimos {self.RATE_WINDOW_SECONDS} s", justify="right")
+        rates_table.add_column("Total (sesión)", justify="right", style="dim")
+        for event_type in sorted(set(rates) | set(self.session_totals)):
+            rates_table.add_row(event_type, str(rates[event_type]), str(self.session_totals[event_type]))
+
+        parts = [build_stats_panel(self.stats), rates_table]
+        if self.recent:
+            parts.append(build_history_table(self.recent))
+        else:
+            parts.append(Text("No hay eventos en el histórico todavía.", style="yellow"))
+        parts.append(Text(f"Actualizado: {datetime.now().strftime('%H:%M:%S')} · Ctrl+C para salir", style="dim"))
+        return Group(*parts)
+
+
+def watch_dashboard(manager, console, interval=1.0):
+    """Muestra el dashboard refrescándolo de forma continua hasta Ctrl+C."""
+    dashboard = LiveDashboard(manager)
+    dashboard.poll()
+    try:
+        with Live(dashboard.render(), console=console, refresh_per_second=4) as live:
+            while True:
+                time.sleep(interval)
+                dashboard.poll()
+                live.update(dashboard.render())
+    except KeyboardInterrupt:
+        console.print("[yellow]Modo de seguimiento finalizado.[/yellow]")
+
+
+def display_leases(manager, console, search_term=None, after=None, offset=0, limit=None):
+    """Muestra las concesiones activas página a página, con memoria constante."""
+    leases = manager.iter_leases(search_term, after=after, offset=offset, limit=limit)
+    shown = 0
+    last_ip = None
+
+    while True:
+        page = [lease for _, lease in zip(range(PAGE_SIZE), leases)]
+        if not page:
+            break
+
+        title = "[bold green]Concesiones Activas[/bold green]" if shown == 0 else None
+        table = Table(title=title, show_header=True, header_style="bold green")
+        table.add_column("MAC Address", style="cyan", no_wrap=True, min_width=17)
+        table.add_column("IP Address", style="magenta", min_width=15)
+        table.add_column("Expira en", style="yellow", min_width=19)
+        for lease in page:
+            table.add_row(lease['mac'], lease['ip'], lease['expires'])
+        console.print(table)
+
+        shown += len(page)
+        last_ip = page[-1]['ip']
+        if len(page) < PAGE_SIZE:
+            break
+
+    query = manager.last_query
+    if search_term and query:
+        access = "índice" if query['indexed'] else "recorrido completo"
+        console.print(f"[dim]Búsqueda '{search_term}' de tipo {query['kind']} ({access}): "
+                      f"{query['rows']} resultados en {query['elapsed'] * 1000:.2f} ms.[/dim]")
+
+    if not shown:
         console.print("[yellow]No se encontraron concesiones activas.[/yellow]")
         return
-        
-    for lease in leases:
-        table.add_row(lease['mac'], lease['ip'], lease['expires'])
-    
+    console.print(f"[dim]{shown} concesiones mostradas. Última IP: {last_ip} (usa --after para continuar).[/dim]")
+
+
+def export_leases(manager, output, fmt, search_term=None, after=None, offset=0, limit=None):
+    """Escribe las concesiones en CSV o JSON Lines fila a fila. Devuelve el número de filas."""
+    leases = manager.iter_leases(search_term, after=after, offset=offset, limit=limit)
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for lease in leases:
+            writer.writerow(lease)
+            count += 1
+    else:
+        for lease in leases:
+            output.write(json.dumps(lease) + "\n")
+            count += 1
+    return count
+
+
+def report_bulk_result(console, action, result, noun='concesiones'):
+    """Muestra el resultado de una operación masiva con su rendimiento."""
+    rate = result['rows'] / result['elapsed'] if result['elapsed'] > 0 else 0
+    console.print(f"[green]✅ {result['rows']} {noun} {action} en {result['elapsed']:.3f} s "
+                  f"({rate:,.0f} filas/s).[/green]")
+
+
+def display_history(manager, console, identifier=None):
+    """Muestra el histórico de eventos, incluyendo las particiones archivadas."""
+    events = manager.get_history(identifier or None)
+    if not events:
+        console.print("[yellow]No se encontraron eventos en el histórico.[/yellow]")
+        return
+
+    table = Table(title="[bold magenta]Histórico de Eventos[/bold magenta]", border_style="magenta")
+    table.add_column("Fecha", style="dim")
+    table.add_column("Evento", style="yellow")
+    table.add_column("MAC Address", style="cyan")
+    table.add_column("IP Address", style="magenta")
+    table.add_column("Origen", style="dim")
+
+    for item in events:
+        table.add_row(item['time'], item['type'], item['mac'], item['ip'], item['source'])
+
+    console.print(table)
+
+
+def display_rogue_servers(manager, console):
+    """Muestra los servidores DHCP no autorizados registrados por el servidor."""
+    servers = manager.get_rogue_servers()
+    if not servers:
+        console.print("[green]No se han detectado servidores DHCP no autorizados.[/green]")
+        return
+
+    table = Table(title="[bold red]Servidores DHCP No Autorizados[/bold red]", border_style="red")
+    table.add_column("MAC Address", style="cyan")
+    table.add_column("IP Address", style="magenta")
+    table.add_column("Paquetes", justify="right", style="bold red")
+    table.add_column("Primera vez", style="dim")
+    table.add_column("Última vez", style="yellow")
+
+    for server in servers:
+        table.add_row(server['mac'], server['ip'], str(server['packets']), server['first_seen'], server['last_seen'])
+
+    console.print(table)
+
+
+def display_profile(console, path, limit=20):
+    """Informe de un perfil de pilas colapsadas: funciones con más muestras propias."""
+    counts = read_collapsed(path)
+    total = sum(counts.values())
+    if not total:
+        console.print(f"[yellow]El perfil '{path}' no tiene muestras del servidor.[/yellow]")
+        return
+    table = Table(title=f"Camino caliente: {path} ({total} muestras)", border_style="red")
+    table.add_column("Función", style="cyan")
+    table.add_column("Propias", justify="right", style="bold red")
+    table.add_column("% propias", justify="right")
+    table.add_column("Inclusivas", justify="right", style="yellow")
+    table.add_column("% inclusivas", justify="right")
+    for label, self_count, total_count in hot_paths(counts, limit):
+        table.add_row(label, str(self_count), f"{self_count / total:.1%}", str(total_count), f"{total_count / total:.1%}")
+    console.print(table)
+    console.print(f"[dim]Gráfico de llama: flamegraph.pl {path} > perfil.svg (o ábrelo en speedscope.app).[/dim]")
+
+
+def profile_server(manager, console, seconds=None):
+    """Lanza una sesión de perfilado en el servidor, espera a que termine y muestra el informe."""
+    requested_at = time.time()
+    seconds = manager.request_profile(seconds)
+    console.print(f"[cyan]Perfilando el servidor durante {seconds} s...[/cyan]")
+    deadline = requested_at + seconds + 10
+    path = None
+    while path is None and time.time() < deadline:
+        time.sleep(0.5)
+        path = manager.latest_profile(since=requested_at)
+    if path is None:
+        console.print(f"[red]❌ El servidor no escribió ningún perfil en '{manager.profile_dir}'.[/red]")
+        return
+    display_profile(console, path)
+
+
+def display_reservations(manager, console):
+    """Muestra las reservas estáticas, tanto del almacén como de config.json."""
+    reservations = manager.get_reservations()
+    if not reservations:
+        console.print("[yellow]No hay reservas configuradas.[/yellow]")
+        return
+    table = Table(title=f"Reservas estáticas ({len(reservations)})", border_style="cyan")
+    table.add_column("Dirección MAC", style="magenta")
+    table.add_column("Dirección IP", style="green")
+    table.add_column("Hostname")
+    table.add_column("Origen", style="dim")
+    for reservation in reservations:
+        table.add_row(reservation['mac'], reservation['ip'], reservation['hostname'] or "-", reservation['source'])
     console.print(table)
 
 
@@ -174,7 +813,31 @@ def main():
     parser.add_argument(
         '--search',
         type=str,
-        help='Filtra la lista de concesiones por IP o MAC.'
+        help='Filtra la lista de concesiones. Admite MAC exacta, prefijo de MAC (OUI),\n'
+             'IP exacta o red CIDR (resueltas por índice); otro texto se busca como subcadena.'
+    )
+    parser.add_argument(
+        '--limit',
+        type=int,
+        help='Número máximo de concesiones a listar.'
+    )
+    parser.add_argument(
+        '--offset',
+        type=int,
+        default=0,
+        help='Número de concesiones a saltar antes de empezar a listar.'
+    )
+    parser.add_argument(
+        '--after',
+        metavar='IP',
+        type=IPv4Address,
+        help='Continúa el listado a partir de la IP indicada (paginación por clave).'
+    )
+    parser.add_argument(
+        '--format',
+        choices=['table', 'csv', 'jsonl'],
+        default='table',
+        help='Formato de salida del listado: tabla (por defecto), CSV o JSON Lines.'
     )
     parser.add_argument(
         '--free-lease',
@@ -182,6 +845,96 @@ def main():
         type=str,
         help='Libera una concesión activa especificando su IP o MAC.'
     )
+    parser.add_argument(
+        '--free-range',
+        metavar='CIDR',
+        type=IPv4Network,
+        help='Libera en bloque todas las concesiones de una red (ej: 192.168.1.0/25).'
+    )
+    parser.add_argument(
+        '--import',
+        dest='import_file',
+        metavar='FICHERO',
+        help='Importa concesiones desde un fichero CSV o JSON Lines (mismo formato que --export).'
+    )
+    parser.add_argument(
+        '--export',
+        dest='export_file',
+        metavar='FICHERO',
+        help='Exporta todas las concesiones a un fichero .csv o .jsonl.'
+    )
+    parser.add_argument(
+        '--yes',
+        action='store_true',
+        help='No pide confirmación en las operaciones masivas.'
+    )
+    parser.add_argument(
+        '--history',
+        metavar='IP_o_MAC',
+        nargs='?',
+        const='',
+        help='Muestra el histórico de eventos (tabla viva y archivos), opcionalmente filtrado por IP o MAC.'
+    )
+    parser.add_argument(
+        '--reservations',
+        action='store_true',
+        help='Muestra las reservas estáticas (almacén y config.json).'
+    )
+    parser.add_argument(
+        '--reserve',
+        nargs=2,
+        metavar=('MAC', 'IP'),
+        help='Crea o actualiza una reserva. El servidor la aplica sin reiniciarse.'
+    )
+    parser.add_argument(
+        '--hostname',
+        help='Hostname opcional para --reserve.'
+    )
+    parser.add_argument(
+        '--unreserve',
+        metavar='MAC',
+        help='Elimina la reserva de una MAC del almacén de reservas.'
+    )
+    parser.add_argument(
+        '--import-reservations',
+        metavar='FICHERO',
+        help='Importa reservas desde un fichero CSV o JSON Lines (campos mac, ip y hostname opcional).'
+    )
+    parser.add_argument(
+        '--rogues',
+        action='store_true',
+        help='Muestra los servidores DHCP no autorizados detectados en la red.'
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Muestra el dashboard en vivo, refrescándolo de forma continua.'
+    )
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=1.0,
+        help='Segundos entre refrescos del dashboard en modo --watch (por defecto: 1).'
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='SEGUNDOS',
+        type=float,
+        nargs='?',
+        const=0,
+        help='Perfila el servidor en marcha por muestreo (por defecto, default_duration_seconds)\n'
+             'y muestra las funciones más calientes. El perfil queda en formato de pilas colapsadas.'
+    )
+    parser.add_argument(
+        '--profile-report',
+        metavar='FICHERO',
+        help='Muestra el informe de un perfil ya guardado (.folded).'
+    )
+    parser.add_argument(
+        '--archive-history',
+        action='store_true',
+        help='Mueve ahora los eventos antiguos del histórico a los archivos mensuales.'
+    )
 
     # Si no se dan argumentos, mostramos la ayuda. sys.argv tiene el nombre del script en [0].
     if len(sys.argv) == 1:
@@ -201,7 +954,10 @@ def main():
 
     try:
         if args.leases or args.search:
-            display_leases(manager, console, args.search)
+            if args.format == 'table':
+                display_leases(manager, console, args.search, args.after, args.offset, args.limit)
+            else:
+                export_leases(manager, sys.stdout, args.format, args.search, args.after, args.offset, args.limit)
         elif args.free_lease:
             console.print(f"¿Está seguro que desea liberar la concesión para '[bold yellow]{args.free_lease}[/bold yellow]'? [y/N]: ", end="")
             if input().lower() == 'y':
@@ -211,6 +967,61 @@ def main():
                     console.print(f"[red]❌ No se encontró una concesión activa para '{args.free_lease}'.[/red]")
             else:
                 console.print("[yellow]Operación cancelada.[/yellow]")
+        elif args.free_range:
+            count = manager.count_leases_in_range(args.free_range)
+            if not count:
+                console.print(f"[yellow]No hay concesiones en la red {args.free_range}.[/yellow]")
+            else:
+                confirmed = args.yes
+                if not confirmed:
+                    console.print(f"¿Liberar [bold yellow]{count}[/bold yellow] concesiones de la red "
+                                  f"'[bold yellow]{args.free_range}[/bold yellow]'? [y/N]: ", end="")
+                    confirmed = input().lower() == 'y'
+                if confirmed:
+                    report_bulk_result(console, "liberadas", manager.free_range(args.free_range))
+                else:
+                    console.print("[yellow]Operación cancelada.[/yellow]")
+        elif args.import_file:
+            try:
+                report_bulk_result(console, "importadas", manager.import_leases(args.import_file))
+            except (OSError, ValueError) as e:
+                console.print(f"[red]❌ Importación cancelada, no se ha aplicado ningún cambio: {e}[/red]")
+        elif args.export_file:
+            report_bulk_result(console, f"exportadas a '{args.export_file}'", manager.export_leases(args.export_file))
+        elif args.history is not None:
+            display_history(manager, console, args.history)
+        elif args.reservations:
+            display_reservations(manager, console)
+        elif args.reserve:
+            try:
+                manager.reserve(args.reserve[0], args.reserve[1], args.hostname)
+                console.print(f"[green]✅ Reserva guardada: {args.reserve[0]} -> {args.reserve[1]}.[/green]")
+            except ValueError as e:
+                console.print(f"[red]❌ No se pudo guardar la reserva: {e}[/red]")
+        elif args.unreserve:
+            if manager.unreserve(args.unreserve):
+                console.print(f"[green]✅ Reserva de '{args.unreserve}' eliminada.[/green]")
+            else:
+                console.print(f"[red]❌ '{args.unreserve}' no tiene reserva en el almacén.[/red]")
+        elif args.import_reservations:
+            try:
+                report_bulk_result(console, "importadas", manager.import_reservations(args.import_reservations), 'reservas')
+            except (OSError, ValueError) as e:
+                console.print(f"[red]❌ Importación cancelada, no se ha aplicado ningún cambio: {e}[/red]")
+        elif args.rogues:
+            display_rogue_servers(manager, console)
+        elif args.archive_history:
+            moved = manager.archive_history()
+            console.print(f"[green]✅ {moved} eventos archivados en '{manager.archive_dir}'.[/green]")
+        elif args.profile is not None:
+            try:
+                profile_server(manager, console, args.profile)
+            except RuntimeError as e:
+                console.print(f"[red]❌ {e}[/red]")
+        elif args.profile_report:
+            display_profile(console, args.profile_report)
+        elif args.watch:
+            watch_dashboard(manager, console, args.interval)
         else:
             # Comportamiento por defecto: mostrar el dashboard
             display_dashboard(manager, console)
@@ -0,0 +1,98 @@
+# src/net_utils.py
+import re
+from ipaddress import IPv4Address, IPv4Network
+
+MAC_SEPARATORS = re.compile(r'[:\-.]')
+HEX_DIGITS = re.compile(r'^[0-9a-f]*$')
+
+
+def ip_to_int(ip):
+    """Convierte una IP en texto ('192.168.1.10') a su entero de 32 bits."""
+    return int(IPv4Address(ip))
+
+
+def int_to_ip(value):
+    """Convierte un entero de 32 bits a su representación en texto."""
+    return str(IPv4Address(value))
+
+
+def normalize_mac(mac):
+    """Normaliza una MAC a 12 dígitos hexadecimales en minúscula, sin separadores."""
+    return MAC_SEPARATORS.sub('', mac).lower()
+
+
+def mac_to_int(mac):
+    """
+    Convierte una MAC en cualquier formato habitual (aa:bb:.., AA-BB-.., aabb.ccdd..)
+    a su entero de 48 bits. Lanza ValueError si no es una MAC válida.
+    """
+    digits = normalize_mac(mac)
+    if len(digits) != 12:
+        raise ValueError(f"MAC no válida: '{mac}'")
+    return int(digits, 16)
+
+
+def int_to_mac(value):
+    """Convierte un entero de 48 bits a la forma canónica 'aa:bb:cc:dd:ee:ff'."""
+    digits = f"{value:012x}"
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+class SearchQuery:
+    """
+    Clasifica un término de búsqueda del gestor y lo traduce a una condición
+    SQL que pueda resolverse con un índice:
+      - 'mac'        MAC completa           -> mac = ?
+      - 'oui'        prefijo de MAC (OUI)    -> rango sobre mac (entero de 48 bits)
+      - 'ip'         IP exacta               -> ip_int = ?
+      - 'cidr'       red en notación CIDR    -> rango sobre ip_int
+      - 'substring'  cualquier otra cosa     -> LIKE (recorre la tabla)
+    """
+
+    def __init__(self, term):
+        self.term = term.strip()
+        self.kind, self.condition, self.params = self._classify(self.term.lower())
+
+    @property
+    def uses_index(self):
+        return self.kind != 'substring'
+
+    def matches(self, mac, ip):
+        """Evalúa la búsqueda en Python, para almacenes sin SQL (ver src/lease_store.py)."""
+        if self.kind == 'substring':
+            term = self.term.lower()
+            return term in int_to_mac(mac) or term in int_to_ip(ip)
+        value = mac if self.kind in ('mac', 'oui') else ip
+        return self.params[0] <= value <= self.params[-1]
+
+    def _classify(self, term):
+        if '/' in term:
+            try:
+                network = IPv4Network(term, strict=False)
+                return 'cidr', "ip_int BETWEEN ? AND ?", [int(network.network_address), int(network.broadcast_address)]
+            except ValueError:
+                pass
+        try:
+            return 'ip', "ip_int = ?", [ip_to_int(term)]
+        except ValueError:
+            pass
+
+        octets = MAC_SEPARATORS.split(term)
+        has_separators = len(octets) > 1
+        if has_separators and octets[-1] == '':
+            octets.pop()  # Admite prefijos escritos con separador final ("aa:bb:cc:")
+        digits = ''.join(octets)
+        if digits and HEX_DIGITS.match(digits):
+            # Grupos de 2 (aa:bb:cc) o de 4 dígitos (aabb.ccdd.eeff, formato Cisco)
+            well_formed = len({len(octet) for octet in octets}) == 1 and len(octets[0]) in (2, 4) if has_separators else True
+            if well_formed and len(digits) == 12:
+                return 'mac', "mac = ?", [int(digits, 16)]
+            if well_formed and (has_separators or len(digits) == 6) and len(digits) < 12 and len(digits) % 2 == 0:
+                # Un prefijo de n bits cubre el rango [prefijo << (48 - n), siguiente prefijo)
+                shift = 48 - 4 * len(digits)
+                first = int(digits, 16) << shift
+                return 'oui', "mac BETWEEN ? AND ?", [first, first + (1 << shift) - 1]
+
+        # mac_text() e ipv4_text() son conversiones registradas en la conexión
+        # (ver database.register_sql_functions)
+        return 'substring', "(mac_text(mac) LIKE ? OR ipv4_text(ip_int) LIKE ?)", [f'%{self.term}%', f'%{self.term}%']
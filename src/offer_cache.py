@@ -0,0 +1,103 @@
+# src/offer_cache.py
+import threading
+import time
+
+# Desplazamientos dentro de la trama Ethernet + IPv4 (sin opciones) + UDP + BOOTP
+UDP_CHECKSUM_OFFSET = 40
+XID_OFFSET = 46
+
+
+class PreparedPacket(bytes):
+    """
+    Trama ya serializada, lista para enviar, con los datos que necesita el
+    logging del servidor para no tener que diseccionarla de nuevo.
+    """
+
+    def __new__(cls, data, client_mac, yiaddr, msg_type):
+        packet = super().__new__(cls, data)
+        packet.client_mac = client_mac
+        packet.yiaddr = yiaddr
+        packet.msg_type = msg_type
+        return packet
+
+
+def _ones_complement_add(a, b):
+    total = a + b
+    return (total & 0xFFFF) + (total >> 16)
+
+
+def patch_xid(template, xid):
+    """
+    Devuelve una copia de 'template' con el xid sustituido, actualizando el
+    checksum UDP de forma incremental (RFC 1624) en lugar de recalcularlo.
+    """
+    data = bytearray(template)
+    checksum = int.from_bytes(data[UDP_CHECKSUM_OFFSET:UDP_CHECKSUM_OFFSET + 2], 'big')
+    if checksum:  # 0 significa "sin checksum" en UDP/IPv4
+        old = int.from_bytes(data[XID_OFFSET:XID_OFFSET + 4], 'big')
+        # HC' = ~(~HC + ~m + m') aplicado a las dos palabras de 16 bits del xid
+        value = ~checksum & 0xFFFF
+        for shift in (16, 0):
+            value = _ones_complement_add(value, ~(old >> shift) & 0xFFFF)
+            value = _ones_complement_add(value, (xid >> shift) & 0xFFFF)
+        checksum = ~value & 0xFFFF or 0xFFFF
+        data[UDP_CHECKSUM_OFFSET:UDP_CHECKSUM_OFFSET + 2] = checksum.to_bytes(2, 'big')
+    data[XID_OFFSET:XID_OFFSET + 4] = xid.to_bytes(4, 'big')
+    return bytes(data)
+
+
+class OfferCache:
+    """
+    Caché por MAC de DHCPOFFER ya serializados para clientes conocidos (con
+    reserva o con concesión vigente). Cada entrada guarda la trama completa y
+    la "variante" de la petición que la originó (flags, giaddr, ciaddr,
+    chaddr), que determina las direcciones de destino; si coincide, basta
+    con copiar la plantilla y parchear el xid.
+
+    Las entradas caducan al expirar la concesión o tras 'ttl' segundos (los
+    cambios hechos desde manager.py no llegan a este proceso), y se
+    invalidan al cambiar la concesión de esa MAC o al recargar la configuración.
+    """
+
+    def __init__(self, max_entries=50000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # mac -> (variante, plantilla, ip, válida_hasta)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, mac, variant, xid, now=None):
+        """Devuelve (trama, ip) si hay una oferta válida para esta MAC y variante, o None."""
+        now = time.time() if now is None else now
+        entry = self.entries.get(mac)
+        if entry is None or entry[0] != variant or entry[3] <= now:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return patch_xid(entry[1], xid), entry[2]
+
+    def put(self, mac, variant, packet_bytes, ip, expires_at=None, now=None):
+        now = time.time() if now is None else now
+        valid_until = now + self.ttl if expires_at is None else min(expires_at, now + self.ttl)
+        with self._lock:
+            if mac not in self.entries and len(self.entries) >= self.max_entries:
+                # Se descarta la entrada más antigua (los dict conservan el orden de inserción)
+                del self.entries[next(iter(self.entries))]
+            self.entries[mac] = (variant, packet_bytes, ip, valid_until)
+
+    def invalidate(self, mac):
+        with self._lock:
+            self.entries.pop(mac, None)
+
+    def on_lease_change(self, op, mac, ip, expires_at, replicated=False):
+        """Listener del almacén de concesiones: cualquier cambio de la concesión invalida la oferta."""
+        self.invalidate(mac)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
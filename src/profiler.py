@@ -0,0 +1,201 @@
+# src/profiler.py
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+REQUEST_FILE = 'peticion.json'
+
+
+def read_request(path):
+    """Duración pedida por manager.py junto con la señal (None si no hay petición)."""
+    try:
+        with open(path) as f:
+            seconds = json.load(f).get('duration_seconds')
+        os.remove(path)
+        return seconds
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def write_request(path, seconds):
+    with open(path, 'w') as f:
+        json.dump({'duration_seconds': seconds}, f)
+
+
+def write_pid_file(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def remove_pid_file(path):
+    """Borra el fichero de PID al parar, solo si sigue siendo el de este proceso."""
+    try:
+        with open(path) as f:
+            if f.read().strip() == str(os.getpid()):
+                os.remove(path)
+    except OSError:
+        pass
+
+
+def read_server_pid(path):
+    """
+    PID del servidor en marcha según 'path', o None si no hay fichero o el
+    proceso ya no es el servidor (un PID reutilizado tras una caída). Sin
+    /proc no se puede comprobar la línea de órdenes y se confía en el fichero.
+    """
+    try:
+        with open(path) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            cmdline = f.read().split(b'\0')
+    except FileNotFoundError:
+        return pid if not os.path.isdir('/proc') else None
+    except OSError:
+        return None
+    is_server = any(arg == b'src.server' or arg.endswith(b'server.py') for arg in cmdline)
+    return pid if is_server else None
+
+
+class SamplingProfiler:
+    """
+    Perfilador por muestreo que se activa con el servidor en marcha, sin
+    reiniciarlo bajo cProfile.
+
+    Mientras dura la sesión, un hilo toma cada 'interval' segundos la pila
+    de todos los hilos con sys._current_frames() y cuenta las que pasan por
+    el código del servidor (src/). Los hilos no se detienen ni se
+    instrumentan: el coste es el del propio hilo de muestreo y no hay
+    ninguno cuando está parado. Como el muestreador necesita el GIL, las
+    muestras tienden a caer en los puntos donde los hilos lo sueltan
+    (consultas SQLite, E/S): es un perfil del camino caliente, no un conteo
+    exacto de tiempo de CPU.
+
+    El resultado se escribe en formato de pilas colapsadas
+    ("marco;marco;marco cuenta" por línea), el que aceptan flamegraph.pl,
+    speedscope o inferno. Las pilas empiezan en el primer marco de src/:
+    se omite el arranque de threading y de scapy.
+    """
+
+    def __init__(self, output_dir='data/profiles', interval=0.005, default_duration=30):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.default_duration = default_duration
+        self.request_path = os.path.join(output_dir, REQUEST_FILE)
+        self.labels = {}
+        self.last_output = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=None):
+        """Lanza una sesión de muestreo. Devuelve False si ya había una en curso."""
+        with self._lock:
+            if self.running:
+                return False
+            self._thread = threading.Thread(target=self._run, args=(duration or self.default_duration,),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+        return True
+
+    def _label(self, code):
+        # Una etiqueta por objeto código: solo se formatea la primera vez que aparece
+        label = self.labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if filename.startswith(SRC_DIR):
+                filename = 'src/' + os.path.relpath(filename, SRC_DIR)
+            else:
+                filename = os.path.basename(filename)
+            label = self.labels[code] = f"{code.co_name} ({filename})"
+        return label
+
+    def _stack(self, frame):
+        codes = []
+        first_src = None
+        while frame is not None:
+            code = frame.f_code
+            codes.append(code)
+            if code.co_filename.startswith(SRC_DIR):
+                first_src = len(codes)
+            frame = frame.f_back
+        if first_src is None:
+            return None
+        # De la raíz a la hoja, empezando en el marco de src/ más externo
+        return ';'.join(self._label(code) for code in reversed(codes[:first_src]))
+
+    def sample(self, counts, own_ident):
+        """Añade a 'counts' una muestra de cada hilo que esté ejecutando código de src/."""
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = self._stack(frame)
+            if stack:
+                counts[stack] += 1
+
+    def _run(self, duration):
+        counts = Counter()
+        own_ident = threading.get_ident()
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + duration
+        print(f"[PERFIL] Muestreando durante {duration} s (cada {self.interval * 1000:.0f} ms)...")
+        next_tick = started
+        while next_tick < deadline:
+            self.sample(counts, own_ident)
+            samples += 1
+            next_tick += self.interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        path = self.write(counts)
+        print(f"[PERFIL] {samples} muestras, {sum(counts.values())} pilas del servidor escritas en '{path}'.")
+        for label, self_count, _ in hot_paths(counts, limit=5):
+            print(f"[PERFIL]   {self_count:>6}  {label}")
+
+    def write(self, counts):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"perfil-{datetime.now():%Y%m%d-%H%M%S}.folded")
+        with open(path, 'w') as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        self.last_output = path
+        return path
+
+
+def read_collapsed(path):
+    """Lee un fichero de pilas colapsadas en un Counter {pila: muestras}."""
+    counts = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                counts[stack] += int(count)
+    return counts
+
+
+def hot_paths(counts, limit=20):
+    """
+    Funciones más calientes de un perfil: lista de (función, muestras
+    propias, muestras inclusivas) ordenada por muestras propias (las que la
+    tenían en la cima de la pila).
+    """
+    self_counts = Counter()
+    total_counts = Counter()
+    for stack, count in counts.items():
+        frames = stack.split(';')
+        self_counts[frames[-1]] += count
+        for frame in set(frames):
+            total_counts[frame] += count
+    return [(label, count, total_counts[label]) for label, count in self_counts.most_common(limit)]
@@ -0,0 +1,67 @@
+# src/rate_limiter.py
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """
+    Limitador de tasa por clave (MAC de origen, giaddr del relay...) basado en
+    cubetas de tokens: cada clave acumula 'rate' tokens por segundo hasta un
+    máximo de 'burst', y cada paquete consume uno.
+
+    La tabla de cubetas está acotada: se recorre en orden de último uso y se
+    descartan las claves inactivas más de 'idle_seconds' (una cubeta inactiva
+    ya estaría llena, así que olvidarla no cambia el resultado) y, si aun así
+    se supera 'max_keys', las menos recientes. Así una avalancha de MACs
+    falsificadas no hace crecer la memoria sin límite.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000, idle_seconds=60):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        # clave -> [tokens, último_acceso, descartes_consecutivos]
+        self.buckets = OrderedDict()
+        self.allowed = 0
+        self.dropped = 0
+        self.evicted = 0
+
+    def check(self, key, now=None):
+        """
+        Consume un token de 'key'. Devuelve 0 si el paquete puede procesarse o,
+        si se descarta, cuántos paquetes seguidos lleva descartados esa clave
+        (1 indica que la clave acaba de empezar a ser limitada).
+        """
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now, 0]
+            self._evict(now)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = 0
+            self.allowed += 1
+            return 0
+        bucket[2] += 1
+        self.dropped += 1
+        return bucket[2]
+
+    def _evict(self, now):
+        while self.buckets:
+            key, (_, last_seen, _) = next(iter(self.buckets.items()))
+            if len(self.buckets) <= self.max_keys and now - last_seen < self.idle_seconds:
+                break
+            del self.buckets[key]
+            self.evicted += 1
+
+    def stats(self):
+        return {
+            'allowed': self.allowed, 'dropped': self.dropped,
+            'tracked_keys': len(self.buckets), 'evicted': self.evicted
+        }
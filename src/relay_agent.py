@@ -0,0 +1,96 @@
+# src/relay_agent.py
+from collections import namedtuple
+
+from scapy.all import DHCP
+
+from src.net_utils import ip_to_int
+
+# Subopciones de la opción 82 (RFC 3046) que se pueden usar en las reglas
+SUBOPTIONS = {'circuit_id': 1, 'remote_id': 2}
+
+RelayRule = namedtuple('RelayRule', ['index', 'name', 'pool', 'lease_class', 'scope'])
+
+
+def relay_agent_option(pkt):
+    """Contenido en bruto de la opción 82 del paquete, o None."""
+    return next((opt[1] for opt in pkt[DHCP].options if opt[0] == 'relay_agent_information'), None)
+
+
+def parse_suboptions(data):
+    """Separa las subopciones TLV de la opción 82 en un diccionario {código: bytes}."""
+    suboptions = {}
+    position = 0
+    while position + 2 <= len(data):
+        code, length = data[position], data[position + 1]
+        value = data[position + 2:position + 2 + length]
+        if len(value) < length:
+            break  # Subopción truncada: se ignora el resto
+        suboptions[code] = value
+        position += 2 + length
+    return suboptions
+
+
+def _rule_value(value):
+    """Los valores de las reglas son texto, o hexadecimal si empiezan por '0x'."""
+    return bytes.fromhex(value[2:]) if value.startswith('0x') else value.encode()
+
+
+class RelayRuleTable:
+    """
+    Reglas de clasificación por opción 82, compiladas al cargar la
+    configuración en tablas de búsqueda:
+      - coincidencias exactas: diccionario {(subopción, valor): regla}
+      - prefijos: por subopción, un diccionario por longitud de prefijo
+    Clasificar un paquete cuesta una consulta por subopción y longitud de
+    prefijo distinta, no un recorrido de todas las reglas. Si coinciden
+    varias reglas gana la que aparece antes en la configuración.
+
+    Cada regla puede fijar un pool ("pool_start"/"pool_end"), una clase de
+    la política de concesiones ("lease_class") y un ámbito de 'scopes' para
+    las opciones de red ("scope"). Se define con "circuit_id", "remote_id",
+    "circuit_id_prefix" o "remote_id_prefix".
+    """
+
+    def __init__(self, rules_cfg):
+        self.exact = {}
+        self.prefixes = {code: {} for code in SUBOPTIONS.values()}
+        # Pools reservados a reglas: el pool principal no los reparte
+        self.pools = []
+        for index, rule_cfg in enumerate(rules_cfg):
+            pool = None
+            if 'pool_start' in rule_cfg:
+                pool = (ip_to_int(rule_cfg['pool_start']), ip_to_int(rule_cfg['pool_end']))
+                self.pools.append(pool)
+            rule = RelayRule(index, rule_cfg.get('name', f"regla-{index}"), pool,
+                             rule_cfg.get('lease_class'), rule_cfg.get('scope'))
+            matched = False
+            for name, code in SUBOPTIONS.items():
+                if name in rule_cfg:
+                    self.exact.setdefault((code, _rule_value(rule_cfg[name])), rule)
+                    matched = True
+                if f"{name}_prefix" in rule_cfg:
+                    prefix = _rule_value(rule_cfg[f"{name}_prefix"])
+                    self.prefixes[code].setdefault(len(prefix), {}).setdefault(prefix, rule)
+                    matched = True
+            if not matched:
+                raise ValueError(f"La regla de relay '{rule.name}' no define circuit_id ni remote_id.")
+        # Longitudes de prefijo existentes por subopción, de mayor a menor
+        self.lengths = {code: sorted(table, reverse=True) for code, table in self.prefixes.items()}
+
+    def __bool__(self):
+        return bool(self.exact) or any(self.lengths.values())
+
+    def classify(self, suboptions):
+        """Regla que corresponde a las subopciones recibidas, o None."""
+        best = None
+        for code, value in suboptions.items():
+            rule = self.exact.get((code, value))
+            if rule and (best is None or rule.index < best.index):
+                best = rule
+            for length in self.lengths.get(code, ()):
+                if length > len(value):
+                    continue
+                rule = self.prefixes[code][length].get(value[:length])
+                if rule and (best is None or rule.index < best.index):
+                    best = rule
+        return best
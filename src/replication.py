@@ -0,0 +1,263 @@
+# src/replication.py
+import queue
+import socket
+import struct
+import threading
+import time
+
+# Formato binario del registro de cambios (big-endian, 15 bytes por cambio):
+#   op (1 byte) | mac (6 bytes) | ip (4 bytes) | expires_at (4 bytes)
+# Cada trama lleva una cabecera con su tipo y el número de registros.
+RECORD = struct.Struct('!B6sII')
+FRAME_HEADER = struct.Struct('!BH')
+FRAME_CHANGES = 1
+FRAME_HEARTBEAT = 2
+MAX_RECORDS_PER_FRAME = 0xFFFF
+
+
+def encode_changes(changes):
+    """Codifica una lista de cambios (op, mac, ip, expires_at) como bytes contiguos."""
+    return b''.join(RECORD.pack(op, mac.to_bytes(6, 'big'), ip, expires_at) for op, mac, ip, expires_at in changes)
+
+
+def decode_changes(data):
+    """Operación inversa de encode_changes."""
+    return [
+        (op, int.from_bytes(mac, 'big'), ip, expires_at)
+        for op, mac, ip, expires_at in RECORD.iter_unpack(data)
+    ]
+
+
+def parse_address(value, default_host='0.0.0.0'):
+    """Convierte 'host:puerto' (o solo 'puerto') en una tupla (host, puerto)."""
+    host, _, port = str(value).rpartition(':')
+    return (host or default_host, int(port))
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("El servidor par cerró la conexión.")
+        data.extend(chunk)
+    return bytes(data)
+
+
+class ReplicationSender:
+    """
+    Envía al servidor par, por TCP, los cambios de concesiones de la base de
+    datos local. Agrupa los cambios en tramas (hasta 'batch_size' registros o
+    'batch_window' segundos) y envía latidos cuando no hay actividad. Al
+    (re)conectar manda primero todas las concesiones vigentes.
+
+    Los borrados hechos sin conexión no aparecen en esa lista, así que se
+    guardan como lápidas ('tombstones': mac -> (ip, expires_at)) y se envían
+    como LEASE_DELETE antes de las concesiones. El par solo los aplica si no
+    ha renovado la concesión desde entonces (ver apply_replicated_changes).
+    """
+
+    def __init__(self, db, peer, batch_size=256, batch_window=0.05, heartbeat_interval=1.0, retry_interval=2.0):
+        self.db = db
+        self.peer = peer
+        self.batch_size = min(batch_size, MAX_RECORDS_PER_FRAME)
+        self.batch_window = batch_window
+        self.heartbeat_interval = heartbeat_interval
+        self.retry_interval = retry_interval
+        self.pending = queue.Queue()
+        self.tombstones = {}
+        self._tombstone_lock = threading.Lock()
+        self.connected = False
+        self.stats = {'frames': 0, 'records': 0, 'full_syncs': 0}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def on_lease_change(self, op, mac, ip, expires_at, replicated=False):
+        """Listener del almacén de concesiones: solo encola, nunca bloquea al handler."""
+        if replicated:
+            return
+        if self.connected:
+            self.pending.put((op, mac, ip, expires_at))
+        else:
+            self._remember([(op, mac, ip, expires_at)])
+
+    def _remember(self, changes):
+        # Cambios que no llegaron al par: los borrados quedan como lápidas
+        with self._tombstone_lock:
+            for op, mac, ip, expires_at in changes:
+                if op == self.db.LEASE_DELETE:
+                    self.tombstones[mac] = (ip, expires_at)
+                else:
+                    self.tombstones.pop(mac, None)
+
+    def _send_frame(self, sock, frame_type, changes=()):
+        sock.sendall(FRAME_HEADER.pack(frame_type, len(changes)) + encode_changes(changes))
+        self.stats['frames'] += 1
+        self.stats['records'] += len(changes)
+
+    def _next_batch(self):
+        try:
+            batch = [self.pending.get(timeout=self.heartbeat_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _full_sync(self, sock):
+        # Los cambios encolados antes de conectar quedan cubiertos por la sincronización completa
+        self.connected = True
+        drained = []
+        while not self.pending.empty():
+            drained.append(self.pending.get_nowait())
+        self._remember(drained)
+        now = self.db.clock.time()
+        with self._tombstone_lock:
+            tombstones, self.tombstones = self.tombstones, {}
+        # Una lápida de una concesión ya vencida no cambia nada en el par
+        deletes = [
+            (self.db.LEASE_DELETE, mac, ip, expires_at)
+            for mac, (ip, expires_at) in tombstones.items() if not expires_at or expires_at > now
+        ]
+        leases = [(self.db.LEASE_SET, mac, ip, expires_at) for mac, ip, expires_at in self.db.get_all_leases()]
+        changes = deletes + leases
+        try:
+            for start in range(0, len(changes), self.batch_size):
+                self._send_frame(sock, FRAME_CHANGES, changes[start:start + self.batch_size])
+        except OSError:
+            self._remember(deletes)
+            raise
+        self.stats['full_syncs'] += 1
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                with socket.create_connection(self.peer, timeout=5) as sock:
+                    self._full_sync(sock)
+                    while not self._stop_event.is_set():
+                        batch = self._next_batch()
+                        try:
+                            self._send_frame(sock, FRAME_CHANGES if batch else FRAME_HEARTBEAT, batch)
+                        except OSError:
+                            self._remember(batch)
+                            raise
+            except OSError:
+                pass
+            self.connected = False
+            self._stop_event.wait(self.retry_interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="replication-sender", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class ReplicationReceiver:
+    """
+    Escucha las tramas del servidor par y aplica sus cambios a la base de
+    datos local, una transacción por trama. Cualquier trama (también los
+    latidos) sirve para saber que el par sigue vivo.
+    """
+
+    def __init__(self, db, listen):
+        self.db = db
+        self.listen = listen
+        self.last_seen = None
+        self.stats = {'frames': 0, 'records': 0}
+        self._stop_event = threading.Event()
+        self._server = None
+        self._thread = None
+
+    def _serve_peer(self, conn):
+        with conn:
+            while not self._stop_event.is_set():
+                frame_type, count = FRAME_HEADER.unpack(_recv_exact(conn, FRAME_HEADER.size))
+                changes = decode_changes(_recv_exact(conn, count * RECORD.size)) if count else []
+                if frame_type == FRAME_CHANGES and changes:
+                    self.db.apply_replicated_changes(changes)
+                self.last_seen = time.monotonic()
+                self.stats['frames'] += 1
+                self.stats['records'] += len(changes)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                break
+            try:
+                self._serve_peer(conn)
+            except (OSError, ConnectionError, struct.error):
+                pass
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(self.listen)
+        self._server.listen(1)
+        self._thread = threading.Thread(target=self._run, name="replication-receiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._server:
+            self._server.close()
+
+
+class FailoverPeer:
+    """
+    Empareja dos instancias del servidor. Cada una replica sus cambios a la
+    otra y decide si debe atender peticiones según el modo:
+      - 'active-standby': el 'primary' atiende siempre; el 'secondary' solo
+        cuando deja de recibir tramas del par durante 'takeover_seconds'.
+      - 'split': ambos atienden, cada uno asignando de su mitad del pool
+        ('primary' la baja, 'secondary' la alta); si el par cae, el
+        superviviente usa el pool completo.
+    """
+
+    def __init__(self, db, config):
+        self.mode = config.get('mode', 'active-standby')
+        self.role = config.get('role', 'primary')
+        if self.mode not in ('active-standby', 'split') or self.role not in ('primary', 'secondary'):
+            raise ValueError(f"Configuración de failover no válida: modo '{self.mode}', rol '{self.role}'.")
+        self.takeover_seconds = config.get('takeover_seconds', 10)
+        self.peer_server_ip = config.get('peer_server_ip')
+        self.sender = ReplicationSender(
+            db, parse_address(config['peer']),
+            batch_size=config.get('batch_size', 256),
+            batch_window=config.get('batch_ms', 50) / 1000
+        )
+        self.receiver = ReplicationReceiver(db, parse_address(config.get('listen', 8067)))
+        self._started_at = time.monotonic()
+        db.add_change_listener(self.sender.on_lease_change)
+
+    def peer_alive(self):
+        # Al arrancar se concede un margen para que el par llegue a conectar
+        last_seen = self.receiver.last_seen or self._started_at
+        return time.monotonic() - last_seen < self.takeover_seconds
+
+    def should_serve(self):
+        return self.mode == 'split' or self.role == 'primary' or not self.peer_alive()
+
+    def allocation_range(self, pool_start, pool_end):
+        if self.mode != 'split' or not self.peer_alive():
+            return pool_start, pool_end
+        middle = (pool_start + pool_end) // 2
+        return (pool_start, middle) if self.role == 'primary' else (middle + 1, pool_end)
+
+    def start(self):
+        self.receiver.start()
+        self.sender.start()
+
+    def stop(self):
+        self.sender.stop()
+        self.receiver.stop()
@@ -0,0 +1,289 @@
+# src/reservations.py
+import os
+import sqlite3
+import threading
+import time
+
+from src.net_utils import ip_to_int, mac_to_int
+
+SET = 1
+DELETE = 2
+
+
+class ReservationStore:
+    """
+    Reservas estáticas MAC -> IP en SQLite, pensadas para decenas de miles
+    de entradas que no caben cómodamente en config.json.
+
+    Cada escritura se registra además en 'reservation_changes', un registro
+    de cambios con número de secuencia creciente. El servidor lo consulta
+    periódicamente (ver ReservationMap) para aplicar los cambios hechos con
+    manager.py sin reiniciar. Los cambios de más de un día se purgan.
+    """
+
+    CHANGE_RETENTION_SECONDS = 86400
+
+    def __init__(self, db_path='data/dhcp_leases.db'):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS reservations (
+                    mac INTEGER PRIMARY KEY,
+                    ip_int INTEGER NOT NULL UNIQUE,
+                    hostname TEXT
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS reservation_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op INTEGER NOT NULL,
+                    mac INTEGER NOT NULL,
+                    ip_int INTEGER,
+                    changed_at INTEGER NOT NULL
+                )
+            ''')
+            self.conn.commit()
+
+    def upsert(self, rows):
+        """
+        Crea o actualiza reservas (mac, ip, hostname) en una sola transacción.
+        Lanza ValueError, sin aplicar nada, si una IP ya está reservada para
+        otra MAC.
+        """
+        rows = list(rows)
+        now = int(time.time())
+        with self.lock:
+            try:
+                self.conn.executemany(
+                    "INSERT INTO reservations (mac, ip_int, hostname) VALUES (?, ?, ?) "
+                    "ON CONFLICT(mac) DO UPDATE SET ip_int = excluded.ip_int, hostname = excluded.hostname",
+                    rows
+                )
+                self.conn.executemany(
+                    "INSERT INTO reservation_changes (op, mac, ip_int, changed_at) VALUES (?, ?, ?, ?)",
+                    [(SET, mac, ip, now) for mac, ip, _ in rows]
+                )
+                self._prune_changes(now)
+                self.conn.commit()
+            except sqlite3.IntegrityError as e:
+                self.conn.rollback()
+                raise ValueError(f"IP reservada para más de una MAC: {e}")
+        return len(rows)
+
+    def remove(self, mac):
+        """Borra la reserva de 'mac'. Devuelve False si no existía."""
+        now = int(time.time())
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM reservations WHERE mac = ?", (mac,))
+            if not cursor.rowcount:
+                # El DELETE abrió una transacción aunque no borrase nada
+                self.conn.rollback()
+                return False
+            self.conn.execute(
+                "INSERT INTO reservation_changes (op, mac, ip_int, changed_at) VALUES (?, ?, NULL, ?)",
+                (DELETE, mac, now)
+            )
+            self._prune_changes(now)
+            self.conn.commit()
+        return True
+
+    def _prune_changes(self, now):
+        self.conn.execute("DELETE FROM reservation_changes WHERE changed_at < ?", (now - self.CHANGE_RETENTION_SECONDS,))
+
+    def all(self):
+        """Todas las reservas (mac, ip, hostname) y la secuencia del último cambio incluido."""
+        with self.lock:
+            # Ambas consultas en la misma transacción de lectura: la secuencia corresponde a las filas
+            self.conn.execute("BEGIN")
+            try:
+                rows = self.conn.execute("SELECT mac, ip_int, hostname FROM reservations ORDER BY ip_int").fetchall()
+                seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM reservation_changes").fetchone()[0]
+            finally:
+                self.conn.commit()
+        return rows, seq
+
+    def changes_since(self, seq):
+        """
+        Cambios (seq, op, mac, ip) posteriores a 'seq', o None si parte de
+        ellos ya se purgó y hay que recargar todas las reservas.
+        """
+        with self.lock:
+            oldest = self.conn.execute("SELECT MIN(seq) FROM reservation_changes").fetchone()[0]
+            if oldest is not None and oldest > seq + 1:
+                return None
+            return self.conn.execute(
+                "SELECT seq, op, mac, ip_int FROM reservation_changes WHERE seq > ? ORDER BY seq", (seq,)
+            ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class ReservationMap:
+    """
+    Índice en memoria de las reservas: diccionarios MAC -> IP ('by_mac') e
+    IP -> MAC ('by_ip'), así que tanto buscar la reserva de un cliente como
+    excluir IPs reservadas al asignar cuesta O(1).
+
+    Combina las reservas de config.json ('static', se recargan con SIGHUP)
+    con las de un ReservationStore opcional, que tienen prioridad: si una
+    reserva del almacén usa la IP de una de config.json, esta queda anulada
+    mientras dure la del almacén. Un hilo
+    en segundo plano aplica cada 'refresh_interval' segundos los cambios
+    nuevos del registro de cambios del almacén, fila a fila: el coste
+    depende de cuántas reservas cambian, no de cuántas hay.
+    """
+
+    def __init__(self, store=None, refresh_interval=5):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.static = {}
+        self.stored = {}
+        # IP -> MAC de 'static' y 'stored', para resolver qué reserva tiene cada IP sin recorrerlas
+        self.static_by_ip = {}
+        self.stored_by_ip = {}
+        self.by_mac = {}
+        self.by_ip = {}
+        self.last_seq = 0
+        self.change_listeners = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add_change_listener(self, callback):
+        """callback(mac) se llama cuando cambia la reserva de una MAC."""
+        self.change_listeners.append(callback)
+
+    def get(self, mac, default=None):
+        return self.by_mac.get(mac, default)
+
+    def __contains__(self, mac):
+        return mac in self.by_mac
+
+    def __len__(self):
+        return len(self.by_mac)
+
+    def set_static(self, reservations_cfg):
+        """Reservas de la configuración, {mac_texto: ip_texto}."""
+        static = {mac_to_int(mac): ip_to_int(ip) for mac, ip in reservations_cfg.items()}
+        with self._lock:
+            self.static = static
+            self.static_by_ip = {ip: mac for mac, ip in static.items()}
+            self._rebuild()
+
+    def load(self):
+        """Carga completa del almacén; se usa al arrancar y si faltan cambios purgados."""
+        if not self.store:
+            return 0
+        rows, seq = self.store.all()
+        with self._lock:
+            self.stored = {mac: ip for mac, ip, _ in rows}
+            self.stored_by_ip = {ip: mac for mac, ip in self.stored.items()}
+            self.last_seq = seq
+            self._rebuild()
+        return len(rows)
+
+    def _rebuild(self):
+        # Diccionarios nuevos y sustitución de golpe: los lectores nunca ven uno a medias
+        by_mac = {
+            mac: ip for mac, ip in self.static.items() if mac not in self.stored and ip not in self.stored_by_ip
+        }
+        by_mac.update(self.stored)
+        by_ip = {ip: mac for mac, ip in by_mac.items()}
+        changed = set(self.by_mac.items()) ^ set(by_mac.items())
+        self.by_mac, self.by_ip = by_mac, by_ip
+        self._notify({mac for mac, _ in changed})
+
+    def refresh(self):
+        """Aplica los cambios del almacén posteriores a la última carga. Devuelve cuántos."""
+        if not self.store:
+            return 0
+        changes = self.store.changes_since(self.last_seq)
+        if changes is None:
+            return self.load()
+        if not changes:
+            return 0
+        with self._lock:
+            # Solo se aplican las filas cambiadas, sobre copias de los índices que
+            # se sustituyen de golpe al terminar: los lectores nunca ven uno a medias
+            by_mac, by_ip = dict(self.by_mac), dict(self.by_ip)
+            touched = set()
+            for seq, op, mac, ip in changes:
+                self._apply(mac, ip if op == SET else None, by_mac, by_ip, touched)
+                self.last_seq = seq
+            previous = self.by_mac
+            self.by_mac, self.by_ip = by_mac, by_ip
+            self._notify({mac for mac in touched if previous.get(mac) != by_mac.get(mac)})
+        return len(changes)
+
+    def _unindex(self, mac, by_mac, by_ip):
+        ip = by_mac.pop(mac, None)
+        if ip is not None and by_ip.get(ip) == mac:
+            del by_ip[ip]
+
+    def _apply(self, mac, ip, by_mac, by_ip, touched):
+        """
+        Aplica a 'stored' y a los índices dados la reserva de 'mac' en el
+        almacén ('ip', o None si se borró), anulando o recuperando las reservas
+        de config.json afectadas. Anota en 'touched' las MACs que revisar.
+        """
+        candidates = set()
+        old_ip = self.stored.pop(mac, None)
+        if old_ip is not None:
+            del self.stored_by_ip[old_ip]
+            self._unindex(mac, by_mac, by_ip)
+            touched.add(mac)
+            # La IP liberada puede devolver su reserva a una MAC de config.json
+            candidates.add(self.static_by_ip.get(old_ip))
+        if ip is not None:
+            holder = self.stored_by_ip.get(ip)
+            if holder is not None:
+                del self.stored[holder]
+                self._unindex(holder, by_mac, by_ip)
+                touched.add(holder)
+                candidates.add(holder)
+            self.stored[mac] = ip
+            self.stored_by_ip[ip] = mac
+            # La reserva del almacén anula la de config.json de la misma MAC o de la misma IP
+            self._unindex(mac, by_mac, by_ip)
+            shadowed = by_ip.get(ip)
+            if shadowed is not None:
+                self._unindex(shadowed, by_mac, by_ip)
+                touched.add(shadowed)
+            by_mac[mac] = ip
+            by_ip[ip] = mac
+            touched.add(mac)
+        candidates.add(mac)
+        for static_mac in candidates:
+            static_ip = self.static.get(static_mac)
+            if static_ip is None or static_mac in self.stored or static_ip in self.stored_by_ip:
+                continue
+            by_mac[static_mac] = static_ip
+            by_ip[static_ip] = static_mac
+            touched.add(static_mac)
+
+    def _notify(self, macs):
+        for mac in macs:
+            for callback in self.change_listeners:
+                callback(mac)
+
+    def _run(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except sqlite3.Error as e:
+                print(f"[RESERVAS] No se pudieron leer los cambios de reservas: {e}")
+
+    def start(self):
+        if not self.store:
+            return
+        self._thread = threading.Thread(target=self._run, name="reservation-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
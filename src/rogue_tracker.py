@@ -0,0 +1,103 @@
+# src/rogue_tracker.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class RogueServerTracker:
+    """
+    Agrega el tráfico de servidores DHCP no autorizados por (MAC, IP) en
+    memoria, en lugar de registrar cada paquete. Un hilo en segundo plano
+    vuelca periódicamente los contadores a la tabla 'rogue_servers'.
+
+    observe() solo toca un diccionario: devuelve cuántos paquetes se han
+    visto desde el último aviso cuando toca avisar (servidor nuevo o pasado
+    'alert_interval' desde el último aviso de ese servidor) y 0 en otro caso.
+
+    Como en TokenBucketLimiter, las tablas se recorren en orden de último
+    uso y, por encima de 'max_tracked_keys' claves, se olvidan las menos
+    recientes: un atacante que falsifica MACs o IPs no hace crecer la
+    memoria sin límite.
+    """
+
+    def __init__(self, db, alert_interval=60, flush_interval=30, max_tracked_keys=1000):
+        self.db = db
+        self.alert_interval = alert_interval
+        self.flush_interval = flush_interval
+        self.max_tracked_keys = max_tracked_keys
+        # (mac, ip) -> [paquetes_totales, first_seen, last_seen, último_aviso, paquetes_sin_avisar]
+        self.servers = OrderedDict()
+        # (mac, ip) -> [first_seen, last_seen, paquetes] pendientes de volcar
+        self.pending = OrderedDict()
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def observe(self, mac, ip, now=None):
+        now = time.time() if now is None else now
+        key = (mac, ip)
+        with self._lock:
+            server = self.servers.get(key)
+            if server is None:
+                server = self.servers[key] = [0, now, now, None, 0]
+                self._evict(self.servers)
+            else:
+                self.servers.move_to_end(key)
+            server[0] += 1
+            server[2] = now
+            server[4] += 1
+
+            sighting = self.pending.get(key)
+            if sighting is None:
+                self.pending[key] = [now, now, 1]
+                self._evict(self.pending)
+            else:
+                self.pending.move_to_end(key)
+                sighting[1] = now
+                sighting[2] += 1
+
+            if server[3] is not None and now - server[3] < self.alert_interval:
+                return 0
+            server[3] = now
+            packets, server[4] = server[4], 0
+            return packets
+
+    def _evict(self, table):
+        while len(table) > self.max_tracked_keys:
+            table.popitem(last=False)
+            self.evicted += 1
+
+    def snapshot(self):
+        """Devuelve los servidores vistos en esta ejecución, más activos primero."""
+        with self._lock:
+            rows = [
+                {'mac': mac, 'ip': ip, 'packets': server[0], 'first_seen': server[1], 'last_seen': server[2]}
+                for (mac, ip), server in self.servers.items()
+            ]
+        return sorted(rows, key=lambda row: row['packets'], reverse=True)
+
+    def flush(self):
+        """Vuelca a la base de datos lo observado desde el último volcado."""
+        with self._lock:
+            pending, self.pending = self.pending, OrderedDict()
+        if pending:
+            self.db.save_rogue_servers([
+                (mac, ip, int(first_seen), int(last_seen), packets)
+                for (mac, ip), (first_seen, last_seen, packets) in pending.items()
+            ])
+        return len(pending)
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rogue-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
@@ -1,10 +1,17 @@
 # src/server.py
 import json
 import argparse
+import signal
 import threading
-from scapy.all import sniff, sendp, conf, Ether, BOOTP, DHCP
-from src.database import LeaseDatabase
+from scapy.all import sniff, conf, Ether, BOOTP, DHCP
 from src.dhcp_handler import DHCPHandler
+from src.offer_cache import PreparedPacket
+from src.profiler import SamplingProfiler, read_request, remove_pid_file, write_pid_file
+from src.history_archive import HistoryArchiver
+from src.lease_store import open_lease_store
+from src.replication import FailoverPeer
+from src.tracing import NULL_TRACER, Tracer
+from src.transmitter import PacketTransmitter
 
 # Mapa para traducir el tipo de mensaje DHCP a un string legible
 MSG_TYPE_MAP = {
@@ -37,24 +44,102 @@ def main():
 
     lock = threading.RLock()
     
-    db = LeaseDatabase(lock=lock)
-    handler = DHCPHandler(config, db, log_mode, lock=lock)
+    db = open_lease_store(config, lock)
+
+    renew_cfg = config.get('renew_coalescing', {})
+    if renew_cfg.get('enabled', False):
+        db.configure_renewal_coalescing(
+            renew_cfg.get('threshold_seconds', 600),
+            flush_interval=renew_cfg.get('flush_interval_seconds', 5),
+            history=renew_cfg.get('history', 'summary')
+        )
+        db.start_renewal_flusher()
+
+    failover = None
+    failover_cfg = config.get('failover', {})
+    if failover_cfg.get('enabled', False):
+        failover = FailoverPeer(db, failover_cfg)
+        failover.start()
+        print(f"Failover activo: modo '{failover.mode}', rol '{failover.role}', par en {failover_cfg['peer']}.")
+
+    trace_cfg = config.get('tracing', {})
+    tracer = NULL_TRACER
+    if trace_cfg.get('enabled', False):
+        tracer = Tracer(
+            trace_cfg.get('path', 'data/trace.json'),
+            sample_rate=trace_cfg.get('sample_rate', 1.0),
+            flush_interval=trace_cfg.get('flush_interval_seconds', 2),
+            max_buffered=trace_cfg.get('max_buffered_events', 100000)
+        )
+        tracer.start()
+        print(f"Trazado activo: spans por conversación en '{tracer.path}' (formato Chrome trace).")
+
+    handler = DHCPHandler(config, db, log_mode, lock=lock, failover=failover, tracer=tracer)
+    # Cambios hechos con manager.py (liberar un rango, importar concesiones...), una
+    # vez registrados los listeners del handler: caché de ofertas, instantánea y DDNS
+    db.start_external_watcher(config.get('lease_store', {}).get('external_changes_interval_seconds', 5))
+    handler.rogue_tracker.start()
+    if handler.reservations.store:
+        handler.reservations.start()
+        print(f"Reservas cargadas: {len(handler.reservations)} (cambios aplicados cada {handler.reservations.refresh_interval} s).")
+    if handler.snapshotter:
+        handler.snapshotter.start()
+    if handler.ddns:
+        handler.ddns.start()
+        print(f"DDNS activo: registros A/PTR en {handler.ddns.server[0]}:{handler.ddns.server[1]} "
+              f"(zonas '{handler.ddns.forward_zone}' y '{handler.ddns.reverse_zone}').")
+
+    archiver = None
+    archive_cfg = config.get('history_archive', {})
+    if archive_cfg.get('enabled', False):
+        archiver = HistoryArchiver(
+            db.db_path,
+            archive_dir=archive_cfg.get('archive_dir', 'data/archive'),
+            retention_days=archive_cfg.get('retention_days', 30),
+            interval_seconds=archive_cfg.get('interval_seconds', 3600),
+            batch_size=archive_cfg.get('batch_size', 5000)
+        )
+        archiver.start()
+        print(f"Archivado del histórico activo: retención de {archiver.retention_seconds // 86400} días.")
+
+    transmit_cfg = config.get('transmit', {})
+    transmitter = PacketTransmitter(
+        config['interface'],
+        batch_size=transmit_cfg.get('batch_size', 64),
+        max_queue=transmit_cfg.get('max_queue', 10000),
+        tracer=tracer
+    )
+    transmitter.start()
+
+    def send_response(response, trace=None):
+        # Se serializa aquí y se encola; el socket de envío es único y persistente
+        transmitter.send(response, trace)
+        if log_mode == 'profesional':
+            # --- MEJORA EN EL LOGGING PROFESIONAL ---
+            if isinstance(response, PreparedPacket):
+                client_mac, yiaddr, msg_type_code = response.client_mac, response.yiaddr, response.msg_type
+            else:
+                client_mac = response[Ether].dst
+                yiaddr = response[BOOTP].yiaddr
+                # El primer elemento de las opciones es siempre el message-type
+                msg_type_code = response[DHCP].options[0][1]
+            msg_type_str = MSG_TYPE_MAP.get(msg_type_code, f'UNKNOWN({msg_type_code})')
+            
+            print(f"[{msg_type_str}] Sent IP {yiaddr} to MAC {client_mac}")
+            # --- FIN DE LA MEJORA ---
+
+    # Ofertas que esperaban al sondeo de conflictos de IP
+    handler.deferred_send = send_response
 
     def packet_handler_thread(pkt):
         try:
+            # En modo activo/pasivo el secundario solo escucha mientras el primario responda
+            if failover and not failover.should_serve():
+                return
             response = handler.handle_packet(pkt)
             if response:
-                sendp(response, iface=config['interface'], verbose=0)
-                if log_mode == 'profesional':
-                    # --- MEJORA EN EL LOGGING PROFESIONAL ---
-                    client_mac = response[Ether].dst
-                    yiaddr = response[BOOTP].yiaddr
-                    # El primer elemento de las opciones es siempre el message-type
-                    msg_type_code = response[DHCP].options[0][1]
-                    msg_type_str = MSG_TYPE_MAP.get(msg_type_code, f'UNKNOWN({msg_type_code})')
-                    
-                    print(f"[{msg_type_str}] Sent IP {yiaddr} to MAC {client_mac}")
-                    # --- FIN DE LA MEJORA ---
+                # El contexto de traza del paquete sigue en este hilo: el envío se suma a su conversación
+                send_response(response, tracer.current())
         except Exception as e:
             print(f"\n--- [ERROR CRÍTICO EN UN HILO] ---")
             print(f"El procesamiento del paquete falló con una excepción no controlada.")
@@ -62,6 +147,34 @@ def main():
             print(f"Paquete problemático: {pkt.summary()}")
             print(f"---------------------------------\n")
 
+    def reload_config(signum, frame):
+        try:
+            handler.apply_config(load_config())
+            print("[CONFIG] Configuración recargada; caché de ofertas vaciada.")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[CONFIG] No se pudo recargar la configuración: {e}")
+
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload_config)
+
+    profile_cfg = config.get('profiling', {})
+    profiler = SamplingProfiler(
+        profile_cfg.get('output_dir', 'data/profiles'),
+        interval=profile_cfg.get('interval_ms', 5) / 1000,
+        default_duration=profile_cfg.get('default_duration_seconds', 30)
+    )
+
+    def start_profiling(signum, frame):
+        # manager.py --profile deja la duración pedida en un fichero antes de enviar la señal
+        if not profiler.start(read_request(profiler.request_path)):
+            print("[PERFIL] Ya hay una sesión de perfilado en curso.")
+
+    pid_file = None
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, start_profiling)
+        pid_file = profile_cfg.get('pid_file', 'data/dhcp_server.pid')
+        write_pid_file(pid_file)
+
     def process_packet_threaded(pkt):
         thread = threading.Thread(target=packet_handler_thread, args=(pkt,))
         thread.start()
@@ -72,7 +185,36 @@ def main():
     print("Servidor listo. Escuchando peticiones DHCP...")
     print("-" * 70)
     
-    sniff(filter=dhcp_filter, prn=process_packet_threaded, iface=config['interface'], store=0)
+    try:
+        sniff(filter=dhcp_filter, prn=process_packet_threaded, iface=config['interface'], store=0)
+    finally:
+        # La limpieza se hace también si sniff termina con una excepción
+        # Un PID que sobrevive al servidor podría acabar siendo el de otro proceso
+        if pid_file:
+            remove_pid_file(pid_file)
+        if archiver:
+            archiver.stop()
+        # Al salir se persisten las renovaciones que aún estaban solo en memoria
+        db.stop_renewal_flusher()
+        db.stop_external_watcher()
+        if handler.conflict_detector:
+            handler.conflict_detector.shutdown()
+            print(f"[SONDEO] {handler.conflict_detector.stats}")
+        handler.rogue_tracker.stop()
+        handler.reservations.stop()
+        if handler.mac_limiter:
+            print(f"[LÍMITE] por MAC {handler.mac_limiter.stats()}, por relay {handler.relay_limiter.stats()}")
+        if handler.snapshotter:
+            handler.snapshotter.stop()
+        if handler.ddns:
+            handler.ddns.stop()
+            print(f"[DDNS] {handler.ddns.stats}")
+        if failover:
+            failover.stop()
+            print(f"[FAILOVER] enviado {failover.sender.stats}, recibido {failover.receiver.stats}")
+        transmitter.stop()
+        tracer.stop()
+        print(f"[ENVÍO] {transmitter.summary()}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,324 @@
+# src/simulation.py
+import argparse
+import heapq
+import json
+import random
+import threading
+import time
+from ipaddress import IPv4Network
+
+from scapy.all import BOOTP, DHCP, IP, UDP, Ether, conf
+
+from src.clock import VirtualClock
+from src.dhcp_handler import DHCPHandler, DHCPMessageType
+from src.lease_policy import LeasePolicy
+from src.lease_store import open_lease_store
+from src.net_utils import int_to_ip, int_to_mac, ip_to_int
+
+# Tipos de evento de la simulación
+JOIN, RENEW, LEAVE, FLUSH = range(4)
+
+# Prefijo de las MAC simuladas (administradas localmente)
+MAC_BASE = 0x020000000000
+
+
+class HandlerDriver:
+    """
+    Lleva el ciclo de vida de cada cliente por el DHCPHandler real, con
+    paquetes scapy: DISCOVER/REQUEST, REQUEST de renovación y RELEASE.
+    Ejercita el protocolo completo, a costa de unos cientos de microsegundos
+    por paquete.
+    """
+
+    def __init__(self, config, db, clock):
+        self.handler = DHCPHandler(config, db, 'profesional', lock=db.lock, clock=clock)
+        self.server_ip = config['server_ip']
+        # Una sola petición que se rellena en cada evento: construir el paquete
+        # con '/' en cada llamada costaría tanto como procesarlo.
+        self.request = (Ether(dst="ff:ff:ff:ff:ff:ff") / IP(dst="255.255.255.255") / UDP(sport=68, dport=67)
+                        / BOOTP() / DHCP())
+
+    def _packet(self, mac, xid, options, ciaddr='0.0.0.0'):
+        pkt = self.request
+        pkt[Ether].src = int_to_mac(mac)
+        pkt[IP].src = ciaddr
+        pkt[BOOTP].chaddr = mac.to_bytes(6, 'big')
+        pkt[BOOTP].xid = xid
+        pkt[BOOTP].ciaddr = ciaddr
+        pkt[DHCP].options = options + ["end"]
+        return pkt
+
+    @staticmethod
+    def _renewal_time(response):
+        if response is None or response[DHCP].options[0][1] != DHCPMessageType.ACK:
+            return None
+        return next(opt[1] for opt in response[DHCP].options if opt[0] == 'renewal_time')
+
+    def join(self, mac, xid):
+        offer = self.handler.handle_packet(self._packet(mac, xid, [("message-type", DHCPMessageType.DISCOVER)]))
+        if offer is None:
+            return None
+        ip_text = offer.yiaddr if isinstance(offer, bytes) else offer[BOOTP].yiaddr
+        ack = self.handler.handle_packet(self._packet(mac, xid, [
+            ("message-type", DHCPMessageType.REQUEST), ("requested_addr", ip_text), ("server_id", self.server_ip)
+        ]))
+        t1 = self._renewal_time(ack)
+        return (ip_to_int(ip_text), t1) if t1 else None
+
+    def renew(self, mac, ip, xid):
+        return self._renewal_time(
+            self.handler.handle_packet(self._packet(mac, xid, [("message-type", DHCPMessageType.REQUEST)], ciaddr=int_to_ip(ip)))
+        )
+
+    def leave(self, mac, ip, xid):
+        self.handler.handle_packet(self._packet(mac, xid, [("message-type", DHCPMessageType.RELEASE)], ciaddr=int_to_ip(ip)))
+
+
+class StoreDriver:
+    """
+    Las mismas operaciones que hace el handler, llamadas directamente sobre
+    el almacén de concesiones (sin paquetes). Permite simular poblaciones
+    de cientos de miles de clientes y mide solo el coste del almacenamiento.
+    """
+
+    def __init__(self, config, db, clock):
+        self.db = db
+        self.lease_policy = LeasePolicy(config)
+        self.pool_start = ip_to_int(config['subnet']['pool_start'])
+        self.pool_end = ip_to_int(config['subnet']['pool_end'])
+        self.reserved_ips = {ip_to_int(ip) for ip in config.get('reservations', {}).values()}
+
+    def join(self, mac, xid):
+        lease = self.db.get_lease(mac)
+        ip = lease['ip'] if lease else self.db.find_available_ip(self.pool_start, self.pool_end, self.reserved_ips)
+        if ip is None:
+            return None
+        times = self.lease_policy.for_client(mac)
+        if not self.db.assign_lease(mac, ip, times.lease):
+            return None
+        self.db.add_history_log(mac, ip, 'ASSIGN')
+        return ip, times.t1
+
+    def renew(self, mac, ip, xid):
+        lease = self.db.get_lease(mac)
+        if not lease or lease['ip'] != ip:
+            return None
+        times = self.lease_policy.for_client(mac)
+        self.db.renew_lease(mac, ip, times.lease)
+        return times.t1
+
+    def leave(self, mac, ip, xid):
+        self.db.add_history_log(mac, ip, 'RELEASE')
+        self.db.release_lease(mac)
+
+
+DRIVERS = {'handler': HandlerDriver, 'store': StoreDriver}
+
+
+class LeaseSimulation:
+    """
+    Simulación de eventos discretos sobre un reloj virtual (ver src/clock.py).
+
+    Cada cliente se conecta (DORA), renueva en T1 mientras sigue conectado y
+    se desconecta tras una sesión de duración exponencial de media
+    'session_hours', liberando la IP con probabilidad 'release_probability'
+    o dejándola caducar. Vuelve tras una ausencia de media 'offline_hours'.
+
+    Los eventos se guardan en un heap por instante virtual; entre uno y otro
+    el reloj salta directamente, así que días simulados cuestan lo que
+    cuesta procesar sus eventos. Cada 'report_interval' segundos simulados
+    se anota el tamaño de la base de datos y el rendimiento real.
+    """
+
+    def __init__(self, config, clients=1000, days=1.0, driver='store', db_path=':memory:', seed=1,
+                 session_hours=8.0, offline_hours=4.0, release_probability=0.5,
+                 arrival_window=3600, report_interval=86400):
+        self.config = self._simulation_config(config)
+        self.clients = clients
+        self.duration = days * 86400
+        self.rng = random.Random(seed)
+        self.session = session_hours * 3600
+        self.offline = offline_hours * 3600
+        self.release_probability = release_probability
+        self.arrival_window = arrival_window
+        self.report_interval = report_interval
+
+        self.clock = VirtualClock()
+        self.start = self.clock.time()
+        self.db = open_lease_store(self.config, threading.RLock(), db_path, clock=self.clock)
+        renew_cfg = self.config.get('renew_coalescing', {})
+        self.flush_interval = 0
+        if renew_cfg.get('enabled', False):
+            self.flush_interval = renew_cfg.get('flush_interval_seconds', 5)
+            self.db.configure_renewal_coalescing(
+                renew_cfg.get('threshold_seconds', 600),
+                flush_interval=self.flush_interval,
+                history=renew_cfg.get('history', 'summary')
+            )
+        self.driver = DRIVERS[driver](self.config, self.db, self.clock)
+
+        self.events = []
+        self.sequence = 0
+        # Estado por cliente: IP actual (None si está desconectado) y generación,
+        # que invalida los eventos pendientes de una sesión anterior.
+        self.ips = [None] * clients
+        self.generations = [0] * clients
+        self.counters = dict.fromkeys(('events', 'joins', 'join_failures', 'renewals', 'renew_failures',
+                                       'releases', 'expiries'), 0)
+
+    @staticmethod
+    def _simulation_config(config):
+        config = json.loads(json.dumps(config))
+        config['interface'] = conf.loopback_name
+        # Sin efectos en la red ni en otros ficheros, y sin límites pensados para tráfico real
+        for section in ('rate_limit', 'conflict_detection', 'reservation_store', 'lease_snapshot', 'ddns', 'failover'):
+            config.setdefault(section, {})['enabled'] = False
+        config['lease_store'] = {'backend': 'sqlite'}
+        return config
+
+    def _schedule(self, at, kind, client=None):
+        self.sequence += 1
+        generation = self.generations[client] if client is not None else 0
+        heapq.heappush(self.events, (at, self.sequence, kind, client, generation))
+
+    def _handle(self, now, kind, client):
+        mac = MAC_BASE + client
+        xid = self.sequence & 0xFFFFFFFF
+        if kind == JOIN:
+            result = self.driver.join(mac, xid)
+            if result is None:
+                self.counters['join_failures'] += 1
+                self._schedule(now + self.rng.expovariate(1 / self.offline), JOIN, client)
+                return
+            self.counters['joins'] += 1
+            self.ips[client], t1 = result
+            self._schedule(now + t1, RENEW, client)
+            self._schedule(now + self.rng.expovariate(1 / self.session), LEAVE, client)
+        elif kind == RENEW:
+            t1 = self.driver.renew(mac, self.ips[client], xid)
+            if t1 is None:
+                self.counters['renew_failures'] += 1
+                return
+            self.counters['renewals'] += 1
+            self._schedule(now + t1, RENEW, client)
+        elif kind == LEAVE:
+            if self.rng.random() < self.release_probability:
+                self.driver.leave(mac, self.ips[client], xid)
+                self.counters['releases'] += 1
+            else:
+                self.counters['expiries'] += 1
+            self.ips[client] = None
+            self.generations[client] += 1
+            self._schedule(now + self.rng.expovariate(1 / self.offline), JOIN, client)
+
+    def _db_stats(self):
+        conn = self.db.conn
+        now = int(self.clock.time())
+        return {
+            'leases': conn.execute("SELECT COUNT(*) FROM leases").fetchone()[0],
+            'active': conn.execute("SELECT COUNT(*) FROM leases WHERE expires_at > ?", (now,)).fetchone()[0],
+            'history': conn.execute("SELECT COUNT(*) FROM leases_history").fetchone()[0],
+            'db_bytes': conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+        }
+
+    def run(self, on_report=None):
+        """Ejecuta la simulación completa. Devuelve la lista de informes por intervalo."""
+        for client in range(self.clients):
+            self._schedule(self.start + self.rng.uniform(0, self.arrival_window), JOIN, client)
+        if self.flush_interval:
+            self._schedule(self.start + self.flush_interval, FLUSH)
+
+        end = self.start + self.duration
+        next_report = self.start + self.report_interval
+        reports = []
+        real_started = last_real = time.perf_counter()
+        last_events = 0
+        while self.events and self.events[0][0] < end:
+            at, _, kind, client, generation = heapq.heappop(self.events)
+            while at >= next_report:
+                last_real, last_events = self._report(reports, next_report, last_real, last_events, on_report)
+                next_report += self.report_interval
+            self.clock.set(at)
+            if kind == FLUSH:
+                self.db.flush_renewals()
+                self._schedule(at + self.flush_interval, FLUSH)
+                continue
+            if generation != self.generations[client]:
+                continue  # Evento de una sesión ya terminada
+            self.counters['events'] += 1
+            self._handle(at, kind, client)
+
+        self.clock.set(end)
+        self.db.flush_renewals()
+        self._report(reports, end, last_real, last_events, on_report)
+        reports[-1]['real_total'] = time.perf_counter() - real_started
+        return reports
+
+    def _report(self, reports, at, last_real, last_events, on_report):
+        real_now = time.perf_counter()
+        elapsed = real_now - last_real
+        events = self.counters['events'] - last_events
+        report = {
+            'simulated_hours': (at - self.start) / 3600,
+            'online': sum(1 for ip in self.ips if ip is not None),
+            'events_per_second': events / elapsed if elapsed > 0 else 0.0,
+            'real_seconds': elapsed,
+            **self.counters,
+            **self._db_stats()
+        }
+        reports.append(report)
+        if on_report:
+            on_report(report)
+        return real_now, self.counters['events']
+
+
+def print_report(report):
+    print(f"[SIM] t={report['simulated_hours']:7.1f} h | conectados {report['online']:>7} | "
+          f"concesiones {report['leases']:>7} (activas {report['active']:>7}) | histórico {report['history']:>9} | "
+          f"BD {report['db_bytes'] / 1048576:8.1f} MB | {report['events_per_second']:>9,.0f} eventos/s "
+          f"({report['real_seconds']:.1f} s reales)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulación con reloj virtual del ciclo de vida de muchos clientes DHCP."
+    )
+    parser.add_argument('--clients', type=int, default=10000, help='Número de clientes simulados.')
+    parser.add_argument('--days', type=float, default=1.0, help='Días simulados.')
+    parser.add_argument('--driver', choices=sorted(DRIVERS), default='store',
+                        help="'store': operaciones sobre el almacén; 'handler': paquetes DHCP por el handler.")
+    parser.add_argument('--pool', type=IPv4Network,
+                        help='Red para el pool simulado (ej: 10.0.0.0/16); por defecto, la de config.json.')
+    parser.add_argument('--db', help='Fichero SQLite de la simulación (por defecto, en memoria: sin coste de escritura a disco).')
+    parser.add_argument('--seed', type=int, default=1, help='Semilla aleatoria, para repetir una simulación.')
+    parser.add_argument('--session-hours', type=float, default=8.0, help='Duración media de una sesión.')
+    parser.add_argument('--offline-hours', type=float, default=4.0, help='Duración media de una ausencia.')
+    parser.add_argument('--report-hours', type=float, default=24.0, help='Horas simuladas entre informes.')
+    args = parser.parse_args()
+
+    with open('config/config.json') as f:
+        config = json.load(f)
+    if args.pool:
+        hosts = list(args.pool.hosts())
+        config['subnet'].update({
+            'network': str(args.pool.network_address), 'mask': str(args.pool.netmask),
+            'gateway': str(hosts[0]), 'pool_start': str(hosts[1]), 'pool_end': str(hosts[-1])
+        })
+        config['server_ip'] = str(hosts[0])
+        config['reservations'] = {}
+
+    simulation = LeaseSimulation(
+        config, clients=args.clients, days=args.days, driver=args.driver, db_path=args.db or ':memory:', seed=args.seed,
+        session_hours=args.session_hours, offline_hours=args.offline_hours,
+        report_interval=args.report_hours * 3600
+    )
+    print(f"Simulando {args.clients} clientes durante {args.days:g} días (driver '{args.driver}')...")
+    reports = simulation.run(on_report=print_report)
+    final = reports[-1]
+    print(f"[SIM] {final['events']} eventos en {final['real_total']:.1f} s reales: "
+          f"{final['joins']} conexiones ({final['join_failures']} sin IP), {final['renewals']} renovaciones "
+          f"({final['renew_failures']} rechazadas), {final['releases']} liberaciones, {final['expiries']} caducidades.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# src/tracing.py
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import nullcontext
+
+_NO_SPAN = nullcontext()
+
+
+def _now_us():
+    return time.perf_counter_ns() // 1000
+
+
+class TraceContext:
+    """Spans de una petición: se acumulan aquí y se emiten juntos al terminar."""
+
+    __slots__ = ('started', 'spans', 'args', 'tid')
+
+    def __init__(self):
+        self.started = _now_us()
+        self.spans = []
+        self.args = {}
+        self.tid = None
+
+
+class _Span:
+    __slots__ = ('context', 'name', 'started')
+
+    def __init__(self, context, name):
+        self.context = context
+        self.name = name
+
+    def __enter__(self):
+        self.started = _now_us()
+        return self
+
+    def __exit__(self, *exc):
+        self.context.spans.append((self.name, self.started, _now_us() - self.started))
+        return False
+
+
+class NullTracer:
+    """Trazado desactivado: todas las operaciones son no-ops de coste mínimo."""
+
+    enabled = False
+
+    def begin(self):
+        return None
+
+    def span(self, name):
+        return _NO_SPAN
+
+    def tag(self, **args):
+        pass
+
+    def end(self):
+        pass
+
+    def current(self):
+        return None
+
+    def record(self, context, name, started, duration, **args):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class Tracer(NullTracer):
+    """
+    Trazas por conversación DHCP en el formato de eventos de Chrome
+    (chrome://tracing, Perfetto): un evento "X" por span con su inicio y
+    duración en microsegundos.
+
+    Cada paquete abre un contexto en su hilo (begin); los spans del handler,
+    de cada llamada al almacén de concesiones (ver TracedStore) y de la
+    construcción de la respuesta se acumulan en él y se emiten al terminar
+    (end) bajo el 'tid' de su conversación (ver tag): el visor muestra una
+    fila por conversación con el DORA completo. El envío, que ocurre en el
+    hilo del transmisor, se añade después con record().
+
+    Los eventos se escriben en 'path' por bloques desde un hilo en segundo
+    plano, en formato de array JSON sin cerrar (admitido por los visores).
+    Con 'sample_rate' < 1 solo se traza esa fracción de los paquetes.
+    """
+
+    enabled = True
+    MAX_CONVERSATIONS = 10000
+
+    def __init__(self, path='data/trace.json', sample_rate=1.0, flush_interval=2, max_buffered=100000):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.pid = os.getpid()
+        self.buffer = []
+        self.dropped = 0
+        self.tids = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def begin(self):
+        """Abre el contexto de traza del paquete que se empieza a procesar en este hilo."""
+        context = TraceContext() if self.sample_rate >= 1 or random.random() < self.sample_rate else None
+        self._local.context = context
+        return context
+
+    def current(self):
+        return getattr(self._local, 'context', None)
+
+    def span(self, name):
+        context = self.current()
+        return _Span(context, name) if context else _NO_SPAN
+
+    def _tid(self, convo_id):
+        tid = self.tids.get(convo_id)
+        if tid is None:
+            if len(self.tids) >= self.MAX_CONVERSATIONS:
+                self.tids.clear()
+            tid = self.tids[convo_id] = len(self.tids) + 1
+            # Nombre de la fila en el visor
+            self._emit({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': convo_id}})
+        return tid
+
+    def tag(self, **args):
+        """Anota el paquete en curso; 'conversation' decide la fila del visor."""
+        context = self.current()
+        if context is not None:
+            context.args.update(args)
+
+    def end(self):
+        """Cierra el paquete: emite sus spans y el span raíz 'handle_packet'."""
+        context = self.current()
+        if context is None:
+            return
+        finished = _now_us()
+        with self._lock:
+            context.tid = self._tid(context.args.get('conversation', 'sin conversación'))
+            self._emit({'name': 'handle_packet', 'cat': 'dhcp', 'ph': 'X', 'ts': context.started,
+                        'dur': finished - context.started, 'pid': self.pid, 'tid': context.tid,
+                        'args': context.args})
+            for name, started, duration in context.spans:
+                self._emit({'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'ts': started, 'dur': duration,
+                            'pid': self.pid, 'tid': context.tid})
+        context.spans = []
+
+    def record(self, context, name, started, duration, **args):
+        """Añade un span medido fuera del hilo del paquete (p. ej. el envío en el transmisor)."""
+        if context is None or context.tid is None:
+            return
+        with self._lock:
+            event = {'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'ts': started, 'dur': duration,
+                     'pid': self.pid, 'tid': context.tid}
+            if args:
+                event['args'] = args
+            self._emit(event)
+
+    def _emit(self, event):
+        if len(self.buffer) >= self.max_buffered:
+            self.dropped += 1
+            return
+        self.buffer.append(event)
+
+    def flush(self):
+        """Añade al fichero los eventos pendientes. Devuelve cuántos."""
+        with self._lock:
+            events, self.buffer = self.buffer, []
+        if events:
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps(event, ensure_ascii=False) + ',\n' for event in events))
+        return len(events)
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'w') as f:
+            f.write('[\n')
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self.flush()
+
+
+NULL_TRACER = NullTracer()
+
+
+def traced(name):
+    """Decorador de métodos de objetos con atributo 'tracer': mide cada llamada como un span."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.span(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedStore:
+    """
+    Envuelve un almacén de concesiones y registra un span 'db.<método>' por
+    cada llamada hecha dentro de un contexto de traza.
+    """
+
+    def __init__(self, store, tracer):
+        self._store = store
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        attr = getattr(self._store, name)
+        if not callable(attr):
+            return attr
+        span_name = f"db.{name}"
+        tracer = self._tracer
+
+        def call(*args, **kwargs):
+            with tracer.span(span_name):
+                return attr(*args, **kwargs)
+
+        # Se guarda en la instancia: las siguientes llamadas no pasan por __getattr__
+        setattr(self, name, call)
+        return call
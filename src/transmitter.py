@@ -0,0 +1,112 @@
+# src/transmitter.py
+import queue
+import threading
+import time
+
+from scapy.all import conf
+
+from src.tracing import NULL_TRACER
+
+
+class PacketTransmitter:
+    """
+    Envía las respuestas por un único socket de capa 2 abierto al arrancar,
+    en lugar de abrir y cerrar uno por paquete como hace sendp().
+
+    Los hilos del handler solo serializan la respuesta y la encolan; un hilo
+    de envío vacía la cola por ráfagas de hasta 'batch_size' tramas y las
+    escribe seguidas en el socket. Python no expone sendmmsg(), así que cada
+    trama sigue siendo una llamada send(), pero sin coste de preparación.
+    """
+
+    def __init__(self, iface, batch_size=64, max_queue=10000, tracer=None):
+        self.iface = iface
+        self.tracer = tracer or NULL_TRACER
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.socket = None
+        self.stats = {
+            'queued': 0, 'sent': 0, 'dropped': 0, 'errors': 0, 'batches': 0,
+            'max_queue_depth': 0, 'latency_total': 0.0, 'latency_max': 0.0
+        }
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def send(self, packet, trace=None):
+        """
+        Encola una trama (paquete scapy o bytes). Devuelve False si la cola
+        está llena. 'trace' es el contexto de traza de la petición, al que se
+        añaden los spans de serialización, espera en cola y envío.
+        """
+        started = time.perf_counter_ns() // 1000 if trace else 0
+        frame = bytes(packet)
+        if trace:
+            self.tracer.record(trace, 'send.serialize', started, time.perf_counter_ns() // 1000 - started)
+        try:
+            self.queue.put_nowait((frame, time.perf_counter(), trace))
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+        self.stats['queued'] += 1
+        depth = self.queue.qsize()
+        if depth > self.stats['max_queue_depth']:
+            self.stats['max_queue_depth'] = depth
+        return True
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set() or not self.queue.empty():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            for frame, enqueued_at, trace in batch:
+                sending_at = time.perf_counter()
+                try:
+                    self.socket.send(frame)
+                except OSError:
+                    self.stats['errors'] += 1
+                    continue
+                sent_at = time.perf_counter()
+                latency = sent_at - enqueued_at
+                if trace:
+                    # Mismo reloj que los spans del handler (perf_counter), en microsegundos
+                    self.tracer.record(trace, 'send.queue', int(enqueued_at * 1e6), int((sending_at - enqueued_at) * 1e6))
+                    self.tracer.record(trace, 'send.socket', int(sending_at * 1e6), int((sent_at - sending_at) * 1e6),
+                                       bytes=len(frame))
+                self.stats['sent'] += 1
+                self.stats['latency_total'] += latency
+                if latency > self.stats['latency_max']:
+                    self.stats['latency_max'] = latency
+            self.stats['batches'] += 1
+
+    def summary(self):
+        """Resumen legible de los contadores de envío."""
+        stats = self.stats
+        average = stats['latency_total'] / stats['sent'] * 1000 if stats['sent'] else 0.0
+        per_batch = stats['sent'] / stats['batches'] if stats['batches'] else 0.0
+        return (f"{stats['sent']} tramas enviadas en {stats['batches']} ráfagas ({per_batch:.1f}/ráfaga), "
+                f"cola máx. {stats['max_queue_depth']}, latencia media {average:.3f} ms "
+                f"(máx. {stats['latency_max'] * 1000:.3f} ms), descartadas {stats['dropped']}, errores {stats['errors']}")
+
+    def start(self):
+        self.socket = conf.L2socket(iface=self.iface)
+        self._thread = threading.Thread(target=self._run, name="packet-transmitter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self.socket:
+            self.socket.close()
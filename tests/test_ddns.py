@@ -0,0 +1,43 @@
+# tests/test_ddns.py
+import unittest
+
+from src.ddns import TYPE_A, TYPE_PTR, DdnsUpdater, StubDnsServer
+from src.net_utils import ip_to_int
+
+ZONE = 'aula.local'
+REVERSE_ZONE = '1.168.192.in-addr.arpa'
+
+
+class DdnsUpdaterTest(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubDnsServer(('127.0.0.1', 0), zones=[ZONE, REVERSE_ZONE])
+        self.stub.start()
+        self.updater = DdnsUpdater(self.stub.address, ZONE, REVERSE_ZONE, batch_window=30, timeout=1)
+        self.updater.start()
+
+    def tearDown(self):
+        self.updater.stop()
+        self.stub.stop()
+
+    def test_rejected_client_is_dropped_from_batch(self):
+        self.updater.register(1, ip_to_int('192.168.1.10'), 'pc-1')
+        # Su PTR queda fuera de la zona inversa: el servidor responde NOTZONE
+        self.updater.register(2, ip_to_int('10.0.0.10'), 'pc-2')
+        self.updater.register(3, ip_to_int('192.168.1.12'), 'pc-3')
+
+        self.assertEqual(self.updater.flush(), 2)
+        self.assertEqual(self.updater.stats['rejected'], 1)
+        self.assertEqual(set(self.updater.published), {1, 3})
+        self.assertEqual(self.stub.records[('pc-3.' + ZONE, TYPE_A)], {'192.168.1.12'})
+        self.assertEqual(self.stub.records[('12.1.168.192.in-addr.arpa', TYPE_PTR)], {'pc-3.' + ZONE})
+        self.assertEqual(self.updater.flush(), 0)  # No se reintenta
+
+    def test_stop_sends_pending_updates(self):
+        self.updater.register(1, ip_to_int('192.168.1.10'), 'pc-1')
+        self.updater.stop()
+        self.assertEqual(self.stub.records[('pc-1.' + ZONE, TYPE_A)], {'192.168.1.10'})
+        self.assertEqual(self.updater.dirty, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
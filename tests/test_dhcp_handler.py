@@ -0,0 +1,174 @@
+# tests/test_dhcp_handler.py
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from scapy.all import Ether, IP, UDP, BOOTP, DHCP
+
+from src.conflict_probe import ConflictDetector, StubProber
+from src.database import LeaseDatabase
+from src.dhcp_handler import DHCPHandler
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'config', 'config.json')
+IFACE_MAC = '0a:0b:0c:0d:0e:0f'
+RELAY_MAC = '02:aa:00:00:00:01'
+CIRCUIT_ID = b'\x01\x08eth0/1/3'  # Subopción 1 (circuit-id) de la regla 'planta-1'
+PLANTA_RULE = {
+    'name': 'planta-1', 'circuit_id_prefix': 'eth0/1/',
+    'pool_start': '192.168.1.150', 'pool_end': '192.168.1.179'
+}
+
+
+def load_test_config():
+    """config.json sin las funciones que escriben fuera del directorio temporal ni tocan la red."""
+    with open(CONFIG_PATH) as f:
+        config = json.load(f)
+    config['interface'] = 'lo'
+    for section in ('rate_limit', 'conflict_detection', 'lease_snapshot', 'ddns', 'failover', 'tracing'):
+        config.setdefault(section, {})['enabled'] = False
+    return config
+
+
+def discover(mac, xid=1, giaddr='0.0.0.0', src_mac=None, sport=68, options=()):
+    """DHCPDISCOVER tal como llega del cable (re-diseccionado, con tipos de mensaje numéricos)."""
+    pkt = (
+        Ether(src=src_mac or mac, dst='ff:ff:ff:ff:ff:ff') /
+        IP(src='0.0.0.0' if sport == 68 else giaddr, dst='255.255.255.255') /
+        UDP(sport=sport, dport=67) /
+        BOOTP(chaddr=bytes.fromhex(mac.replace(':', '')), xid=xid, flags=0x8000, giaddr=giaddr) /
+        DHCP(options=[('message-type', 'discover'), *options, 'end'])
+    )
+    return Ether(bytes(pkt))
+
+
+class HandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config = load_test_config()
+        self.lock = threading.RLock()
+        self.db = LeaseDatabase(os.path.join(self.tmp_dir, 'leases.db'), lock=self.lock)
+        self.handler = self.make_handler()
+
+    def make_handler(self):
+        # Una MAC de interfaz distinta de cero, como la de cualquier NIC real (la de loopback es 0)
+        with mock.patch('src.dhcp_handler.get_if_hwaddr', return_value=IFACE_MAC):
+            return DHCPHandler(self.config, self.db, lock=self.lock)
+
+    def tearDown(self):
+        self.db.conn.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class ResponseSerializationTest(HandlerTestCase):
+    def test_offer_serializes_with_interface_mac(self):
+        response = self.handler.handle_packet(discover('02:00:00:00:00:01'))
+        frame = Ether(bytes(response))
+        self.assertEqual(frame[Ether].src, IFACE_MAC)
+        self.assertEqual(frame[BOOTP].op, 2)
+        self.assertEqual(frame[BOOTP].yiaddr, self.config['subnet']['pool_start'])
+
+
+class RelayedRequestTest(HandlerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config['relay_rules'] = [PLANTA_RULE]
+        self.handler.apply_config(self.config)
+
+    def relayed_discover(self, mac, xid=1):
+        return discover(mac, xid=xid, giaddr='192.168.10.1', src_mac=RELAY_MAC, sport=67,
+                        options=[('relay_agent_information', CIRCUIT_ID)])
+
+    def test_relayed_discover_is_answered_from_rule_pool(self):
+        response = self.handler.handle_packet(self.relayed_discover('02:00:00:00:00:02'))
+        self.assertIsNotNone(response)
+        frame = Ether(bytes(response))
+        self.assertEqual(frame[IP].dst, '192.168.10.1')
+        self.assertEqual(frame[BOOTP].yiaddr, '192.168.1.150')
+        options = {opt[0]: opt[1] for opt in frame[DHCP].options if isinstance(opt, tuple)}
+        self.assertEqual(options['relay_agent_information'], CIRCUIT_ID)
+        self.assertEqual(self.handler.rogue_tracker.servers, {})
+
+    def test_relayed_clients_are_keyed_on_chaddr(self):
+        first = Ether(bytes(self.handler.handle_packet(self.relayed_discover('02:00:00:00:00:02', xid=1))))
+        second = Ether(bytes(self.handler.handle_packet(self.relayed_discover('02:00:00:00:00:03', xid=2))))
+        self.assertEqual(first[BOOTP].yiaddr, '192.168.1.150')
+        self.assertEqual(second[BOOTP].yiaddr, '192.168.1.150')  # Ninguna concesión aún: misma candidata
+        self.assertEqual(set(self.handler.mac_map), {0x020000000002, 0x020000000003})
+
+    def test_main_pool_skips_rule_pools(self):
+        self.handler.pool_start = self.handler.relay_rules.pools[0][0]
+        response = self.handler.handle_packet(discover('02:00:00:00:00:04'))
+        self.assertEqual(Ether(bytes(response))[BOOTP].yiaddr, '192.168.1.180')
+
+    def test_server_reply_is_tracked_as_rogue(self):
+        reply = Ether(bytes(
+            Ether(src='02:bb:00:00:00:01', dst='ff:ff:ff:ff:ff:ff') /
+            IP(src='192.168.1.250', dst='255.255.255.255') /
+            UDP(sport=67, dport=68) /
+            BOOTP(op=2, chaddr=b'\x02\x00\x00\x00\x00\x05') /
+            DHCP(options=[('message-type', 'offer'), ('server_id', '192.168.1.250'), 'end'])
+        ))
+        self.assertIsNone(self.handler.handle_packet(reply))
+        self.assertEqual(len(self.handler.rogue_tracker.servers), 1)
+
+
+class RateLimitTest(HandlerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config['rate_limit']['enabled'] = True
+        self.handler = self.make_handler()
+        self.burst = self.config['rate_limit']['per_mac_burst']
+
+    def relayed(self, mac, xid):
+        return discover(mac, xid=xid, giaddr='192.168.10.1', src_mac=RELAY_MAC, sport=67)
+
+    def test_relayed_clients_have_their_own_bucket(self):
+        answered = [self.handler.handle_packet(self.relayed(f'02:00:00:00:01:{n:02x}', n)) for n in range(3 * self.burst)]
+        self.assertNotIn(None, answered)
+
+    def test_client_behind_relay_is_limited_by_chaddr(self):
+        answered = [self.handler.handle_packet(self.relayed('02:00:00:00:01:01', n)) for n in range(self.burst + 1)]
+        self.assertIsNone(answered[-1])
+        self.assertNotIn(None, answered[:-1])
+
+
+class DeferredOfferTest(HandlerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.prober = StubProber(delay=0.2)
+        self.handler.conflict_detector = ConflictDetector(self.prober)
+        self.sent = []
+        self.done = threading.Event()
+        self.handler.deferred_send = self.on_deferred
+
+    def tearDown(self):
+        self.handler.conflict_detector.shutdown()
+        super().tearDown()
+
+    def on_deferred(self, response):
+        self.sent.append(Ether(bytes(response)))
+        if len(self.sent) == 2:
+            self.done.set()
+
+    def test_retransmits_get_a_single_offer(self):
+        for _ in range(3):
+            self.assertIsNone(self.handler.handle_packet(discover('02:00:00:00:00:06', xid=7)))
+        self.done.wait(1)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.prober.probes, 1)
+
+    def test_pending_candidate_is_not_offered_to_another_client(self):
+        self.handler.handle_packet(discover('02:00:00:00:00:06', xid=7))
+        self.handler.handle_packet(discover('02:00:00:00:00:07', xid=8))
+        self.assertTrue(self.done.wait(2))
+        offered = {frame[BOOTP].xid: frame[BOOTP].yiaddr for frame in self.sent}
+        self.assertEqual(len(set(offered.values())), 2)
+        self.assertEqual(self.handler.conflict_detector.stats['probes'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
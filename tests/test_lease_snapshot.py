@@ -0,0 +1,69 @@
+# tests/test_lease_snapshot.py
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from src.database import LeaseDatabase
+from src.lease_snapshot import JOURNAL_HEADER, LeaseIndex, LeaseSnapshotter
+from src.net_utils import ip_to_int, mac_to_int
+
+MAC = mac_to_int('02:00:00:00:00:01')
+IP = ip_to_int('192.168.1.120')
+
+
+class LeaseSnapshotterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'leases.db')
+        self.db = LeaseDatabase(self.db_path, lock=threading.RLock())
+        self.snapshotter = self.start_server(self.db)
+
+    def tearDown(self):
+        self.db.conn.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def start_server(self, db):
+        snapshotter = LeaseSnapshotter(
+            LeaseIndex(), os.path.join(self.tmp_dir, 'leases.snap'), os.path.join(self.tmp_dir, 'leases.journal')
+        )
+        snapshotter.restore(db)
+        db.add_change_listener(snapshotter.on_lease_change)
+        return snapshotter
+
+    def restart(self):
+        self.snapshotter.stop()
+        self.db.conn.close()
+        self.db = LeaseDatabase(self.db_path, lock=threading.RLock())
+        self.snapshotter = self.start_server(self.db)
+
+    def test_restore_uses_snapshot_when_database_is_unchanged(self):
+        self.db.add_lease(MAC, IP, 3600)
+        self.restart()
+        self.assertEqual(self.snapshotter.index.by_mac[MAC][0], IP)
+
+    def test_restore_rebuilds_after_external_change_while_stopped(self):
+        self.db.add_lease(MAC, IP, 3600)
+        self.snapshotter.stop()
+        # manager.py libera la concesión con el servidor parado
+        manager_db = LeaseDatabase(self.db_path, lock=threading.RLock())
+        manager_db.release_lease(MAC)
+        manager_db.record_external_changes([(LeaseDatabase.LEASE_DELETE, MAC, IP, 0)])
+        manager_db.conn.close()
+        self.db.conn.close()
+        self.db = LeaseDatabase(self.db_path, lock=threading.RLock())
+        self.snapshotter = self.start_server(self.db)
+        self.assertNotIn(MAC, self.snapshotter.index.by_mac)
+
+    def test_renewals_are_not_journaled(self):
+        self.db.add_lease(MAC, IP, 3600)
+        self.db.renew_lease(MAC, IP, 7200)
+        self.snapshotter.flush_journal()
+        record_size = os.path.getsize(self.snapshotter.journal_path) - JOURNAL_HEADER.size
+        self.assertEqual(record_size, 25)  # Solo el alta: registro de 21 bytes más su CRC
+        self.assertEqual(self.snapshotter.index.by_mac[MAC][1], self.db.get_lease(MAC)['expires_at'])
+
+
+if __name__ == '__main__':
+    unittest.main()
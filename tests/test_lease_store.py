@@ -0,0 +1,61 @@
+# tests/test_lease_store.py
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from src.database import LeaseDatabase
+from src.lease_store import InMemoryKV, KVLeaseStore
+from src.net_utils import ip_to_int
+
+IP = ip_to_int('192.168.1.120')
+CLIENTS = 16
+
+
+class KVLeaseStoreConcurrencyTest(unittest.TestCase):
+    """Dos servidores sobre el mismo almacén clave-valor compiten por una IP."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        kv = InMemoryKV()
+        self.stores = [
+            KVLeaseStore(kv, LeaseDatabase(os.path.join(self.tmp_dir, f'audit-{n}.db'), lock=threading.RLock()))
+            for n in range(2)
+        ]
+
+    def tearDown(self):
+        for store in self.stores:
+            store.audit_db.conn.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_concurrent_assign_grants_ip_once(self):
+        barrier = threading.Barrier(CLIENTS)
+        results = {}
+
+        def assign(mac):
+            barrier.wait()
+            results[mac] = self.stores[mac % 2].assign_lease(mac, IP, 3600)
+
+        threads = [threading.Thread(target=assign, args=(mac,)) for mac in range(1, CLIENTS + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        winners = [mac for mac, assigned in results.items() if assigned]
+        self.assertEqual(len(winners), 1)
+        for store in self.stores:
+            self.assertEqual(store.get_lease_holder(IP), winners[0])
+            self.assertEqual([(mac, ip) for mac, ip, _ in store.get_all_leases()], [(winners[0], IP)])
+
+    def test_released_ip_can_be_assigned_again(self):
+        self.assertTrue(self.stores[0].assign_lease(1, IP, 3600))
+        self.assertFalse(self.stores[1].assign_lease(2, IP, 3600))
+        self.stores[0].release_lease(1)
+        self.assertTrue(self.stores[1].assign_lease(2, IP, 3600))
+        self.assertEqual(self.stores[0].get_lease_holder(IP), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
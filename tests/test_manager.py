@@ -0,0 +1,71 @@
+# tests/test_manager.py
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from src.database import LeaseDatabase
+from src.manager import DHCPManager
+from src.net_utils import ip_to_int, mac_to_int
+
+MAC = mac_to_int('02:00:00:00:00:01')
+IP = ip_to_int('192.168.1.120')
+
+
+class ManagerChangesTest(unittest.TestCase):
+    """Los cambios de manager.py llegan a los listeners del servidor."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(self.tmp_dir, 'leases.db')
+        config_path = os.path.join(self.tmp_dir, 'config.json')
+        with open('config/config.json') as f:
+            config = json.load(f)
+        config['lease_store'] = {'backend': 'sqlite'}
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+        self.server_db = LeaseDatabase(db_path, lock=threading.RLock())
+        self.changes = []
+        self.server_db.add_change_listener(lambda op, mac, ip, expires_at, replicated: self.changes.append((op, mac)))
+        self.manager = DHCPManager(db_path, config_path)
+
+    def tearDown(self):
+        self.manager.close()
+        self.server_db.conn.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write_import(self, lines):
+        path = os.path.join(self.tmp_dir, 'import.csv')
+        with open(path, 'w') as f:
+            f.write('mac,ip\n' + '\n'.join(lines) + '\n')
+        return path
+
+    def test_free_range_is_seen_by_server(self):
+        self.server_db.add_lease(MAC, IP, 3600)
+        self.changes.clear()
+        self.manager.free_range('192.168.1.0/24')
+        self.assertEqual(self.server_db.poll_external_changes(), 1)
+        self.assertEqual(self.changes, [(LeaseDatabase.LEASE_DELETE, MAC)])
+
+    def test_import_replaces_holder_and_is_seen_by_server(self):
+        self.server_db.add_lease(MAC, IP, 3600)
+        self.changes.clear()
+        self.manager.import_leases(self.write_import(['02:00:00:00:00:02,192.168.1.120']))
+        self.server_db.poll_external_changes()
+        self.assertEqual(self.changes, [
+            (LeaseDatabase.LEASE_DELETE, MAC),
+            (LeaseDatabase.LEASE_SET, mac_to_int('02:00:00:00:00:02')),
+        ])
+
+    def test_import_rejects_duplicate_ips(self):
+        path = self.write_import(['02:00:00:00:00:02,192.168.1.130', '02:00:00:00:00:03,192.168.1.130'])
+        with self.assertRaises(ValueError):
+            self.manager.import_leases(path)
+        self.assertIsNone(self.server_db.get_lease_holder(ip_to_int('192.168.1.130')))
+        self.assertEqual(self.server_db.poll_external_changes(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# tests/test_profiler.py
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from src.profiler import read_server_pid, remove_pid_file, write_pid_file
+
+
+class PidFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'dhcp_server.pid')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_remove_only_own_pid_file(self):
+        write_pid_file(self.path)
+        remove_pid_file(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+        with open(self.path, 'w') as f:
+            f.write('1')
+        remove_pid_file(self.path)
+        self.assertTrue(os.path.exists(self.path))
+
+    @unittest.skipUnless(os.path.isdir('/proc'), "necesita /proc")
+    def test_pid_of_other_process_is_rejected(self):
+        # El proceso de las pruebas no es src.server
+        write_pid_file(self.path)
+        self.assertIsNone(read_server_pid(self.path))
+
+    @unittest.skipUnless(os.path.isdir('/proc'), "necesita /proc")
+    def test_pid_of_running_server_is_accepted(self):
+        server = subprocess.Popen([sys.executable, '-c', 'import time; print(flush=True); time.sleep(30)', 'src.server'],
+                                  stdout=subprocess.PIPE)
+        try:
+            server.stdout.readline()  # Ya arrancado: /proc/<pid>/cmdline tiene sus argumentos
+            with open(self.path, 'w') as f:
+                f.write(str(server.pid))
+            self.assertEqual(read_server_pid(self.path), server.pid)
+        finally:
+            server.kill()
+            server.wait()
+            server.stdout.close()
+
+    def test_missing_pid_file(self):
+        self.assertIsNone(read_server_pid(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# tests/test_replication.py
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from src.database import LeaseDatabase
+from src.net_utils import ip_to_int, mac_to_int
+from src.replication import FailoverPeer
+
+MAC_A = mac_to_int('02:00:00:00:00:01')
+MAC_B = mac_to_int('02:00:00:00:00:02')
+IP = ip_to_int('192.168.1.120')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+class LoopbackFailoverTest(unittest.TestCase):
+    """Dos instancias locales replicándose por 127.0.0.1."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ports = (free_port(), free_port())
+        self.db_a = LeaseDatabase(os.path.join(self.tmp_dir, 'a.db'), lock=threading.RLock())
+        self.db_b = LeaseDatabase(os.path.join(self.tmp_dir, 'b.db'), lock=threading.RLock())
+        self.peer_a = self.make_peer(self.db_a, 'primary', self.ports[0], self.ports[1])
+        self.peer_b = self.make_peer(self.db_b, 'secondary', self.ports[1], self.ports[0])
+        for peer in (self.peer_a, self.peer_b):
+            peer.sender.retry_interval = 0.05
+            peer.sender.heartbeat_interval = 0.05
+
+    def tearDown(self):
+        for peer in (self.peer_a, self.peer_b):
+            peer.stop()
+        self.db_a.conn.close()
+        self.db_b.conn.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def make_peer(db, role, listen, peer):
+        return FailoverPeer(db, {
+            'mode': 'active-standby', 'role': role,
+            'listen': f'127.0.0.1:{listen}', 'peer': f'127.0.0.1:{peer}', 'batch_ms': 5
+        })
+
+    def test_changes_replicate_both_ways(self):
+        self.peer_a.start()
+        self.peer_b.start()
+        self.assertTrue(wait_for(lambda: self.peer_a.sender.connected and self.peer_b.sender.connected))
+        self.db_a.add_lease(MAC_A, IP, 3600)
+        self.assertTrue(wait_for(lambda: self.db_b.get_lease_holder(IP) == MAC_A))
+        self.db_b.release_lease(MAC_A)
+        self.assertTrue(wait_for(lambda: self.db_a.get_lease(MAC_A) is None))
+
+    def test_release_while_disconnected_converges(self):
+        self.db_a.add_lease(MAC_A, IP, 3600)
+        self.db_b.apply_replicated_changes([(LeaseDatabase.LEASE_SET, MAC_A, IP, self.db_a.get_lease(MAC_A)['expires_at'])])
+        # Sin conexión, el borrado queda como lápida y se envía al conectar
+        self.db_a.release_lease(MAC_A)
+        self.assertIn(MAC_A, self.peer_a.sender.tombstones)
+        self.peer_b.receiver.start()
+        self.peer_a.sender.start()
+        self.assertTrue(wait_for(lambda: self.db_b.get_lease(MAC_A) is None))
+
+
+class ReplicatedConflictTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db = LeaseDatabase(os.path.join(self.tmp_dir, 'leases.db'), lock=threading.RLock())
+        self.changes = []
+        self.db.add_change_listener(lambda *change: self.changes.append(change))
+
+    def tearDown(self):
+        self.db.conn.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_set_for_ip_held_longer_by_other_mac_is_rejected(self):
+        self.db.add_lease(MAC_A, IP, 3600)
+        expires_at = self.db.get_lease(MAC_A)['expires_at']
+        self.changes.clear()
+        self.db.apply_replicated_changes([(LeaseDatabase.LEASE_SET, MAC_B, IP, expires_at - 60)])
+        self.assertEqual(self.db.get_lease_holder(IP), MAC_A)
+        self.assertIsNone(self.db.get_lease(MAC_B))
+        self.assertEqual(self.changes, [])
+
+    def test_delete_does_not_undo_a_later_renewal(self):
+        self.db.add_lease(MAC_A, IP, 3600)
+        expires_at = self.db.get_lease(MAC_A)['expires_at']
+        self.db.apply_replicated_changes([(LeaseDatabase.LEASE_DELETE, MAC_A, IP, expires_at - 60)])
+        self.assertEqual(self.db.get_lease_holder(IP), MAC_A)
+        self.db.apply_replicated_changes([(LeaseDatabase.LEASE_DELETE, MAC_A, IP, expires_at)])
+        self.assertIsNone(self.db.get_lease_holder(IP))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# tests/test_reservations.py
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from src.net_utils import ip_to_int, mac_to_int
+from src.reservations import ReservationMap, ReservationStore
+
+STATIC_MAC = mac_to_int('02:00:00:00:00:01')
+STORED_MAC = mac_to_int('02:00:00:00:00:02')
+IP = ip_to_int('192.168.1.20')
+
+
+class ReservationMapTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = ReservationStore(os.path.join(self.tmp_dir, 'reservas.db'))
+        self.reservations = ReservationMap(self.store)
+        self.reservations.set_static({'02:00:00:00:00:01': '192.168.1.20'})
+        self.reservations.load()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def assertConsistent(self):
+        self.assertEqual(self.reservations.by_ip, {ip: mac for mac, ip in self.reservations.by_mac.items()})
+
+    def test_stored_reservation_overrides_static_ip(self):
+        self.store.upsert([(STORED_MAC, IP, None)])
+        self.assertEqual(self.reservations.refresh(), 1)
+        self.assertEqual(self.reservations.by_ip[IP], STORED_MAC)
+        self.assertNotIn(STATIC_MAC, self.reservations)
+        self.assertConsistent()
+
+    def test_static_reservation_returns_when_stored_is_removed(self):
+        self.store.upsert([(STORED_MAC, IP, None)])
+        self.reservations.refresh()
+        self.store.remove(STORED_MAC)
+        self.reservations.refresh()
+        self.assertEqual(self.reservations.get(STATIC_MAC), IP)
+        self.assertNotIn(STORED_MAC, self.reservations)
+        self.assertConsistent()
+
+    def test_refresh_swaps_indexes(self):
+        by_mac, by_ip = self.reservations.by_mac, self.reservations.by_ip
+        self.store.upsert([(STORED_MAC, IP + 1, None)])
+        self.reservations.refresh()
+        # Los lectores que ya tenían los diccionarios anteriores no los ven cambiar
+        self.assertEqual(by_mac, {STATIC_MAC: IP})
+        self.assertEqual(by_ip, {IP: STATIC_MAC})
+        self.assertEqual(self.reservations.get(STORED_MAC), IP + 1)
+        self.assertConsistent()
+
+    def test_incremental_refresh_matches_full_load(self):
+        rng = random.Random(7)
+        static = {f'02:00:00:00:01:{n:02x}': f'192.168.1.{100 + n}' for n in range(20)}
+        self.reservations.set_static(static)
+        notified = set()
+        self.reservations.add_change_listener(notified.add)
+        for _ in range(30):
+            before = dict(self.reservations.by_mac)
+            notified.clear()
+            for _ in range(rng.randint(1, 5)):
+                mac = mac_to_int(f'02:00:00:00:0{rng.choice("12")}:{rng.randrange(20):02x}')
+                if rng.random() < 0.3:
+                    self.store.remove(mac)
+                    continue
+                try:
+                    self.store.upsert([(mac, ip_to_int(f'192.168.1.{100 + rng.randrange(25)}'), None)])
+                except ValueError:
+                    pass  # IP ya reservada para otra MAC
+            self.reservations.refresh()
+            full = ReservationMap(self.store)
+            full.set_static(static)
+            full.load()
+            self.assertEqual(self.reservations.by_mac, full.by_mac)
+            self.assertConsistent()
+            changed = {mac for mac in before.keys() | full.by_mac.keys() if before.get(mac) != full.by_mac.get(mac)}
+            self.assertEqual(notified, changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+# tests/test_rogue_tracker.py
+import unittest
+from unittest import mock
+
+from src.rogue_tracker import RogueServerTracker
+
+
+class RogueServerTrackerTest(unittest.TestCase):
+    def test_tables_are_capped_by_recent_use(self):
+        db = mock.Mock()
+        tracker = RogueServerTracker(db, max_tracked_keys=3)
+        for ip in range(5):
+            tracker.observe(0x02bb00000001, ip, now=ip)
+        tracker.observe(0x02bb00000001, 2, now=10)  # La más reciente no se olvida
+        tracker.observe(0x02bb00000001, 5, now=11)
+        self.assertEqual(list(tracker.servers), [(0x02bb00000001, ip) for ip in (4, 2, 5)])
+        self.assertEqual(list(tracker.pending), list(tracker.servers))
+
+        self.assertEqual(tracker.flush(), 3)
+        db.save_rogue_servers.assert_called_once()
+
+    def test_stop_flushes_pending(self):
+        db = mock.Mock()
+        tracker = RogueServerTracker(db, flush_interval=3600)
+        tracker.start()
+        tracker.observe(0x02bb00000001, 1, now=0)
+        tracker.stop()
+        db.save_rogue_servers.assert_called_once_with([(0x02bb00000001, 1, 0, 0, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()